@@ -0,0 +1,139 @@
+"""Запуск сбора из Python-кода (asyncio) без процесса scrapy crawl и промежуточного файла.
+
+Пример:
+    import asyncio
+    from alkoteka.api import crawl
+
+    async def main():
+        async for item in crawl(cities=['Москва'], categories=['vino'], settings={'LOG_LEVEL': 'WARNING'}):
+            print(item['RPC'], item['price_data']['current'])
+
+    asyncio.run(main())
+
+Items - dict после всех pipelines (форматирование, валидация, переименование), в том же виде, что и в
+выгрузке -O. Сбор останавливается, если выйти из цикла async for (break) или закрыть итератор (aclose).
+Несколько сборов в одном процессе выполняются последовательно или одновременно в одном цикле asyncio.
+"""
+import asyncio
+import os
+import sys
+import threading
+from collections.abc import AsyncIterator, Iterable
+from typing import Any
+
+from itemadapter import ItemAdapter
+
+SPIDER_NAME = 'products_by_category'
+
+# Настройки сбора из Python-кода: items выдаются приложению, выгрузка в файл и telnet консоль не нужны
+API_SETTINGS = {
+    'FEEDS': {},
+    'TELNETCONSOLE_ENABLED': False,
+}
+
+# Признак конца сбора в очереди items
+_FINISHED = object()
+
+
+def _reactor(loop: asyncio.AbstractEventLoop):
+    """Реактор Twisted поверх цикла asyncio приложения (устанавливается и запускается один раз на процесс)"""
+    if 'twisted.internet.reactor' not in sys.modules:
+        from twisted.internet import asyncioreactor
+
+        asyncioreactor.install(eventloop=loop)
+    from twisted.internet import reactor
+    from twisted.internet.asyncioreactor import AsyncioSelectorReactor
+
+    if not isinstance(reactor, AsyncioSelectorReactor) or reactor._asyncioEventloop is not loop:
+        raise RuntimeError('alkoteka.api.crawl: реактор Twisted уже установлен не поверх текущего цикла asyncio')
+    if not reactor.running:
+        # Цикл asyncio уже работает (его запустило приложение) - реактору нужны только события запуска;
+        # reactor.run() не вызывается, поэтому реактор не останавливается между сборами
+        reactor.startRunning(installSignalHandlers=False)
+    # Реактор не получает событие shutdown (его останавливает не reactor.stop(), а закрытие цикла asyncio),
+    # поэтому пул потоков реактора (DNS, HeaderProfilePool) не останавливается: его потоки - фоновые,
+    # чтобы не мешать завершению процесса, и пул используется всеми сборами процесса
+    reactor.getThreadPool().threadFactory = _daemon_thread
+    return reactor
+
+
+def _daemon_thread(*args, **kwargs) -> threading.Thread:
+    return threading.Thread(*args, daemon=True, **kwargs)
+
+
+def project_settings(overrides: dict | None = None):
+    """Настройки проекта alkoteka (settings.py) с API_SETTINGS и overrides"""
+    os.environ.setdefault('SCRAPY_SETTINGS_MODULE', 'alkoteka.settings')
+    from scrapy.utils.project import get_project_settings
+
+    settings = get_project_settings()
+    settings.setdict({**API_SETTINGS, **(overrides or {})}, priority='cmdline')
+    return settings
+
+
+async def crawl(cities: str | Iterable[str] | None = None, categories: str | Iterable[str] | None = None, *,
+                mode: str | None = None, settings: dict | None = None, buffer: int = 1000,
+                **spider_args: Any) -> AsyncIterator[dict]:
+    """Сбор products_by_category; асинхронный итератор items (dict).
+
+    cities      - город, список городов или 'all' (по умолчанию - DEFAULT_CITY_NAME)
+    categories  - slug категорий из URLS_FILENAME (по умолчанию - все)
+    mode        - 'full' или 'listing' (только строки листинга, partial items)
+    settings    - переопределение настроек проекта (как -s NAME=VALUE)
+    buffer      - items в очереди, после которых сбор ждет, пока приложение их разберет
+    spider_args - прочие аргументы паука (как -a NAME=VALUE)
+    """
+    from scrapy import signals
+    from scrapy.crawler import CrawlerRunner
+    from twisted.internet.defer import Deferred
+
+    loop = asyncio.get_running_loop()
+    _reactor(loop)
+
+    if cities is not None and not isinstance(cities, str):
+        cities = ','.join(cities)
+    if categories is not None and not isinstance(categories, str):
+        categories = ','.join(categories)
+    args = {key: value for key, value in (('city', cities), ('categories', categories), ('mode', mode))
+            if value is not None}
+
+    queue: asyncio.Queue = asyncio.Queue()
+    # Обработка items (и загрузка страниц) ждет этих Deferred, пока очередь заполнена
+    waiters: list[Deferred] = []
+    stopped = False
+
+    def release_waiters():
+        while waiters:
+            waiters.pop().callback(None)
+
+    def item_scraped(item, response, spider):
+        if stopped:
+            return None
+        queue.put_nowait(item if isinstance(item, dict) else ItemAdapter(item).asdict())
+        if queue.qsize() < buffer:
+            return None
+        waiter = Deferred()
+        waiters.append(waiter)
+        return waiter
+
+    runner = CrawlerRunner(project_settings(settings))
+    crawler = runner.create_crawler(SPIDER_NAME)
+    crawler.signals.connect(item_scraped, signal=signals.item_scraped)
+    finished = runner.crawl(crawler, **args, **spider_args).asFuture(loop)
+    finished.add_done_callback(lambda _: queue.put_nowait(_FINISHED))
+
+    try:
+        while (item := await queue.get()) is not _FINISHED:
+            if waiters and queue.qsize() < buffer:
+                release_waiters()
+            yield item
+        # Ошибка сбора (CloseSpider в __init__ паука и т.п.)
+        await finished
+    finally:
+        if not finished.done():
+            # Выход из цикла async for до конца сбора: остановка паука и ожидание закрытия
+            stopped = True
+            release_waiters()
+            if crawler.crawling:
+                crawler.stop()
+            await asyncio.wait({finished})
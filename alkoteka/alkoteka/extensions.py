@@ -0,0 +1,304 @@
+import logging
+import os
+import signal
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+from urllib.parse import urlparse
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.httpobj import urlparse_cached
+
+from .metrics import CrawlMetrics
+from .profiling import SamplingProfiler, allocation_report, current_rss_mb
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsExporterExtension:
+    """Периодическая выгрузка CrawlMetrics в файл METRICS_PATH (Prometheus text или JSON) и строка прогресса в лог.
+
+    Дополняет метрики задержкой загрузки по типам запросов (city / listing / detail / other),
+    задержкой от постановки запроса в очередь до item, а также прогрессом и ETA: ожидаемое
+    количество товаров паук берет из total пагинации категорий (статистика progress/expected_products).
+    """
+
+    # Ключ meta: время постановки запроса в очередь
+    META_KEY = 'metrics_scheduled_at'
+
+    def __init__(self, crawler, metrics: CrawlMetrics, path: str, export_format: str, interval: float):
+        if export_format not in ('prometheus', 'json'):
+            raise NotConfigured(f"METRICS_FORMAT должен быть 'prometheus' или 'json', получено: {export_format!r}")
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.metrics = metrics
+        self.path = Path(path) if path else None
+        self.export_format = export_format
+        self.interval = interval
+        self.task = None
+        self.started_at = None
+        # Пути запросов паука: (путь_списка_городов, путь_товаров)
+        self.city_path = ''
+        self.product_path = ''
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        metrics = CrawlMetrics.from_crawler(crawler)
+        if not metrics.enabled:
+            raise NotConfigured()
+        ext = cls(crawler, metrics, settings.get('METRICS_PATH'), settings.get('METRICS_FORMAT', 'prometheus'),
+                  settings.getfloat('METRICS_INTERVAL', 30))
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(ext.request_scheduled, signal=signals.request_scheduled)
+        crawler.signals.connect(ext.response_received, signal=signals.response_received)
+        crawler.signals.connect(ext.item_scraped, signal=signals.item_scraped)
+        return ext
+
+    def spider_opened(self, spider):
+        self.started_at = time.time()
+        params = (spider.settings.get('PARSING_PARAMS') or {}).get(spider.name) or {}
+        self.city_path = urlparse(params.get('CITY_URL') or '').path.rstrip('/')
+        self.product_path = urlparse(params.get('PRODUCT_URL') or '').path.rstrip('/')
+        if self.interval > 0:
+            from twisted.internet import task
+
+            self.task = task.LoopingCall(self.export, spider)
+            self.task.start(self.interval, now=False)
+
+    def spider_closed(self, spider, reason):
+        if self.task is not None and self.task.running:
+            self.task.stop()
+        self.export(spider)
+
+    def endpoint(self, request) -> str:
+        path = urlparse_cached(request).path.rstrip('/')
+        if self.city_path and path == self.city_path:
+            return 'city'
+        if self.product_path and path == self.product_path:
+            return 'listing'
+        if self.product_path and path.startswith(self.product_path + '/'):
+            return 'detail'
+        return 'other'
+
+    def request_scheduled(self, request, spider):
+        # setdefault: повторы (retry) сохраняют время первой постановки
+        request.meta.setdefault(self.META_KEY, time.time())
+
+    def response_received(self, response, request, spider):
+        latency = request.meta.get('download_latency')
+        if latency is not None:
+            self.metrics.observe('download_seconds', latency, self.endpoint(request))
+
+    def item_scraped(self, item, response, spider):
+        scheduled_at = response.meta.get(self.META_KEY) if response is not None else None
+        if scheduled_at is not None:
+            self.metrics.observe('request_to_item_seconds', time.time() - scheduled_at)
+
+    def update_progress(self):
+        """Прогресс и ETA по ожидаемому количеству строк листинга"""
+        stats = self.stats
+        elapsed = time.time() - (self.started_at or time.time())
+        items = stats.get_value('item_scraped_count', 0)
+        # Строки листинга, которые уже не дадут item: отброшенные и объединенные товары
+        done = (items + stats.get_value('item_dropped_count', 0)
+                + stats.get_value('dedup/coalesced', 0) + stats.get_value('dedup/after_emit', 0))
+        expected = stats.get_value('progress/expected_products')
+
+        progress = eta = None
+        if expected:
+            progress = min(done / expected, 1.0)
+            if done:
+                eta = max(expected - done, 0) * elapsed / done
+
+        self.metrics.set_gauge('elapsed_seconds', round(elapsed, 1))
+        self.metrics.set_gauge('items', items)
+        self.metrics.set_gauge('requests', stats.get_value('downloader/request_count', 0))
+        self.metrics.set_gauge('pending_requests',
+                               stats.get_value('scheduler/enqueued', 0) - stats.get_value('scheduler/dequeued', 0))
+        self.metrics.set_gauge('expected_products', expected)
+        self.metrics.set_gauge('progress_ratio', round(progress, 4) if progress is not None else None)
+        self.metrics.set_gauge('eta_seconds', round(eta, 1) if eta is not None else None)
+        return items, elapsed, progress, eta
+
+    def export(self, spider):
+        items, elapsed, progress, eta = self.update_progress()
+
+        msg = f'Собрано {items} items за {elapsed / 60:.1f} мин'
+        if progress is not None:
+            msg += f', прогресс {progress:.1%}'
+        if eta is not None:
+            msg += f', осталось ~{eta / 60:.1f} мин'
+        logger.info(msg)
+
+        if self.path is None:
+            return
+        text = self.metrics.to_prometheus() if self.export_format == 'prometheus' else self.metrics.to_json()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(self.path.suffix + '.tmp')
+        tmp_path.write_text(text, encoding='utf-8')
+        os.replace(tmp_path, self.path)
+
+
+class ProfilingExtension:
+    """Режим профилирования (PROFILING_ENABLED): статистический профилировщик CPU потока реактора
+    и снимки tracemalloc. Время и память распределяются по категориям кода (callbacks паука, loaders,
+    extractors, валидация, middlewares, pipelines и т.д.).
+
+    Отчет пишется в PROFILING_DIR при закрытии паука и по сигналу PROFILING_SIGNAL
+    (kill -USR1 <pid>); в отчете по сигналу есть и рост памяти с предыдущего отчета.
+    """
+
+    def __init__(self, crawler, path: str, interval: float, tracemalloc_frames: int, signal_name: str | None,
+                 top: int):
+        self.crawler = crawler
+        self.path = Path(path)
+        self.profiler = SamplingProfiler(interval)
+        self.tracemalloc_frames = tracemalloc_frames
+        self.signal_name = signal_name
+        self.top = top
+        self.started_tracemalloc = False
+        self.previous_snapshot = None
+        self.previous_handler = None
+        self.started_at = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('PROFILING_ENABLED'):
+            raise NotConfigured()
+        ext = cls(crawler, settings.get('PROFILING_DIR'), settings.getfloat('PROFILING_INTERVAL', 0.01),
+                  settings.getint('PROFILING_TRACEMALLOC_FRAMES', 1), settings.get('PROFILING_SIGNAL'),
+                  settings.getint('PROFILING_TOP', 25))
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_opened(self, spider):
+        self.started_at = time.time()
+        # 0 - без tracemalloc (только CPU)
+        if self.tracemalloc_frames > 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(self.tracemalloc_frames)
+            self.started_tracemalloc = True
+        self.profiler.start()
+        self.install_signal()
+        logger.info(f'Профилирование включено, отчеты: {self.path}')
+
+    def spider_closed(self, spider, reason):
+        self.restore_signal()
+        self.profiler.stop()
+        self.dump(spider, reason)
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+
+    def install_signal(self):
+        signum = getattr(signal, self.signal_name or '', None)
+        # Обработчик сигнала можно установить только из главного потока
+        if signum is None or threading.current_thread() is not threading.main_thread():
+            return
+        from twisted.internet import reactor
+
+        self.previous_handler = signal.signal(
+            signum, lambda *_: reactor.callFromThread(self.dump, self.crawler.spider, 'signal'))
+
+    def restore_signal(self):
+        if self.previous_handler is not None:
+            signal.signal(getattr(signal, self.signal_name), self.previous_handler)
+            self.previous_handler = None
+
+    def dump(self, spider, reason: str):
+        elapsed = time.time() - (self.started_at or time.time())
+        rss = current_rss_mb()
+        sections = [f'Паук: {spider.name}, причина: {reason}, прошло {elapsed:.1f} сек'
+                    + (f', RSS {rss:.0f} МБ' if rss is not None else ''),
+                    self.profiler.report(self.top)]
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            sections.append(f'tracemalloc: сейчас {current / 1024 / 1024:.1f} МБ, пик {peak / 1024 / 1024:.1f} МБ')
+            sections.append(allocation_report(snapshot, self.top))
+            if self.previous_snapshot is not None:
+                sections.append(allocation_report(snapshot, self.top, previous=self.previous_snapshot))
+            self.previous_snapshot = snapshot
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        path = self.path / f'profile-{spider.name}-{time.strftime("%Y%m%d-%H%M%S")}-{reason}.txt'
+        path.write_text('\n\n'.join(sections) + '\n', encoding='utf-8')
+        logger.info(f'Отчет профилирования: {path}')
+
+
+class MemoryWatchdogExtension:
+    """Сторож памяти: когда RSS процесса превышает MEMORY_WATCHDOG_RSS_MB, в лог пишутся места
+    наибольших выделений памяти.
+
+    Если tracemalloc уже работает (PROFILING_ENABLED), отчет пишется сразу. Иначе tracemalloc
+    включается только при превышении порога, при следующей проверке в лог попадает рост памяти
+    с этого момента, и tracemalloc снова выключается. Следующий порог - на MEMORY_WATCHDOG_STEP_MB выше.
+    """
+
+    def __init__(self, crawler, threshold_mb: float, step_mb: float, interval: float, top: int):
+        self.stats = crawler.stats
+        self.threshold_mb = threshold_mb
+        self.step_mb = step_mb
+        self.interval = interval
+        self.top = top
+        self.task = None
+        self.started_tracemalloc = False
+        # Снимок в момент превышения порога, если tracemalloc включен сторожем
+        self.baseline = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        threshold_mb = settings.getfloat('MEMORY_WATCHDOG_RSS_MB', 0)
+        if threshold_mb <= 0:
+            raise NotConfigured()
+        if current_rss_mb() is None:
+            raise NotConfigured('MemoryWatchdogExtension: RSS процесса недоступен на этой платформе')
+        ext = cls(crawler, threshold_mb, settings.getfloat('MEMORY_WATCHDOG_STEP_MB', 256),
+                  settings.getfloat('MEMORY_WATCHDOG_INTERVAL', 10), settings.getint('MEMORY_WATCHDOG_TOP', 15))
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_opened(self, spider):
+        from twisted.internet import task
+
+        self.task = task.LoopingCall(self.check)
+        self.task.start(self.interval, now=True)
+
+    def spider_closed(self, spider, reason):
+        if self.task is not None and self.task.running:
+            self.task.stop()
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+
+    def check(self):
+        rss = current_rss_mb()
+        self.stats.max_value('memory_watchdog/peak_rss_mb', round(rss))
+
+        if self.baseline is not None:
+            logger.warning(f'RSS {rss:.0f} МБ\n'
+                           + allocation_report(tracemalloc.take_snapshot(), self.top, previous=self.baseline))
+            self.baseline = None
+            # tracemalloc замедляет выделения памяти: выключается до следующего превышения порога
+            tracemalloc.stop()
+            self.started_tracemalloc = False
+        if rss < self.threshold_mb:
+            return
+
+        self.stats.inc_value('memory_watchdog/triggers')
+        logger.warning(f'RSS {rss:.0f} МБ превысил порог {self.threshold_mb:.0f} МБ')
+        self.threshold_mb += self.step_mb
+        if tracemalloc.is_tracing():
+            if not self.started_tracemalloc:
+                logger.warning(allocation_report(tracemalloc.take_snapshot(), self.top))
+                return
+        else:
+            tracemalloc.start()
+            self.started_tracemalloc = True
+        # Рост памяти с этого момента - при следующей проверке
+        self.baseline = tracemalloc.take_snapshot()
@@ -0,0 +1,218 @@
+import math
+import time
+from typing import Any, Callable
+
+from ..items import (
+    AlkotekaItem, AssetsNestedItem, StockNestedItem, PriceDataNestedItem, MetadataPBCNestedItem
+)
+
+
+def _names(block: dict) -> list:
+    return [value["name"] for value in block["values"]]
+
+
+def _range(block: dict) -> dict:
+    return {'min': block["min"], 'max': block["max"], 'unit': block["unit"]}
+
+
+def _serving_temp(block: dict) -> dict:
+    return {'values': [str(value["name"]) for value in block["values"]], 'unit': block["unit"]}
+
+
+def _put_str(fields: dict, field: str, value: Any):
+    """Строковое поле как MapCompose(str.strip) + TakeFirst(): None и пустые строки не попадают в item"""
+    if value is not None:
+        value = str.strip(value)
+        if value != '':
+            fields[field] = value
+
+
+class ProductsByCategoryExtractor:
+    """Сборка AlkotekaItem для ProductsByCategorySpider за один проход по JSON, без ItemLoader.
+
+    Результат совпадает с результатом загрузчиков из loaders/products_by_category_loaders.py
+    (те же классы item, поля, значения и порядок полей), проверка - bench/diff_extractors.py.
+    """
+
+    # code блока description_blocks (в нижнем регистре) = (поле metadata, значение блока, только первый блок)
+    # Для полей-списков значения одинаковых блоков объединяются (Identity() в MetadataPBCLoader),
+    # для остальных берется значение первого блока (TakeFirst())
+    DESCRIPTION_BLOCKS: dict[str, tuple[str, Callable[[dict], Any], bool]] = {
+        'cvet': ('color', _names, False),
+        'obem': ('litres', _range, True),
+        'ves': ('weight', _range, True),
+        'strana': ('country', _names, False),
+        'region': ('region', _names, False),
+        'krepost': ('strength', _range, True),
+        'vid': ('type_', _names, False),
+        'proizvoditel': ('manufacturer', _names, False),
+        'soderzanie-saxara': ('sugar', _names, False),
+        'temperatura-podaci': ('serving_temp', _serving_temp, True),
+        'sortovoi-sostav': ('sort_', _names, False),
+        'prodolzitelnost-vyderzki': ('exposure_time', _names, False),
+        'emkost-vyderzki': ('exposure_container', _names, False),
+        'filtration': ('filtration', _names, False),
+        'vid-upakovki': ('type_container', _names, False),
+    }
+    BRAND_CODE = 'brend'
+    GIFT_PACKAGE_CODE = 'podarocnaya-upakovka'
+
+    def listing_fields(self, product: dict, city_name: str) -> dict:
+        """Поля item из строки листинга"""
+        fields = {'timestamp': int(time.time())}
+        _put_str(fields, 'city', city_name)
+        if product['vendor_code'] is not None:
+            _put_str(fields, 'RPC', str(product['vendor_code']))
+        _put_str(fields, 'url', product['product_url'])
+        _put_str(fields, 'title', product['name'])
+        marketing_tags = [label['title'] for label in product["action_labels"]]
+        if marketing_tags:
+            fields['marketing_tags'] = marketing_tags
+        return fields
+
+    def detail_fields(self, data: dict) -> dict:
+        """Поля item со страницы товара (results)"""
+        return self.combine(self.static_fields(data), self.volatile_fields(data))
+
+    def static_fields(self, data: dict) -> dict:
+        """Не зависящие от города поля страницы товара (JSON-совместимый dict для ProductStaticCache)"""
+        fields = {}
+
+        metadata = {}
+        description = None
+        if data["text_blocks"]:
+            for desc in data["text_blocks"]:
+                if desc["title"].lower() == 'описание':
+                    description = desc["content"]
+        _put_str(metadata, 'description', description)
+        if data["vendor_code"] is not None:
+            metadata['vendor_code'] = int(data["vendor_code"])
+
+        # Один проход по description_blocks: бренд, подарочная упаковка и поля metadata
+        brand = None
+        gift_package = False
+        for block in data["description_blocks"]:
+            code = block["code"].lower()
+            rule = self.DESCRIPTION_BLOCKS.get(code)
+            if rule is not None:
+                field, get_value, first_only = rule
+                value = get_value(block)
+                if first_only:
+                    metadata.setdefault(field, value)
+                elif value:
+                    metadata.setdefault(field, []).extend(value)
+            elif code == self.BRAND_CODE:
+                if brand is None:
+                    brand = ';'.join(_names(block))
+            elif code == self.GIFT_PACKAGE_CODE:
+                gift_package = True
+
+        metadata['gift_package'] = gift_package
+        _put_str(metadata, 'subname', data["subname"])
+
+        if data["gastronomics"]:
+            gastronomics = [g["title"] for v in data["gastronomics"].values() for g in v]
+            if gastronomics:
+                metadata['gastronomics'] = gastronomics
+
+        _put_str(fields, 'brand', brand)
+        fields['section'] = [data["category"]["parent"]["name"], *(flabel["title"] for flabel in data["filter_labels"])]
+
+        assets = {}
+        _put_str(assets, 'main_image', data["image_url"])
+        fields['assets'] = assets
+        fields['metadata'] = metadata
+        return fields
+
+    def volatile_fields(self, data: dict, with_stores: bool = True) -> dict:
+        """Зависящие от города поля: цена, наличие и магазины (строка листинга тоже подходит при with_stores=False)"""
+        stores = None
+        if with_stores:
+            stores = [{
+                'address': store["title"],
+                'phone': store["phone"],
+                'opening_hours': store["opening_hours"],
+                'longitude': store["longitude"],
+                'latitude': store["latitude"],
+                'price': store["price"],
+                'quantity': store["quantity"]
+            } for store in data["availability"]["stores"]]
+        return {'price_data': self.price_data(data), 'stock': self.stock(data), 'stores_list': stores}
+
+    def combine(self, static: dict, volatile: dict) -> dict:
+        """Поля item со страницы товара из static_fields и volatile_fields (в порядке полей загрузчиков)"""
+        fields = {}
+        if 'brand' in static:
+            fields['brand'] = static['brand']
+        fields['section'] = list(static['section'])
+        fields['price_data'] = volatile['price_data']
+        fields['stock'] = volatile['stock']
+        fields['assets'] = AssetsNestedItem(static['assets'])
+
+        # stores_list - между subname и gastronomics
+        stores = volatile['stores_list']
+        metadata = {}
+        for field, value in static['metadata'].items():
+            if field == 'gastronomics' and stores:
+                metadata['stores_list'] = stores
+            metadata[field] = value
+        if stores and 'stores_list' not in metadata:
+            metadata['stores_list'] = stores
+        fields['metadata'] = MetadataPBCNestedItem(metadata)
+
+        fields['variants'] = 0
+        return fields
+
+    def price_data(self, data: dict) -> PriceDataNestedItem:
+        price_data = {}
+        price = data.get("price")
+        prev_price = data.get("prev_price")
+        if price is not None:
+            price_data['current'] = float(price)
+        if prev_price is not None:
+            price_data['original'] = float(prev_price)
+        if price and prev_price:
+            _put_str(price_data, 'sale_tag', str(100 - math.floor(price * 100 / prev_price)))
+        return PriceDataNestedItem(price_data)
+
+    def stock(self, data: dict) -> StockNestedItem:
+        quantity = data.get("quantity_total")
+        stock = {'in_stock': quantity != 0}
+        if quantity is not None:
+            stock['count'] = int(quantity)
+        return StockNestedItem(stock)
+
+    @staticmethod
+    def listing_category(product: dict) -> dict:
+        """Корневая категория товара из строки листинга ({'slug': ..., 'name': ...}; {} - категории в строке нет)"""
+        category = product.get("category") or {}
+        return category.get("parent") or category
+
+    def listing_item(self, listing: dict, product: dict) -> AlkotekaItem:
+        """item только из строки листинга, без страницы товара (partial): цена, наличие и section - из строки листинга,
+        поля, которых в листинге нет (бренд, описание, характеристики, магазины), остаются пустыми"""
+        # Цены или остатка нет в строке листинга - поле None, а не значения по умолчанию (0 и "нет в наличии")
+        price_data = None
+        if product.get("price") is not None:
+            price_data = self.price_data(product)
+        stock = self.stock(product) if product.get("quantity_total") is not None else None
+
+        section = []
+        category_name = self.listing_category(product).get("name")
+        if category_name:
+            section.append(category_name)
+        section.extend(flabel["title"] for flabel in product.get("filter_labels") or ())
+
+        assets = {}
+        _put_str(assets, 'main_image', product.get("image_url"))
+        metadata = {}
+        if product['vendor_code'] is not None:
+            metadata['vendor_code'] = int(product['vendor_code'])
+        _put_str(metadata, 'subname', product.get("subname"))
+        return AlkotekaItem({**listing, 'section': section, 'price_data': price_data, 'stock': stock,
+                             'assets': AssetsNestedItem(assets), 'metadata': MetadataPBCNestedItem(metadata),
+                             'variants': 0, 'partial': True})
+
+    def item(self, listing: dict, detail: dict) -> AlkotekaItem:
+        """item из полей листинга и полей страницы товара (в том числе сохраненных в ProductStateStore)"""
+        return AlkotekaItem({**listing, **detail})
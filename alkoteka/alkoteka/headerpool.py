@@ -0,0 +1,92 @@
+import threading
+from collections import deque
+from typing import Callable
+
+from twisted.internet import threads
+
+
+class HeaderProfilePool:
+    """Запас заранее сгенерированных наборов заголовков браузера и их закрепление за сессиями.
+
+    Сессия (прокси или явный ключ) использует один набор заголовков sticky_requests запросов подряд,
+    как один реальный браузер. Запас пополняется в отдельном потоке, когда в нем остается меньше
+    половины от size, поэтому генерация не выполняется на потоке реактора при обработке запросов.
+    ready - наборы прошлого запуска (HeaderProfileCache, в том числе пустой список): запас не генерируется
+    при создании, а сразу пополняется в отдельном потоке, если наборов меньше половины от size.
+    """
+
+    def __init__(self, generate: Callable[[], dict], size: int = 50, sticky_requests: int = 100,
+                 ready: list[dict] | None = None):
+        self.generate = generate
+        self.size = max(size, 1)
+        self.sticky_requests = max(sticky_requests, 1)
+        # Генератор не рассчитан на вызовы из нескольких потоков одновременно
+        self._lock = threading.Lock()
+        self._refilling = False
+        self.ready: deque[dict] = deque(ready[:self.size] if ready is not None else self._generate_batch(self.size))
+        # Сессия = [набор заголовков, осталось запросов]
+        self.sessions: dict[str, list] = {}
+        # Наборов, сгенерированных на потоке реактора из-за пустого запаса
+        self.generated_inline = 0
+        if len(self.ready) < self.size // 2:
+            self.refill()
+
+    def _generate_batch(self, count: int) -> list[dict]:
+        batch = []
+        for _ in range(count):
+            # Блокировка на каждый набор: набор на потоке реактора не ждет всю пачку пополнения
+            with self._lock:
+                batch.append(self.generate())
+        return batch
+
+    def take(self) -> dict:
+        """Новый набор заголовков из запаса"""
+        if self.ready:
+            profile = self.ready.popleft()
+        else:
+            self.generated_inline += 1
+            profile = self._generate_batch(1)[0]
+        if len(self.ready) < self.size // 2:
+            self.refill()
+        return profile
+
+    def _fill(self, count: int):
+        for _ in range(count):
+            with self._lock:
+                profile = self.generate()
+            # Набор доступен сразу, не дожидаясь всей пачки (append и popleft у deque потокобезопасны)
+            self.ready.append(profile)
+
+    def refill(self):
+        """Пополнение запаса до size в отдельном потоке"""
+        if self._refilling:
+            return
+        self._refilling = True
+
+        def done(_):
+            self._refilling = False
+
+        def failed(failure):
+            self._refilling = False
+            return failure
+
+        threads.deferToThread(self._fill, self.size - len(self.ready)).addCallbacks(done, failed)
+
+    def pending(self, session: str) -> bool:
+        """Сессии нужен новый набор, запас пуст, но набор уже генерируется в потоке пополнения"""
+        if self.ready or not self._refilling:
+            return False
+        entry = self.sessions.get(session)
+        return entry is None or entry[1] <= 0
+
+    def headers_for(self, session: str) -> dict:
+        """Набор заголовков сессии (новый - после sticky_requests запросов)"""
+        entry = self.sessions.get(session)
+        if entry is None or entry[1] <= 0:
+            entry = self.sessions[session] = [self.take(), self.sticky_requests]
+        entry[1] -= 1
+        return entry[0]
+
+    def discard(self, session: str) -> bool:
+        """Сброс набора заголовков сессии (после бана); True - набор был"""
+        return self.sessions.pop(session, None) is not None
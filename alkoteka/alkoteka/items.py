@@ -31,6 +31,7 @@ class MetadataNestedItem(scrapy.Item):
 
 class AlkotekaItem(scrapy.Item):
     timestamp = scrapy.Field()          # Дата и время сбора товара в формате timestamp
+    city = scrapy.Field()               # город, для которого собраны цена и наличие
     RPC = scrapy.Field()                # артикул
     url = scrapy.Field()                # follow ссылка на товар |response.url|
     title = scrapy.Field()              # название
@@ -42,6 +43,7 @@ class AlkotekaItem(scrapy.Item):
     assets = scrapy.Field()         # NESTED
     metadata = scrapy.Field()       # NESTED
     variants = scrapy.Field()
+    partial = scrapy.Field()            # True - item только из строки листинга (-a mode=listing)
 
 
 class MetadataPBCNestedItem(MetadataNestedItem):
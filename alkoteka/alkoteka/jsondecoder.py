@@ -0,0 +1,70 @@
+import importlib
+import json
+from typing import Any, Callable
+
+from scrapy.exceptions import NotConfigured
+
+
+# Ответ еще не декодирован
+_MISSING = object()
+
+
+def _orjson_loads() -> Callable[[bytes], Any]:
+    return importlib.import_module('orjson').loads
+
+
+def _msgspec_loads() -> Callable[[bytes], Any]:
+    return importlib.import_module('msgspec.json').Decoder().decode
+
+
+class JSONDecoder:
+    """Декодирование JSON ответов через orjson / msgspec (если установлены) или стандартный json.
+
+    Результат (или ошибка декодирования) сохраняется в атрибуте response, поэтому middleware и callback
+    паука, получающие один и тот же response, декодируют тело ответа только один раз.
+    """
+
+    # Название бэкенда = функция, возвращающая loads(bytes) (ImportError - бэкенд не установлен)
+    BACKENDS: dict[str, Callable[[], Callable[[bytes], Any]]] = {
+        'orjson': _orjson_loads,
+        'msgspec': _msgspec_loads,
+        'json': lambda: json.loads,
+    }
+    # Порядок выбора бэкенда для JSON_DECODER = 'auto'
+    AUTO_ORDER = ('orjson', 'msgspec', 'json')
+
+    # Атрибут response с декодированным JSON или ValueError
+    CACHE_ATTR = 'decoded_json'
+
+    def __init__(self, backend: str = 'auto'):
+        if backend != 'auto' and backend not in self.BACKENDS:
+            raise NotConfigured(f'Неизвестный JSON_DECODER: {backend!r}, '
+                                f'допустимые значения: auto, {", ".join(self.BACKENDS)}')
+
+        for name in (self.AUTO_ORDER if backend == 'auto' else (backend,)):
+            try:
+                self.loads = self.BACKENDS[name]()
+            except ImportError:
+                continue
+            self.name = name
+            break
+        else:
+            raise NotConfigured(f'JSON_DECODER {backend!r} не установлен')
+
+    @classmethod
+    def from_settings(cls, settings) -> 'JSONDecoder':
+        return cls(settings.get('JSON_DECODER', 'auto'))
+
+    def decode(self, response) -> Any:
+        """JSON тела ответа (ValueError - тело ответа не JSON)"""
+        data = getattr(response, self.CACHE_ATTR, _MISSING)
+        if data is _MISSING:
+            try:
+                data = self.loads(response.body)
+            except Exception as e:
+                # Ошибка тоже сохраняется: middleware и паук не декодируют невалидное тело повторно
+                data = e if isinstance(e, ValueError) else ValueError(str(e))
+            setattr(response, self.CACHE_ATTR, data)
+        if isinstance(data, ValueError):
+            raise data
+        return data
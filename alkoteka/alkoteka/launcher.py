@@ -0,0 +1,507 @@
+"""Сбор в несколько процессов: работа делится на шарды (категории из links.txt, части страниц
+больших категорий, группы городов), шарды выполняются в workers процессах Scrapy, результаты
+шардов объединяются в один файл.
+
+Один процесс Scrapy использует одно ядро (реактор, callbacks паука и pipelines в одном потоке),
+поэтому на машине с несколькими ядрами сбор ускоряется почти пропорционально количеству процессов,
+пока не упирается в предел скорости сайта и прокси. Этот предел общий для всех процессов:
+RATE_BUDGET_PER_PROXY и RATE_BUDGET_PER_DOMAIN (RateBudgetDownloaderMiddleware).
+
+Пример:
+    python -m alkoteka.launcher -a city=all -O output/result.json --workers 16 --page-stripes 4
+"""
+import argparse
+import json
+import logging
+import math
+import multiprocessing
+import os
+import shutil
+import time
+from collections import deque
+from multiprocessing.connection import wait
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+SPIDER_NAME = 'products_by_category'
+
+
+class Shard:
+    """Часть сбора: категории, города и часть страниц категорий (page_stripe из page_stripes)"""
+
+    __slots__ = ('index', 'categories', 'cities', 'page_stripe', 'page_stripes')
+
+    def __init__(self, index: int, categories: list[str], cities: str, page_stripe: int = 0, page_stripes: int = 1):
+        self.index = index
+        self.categories = categories
+        self.cities = cities
+        self.page_stripe = page_stripe
+        self.page_stripes = page_stripes
+
+    @property
+    def name(self) -> str:
+        return f'shard-{self.index:04d}'
+
+    def spider_args(self, per_page: int | None, extra: dict | None = None) -> dict:
+        """Аргументы паука шарда; extra - остальные аргументы -a (mode=... и т.п.), одинаковые для всех шардов"""
+        args = {**(extra or {}), 'city': self.cities, 'categories': ','.join(self.categories)}
+        if self.page_stripes > 1:
+            args['page_stripe'] = f'{self.page_stripe}/{self.page_stripes}'
+        if per_page:
+            args['per_page'] = str(per_page)
+        return args
+
+    def __repr__(self):
+        stripe = f' страницы {self.page_stripe}/{self.page_stripes}' if self.page_stripes > 1 else ''
+        return f'{self.name} ({",".join(self.categories)}; {self.cities}{stripe})'
+
+
+def plan_shards(categories: list[str], cities: list[str], page_stripes: dict[str, int], default_stripes: int,
+                cities_per_shard: int | None) -> list[Shard]:
+    """Шарды: категория x группа городов x часть страниц.
+
+    Порядок чередует категории, чтобы части одной большой категории не ждали друг друга в конце очереди.
+    """
+    size = cities_per_shard or len(cities) or 1
+    city_groups = [','.join(cities[start:start + size]) for start in range(0, len(cities), size)] or ['all']
+
+    units = []
+    for slug in categories:
+        stripes = max(page_stripes.get(slug, default_stripes), 1)
+        units.append([(slug, cities, stripe, stripes) for stripe in range(stripes) for cities in city_groups])
+
+    shards = []
+    while any(units):
+        for category_units in units:
+            if category_units:
+                slug, cities, stripe, stripes = category_units.pop(0)
+                shards.append(Shard(len(shards) + 1, [slug], cities, stripe, stripes))
+    return shards
+
+
+def run_shard(spider_args: dict, overrides: dict, budget, result_path: str):
+    """Процесс сбора одного шарда (multiprocessing, spawn)"""
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.utils.project import get_project_settings
+
+    from .ratebudget import RateBudget
+
+    RateBudget.shared = budget
+    settings = get_project_settings()
+    for key, value in overrides.items():
+        settings.set(key, value, priority='cmdline')
+
+    process = CrawlerProcess(settings, install_root_handler=bool(settings.get('LOG_FILE')))
+    crawler = process.create_crawler(SPIDER_NAME)
+    process.crawl(crawler, **spider_args)
+    process.start()
+
+    stats = crawler.stats.get_stats() if crawler.stats else {}
+    result = {
+        'finish_reason': stats.get('finish_reason'),
+        'items': stats.get('item_scraped_count', 0),
+        'errors': stats.get('log_count/ERROR', 0),
+    }
+    Path(result_path).write_text(json.dumps(result, ensure_ascii=False), encoding='utf-8')
+
+
+class ShardMerger:
+    """Объединение выгрузок шардов (JSON lines) в один файл.
+
+    Товар из нескольких категорий, попавших в разные шарды, выдается каждым из них: остается первый
+    item, а в его section добавляются названия всех категорий товара (как при DEDUP_PRODUCTS в одном
+    процессе) по сведениям шардов (SHARD_MANIFEST_PATH). Таблицы магазинов шардов (STORES_OUTPUT =
+    'normalized') объединяются по store_id, при нескольких городах items раскладываются по файлам
+    городов (CITY_PARTITION_DIR).
+    """
+
+    def __init__(self, settings, shards: list[Shard], workdir: Path):
+        from .pipelines import compile_rename_rules, renamed_field
+
+        self.settings = settings
+        self.shards = shards
+        self.workdir = workdir
+        rules = compile_rename_rules(settings.getdict('RENAME_PATTERN').get(SPIDER_NAME) or {})
+        self.city_field, _ = renamed_field(rules, 'city')
+        self.rpc_field, _ = renamed_field(rules, 'RPC')
+        self.section_field, _ = renamed_field(rules, 'section')
+        self.merged_duplicates = 0
+
+    def path(self, shard: Shard, suffix: str) -> Path:
+        return self.workdir / f'{shard.name}{suffix}'
+
+    def load_manifests(self) -> tuple[dict, dict]:
+        """(названия категорий, Город|RPC=[slug_категории, ...] для товаров из нескольких шардов)"""
+        category_names = {}
+        products = {}
+        shards_by_key = {}
+        for shard in self.shards:
+            try:
+                manifest = json.loads(self.path(shard, '.manifest.json').read_text(encoding='utf-8'))
+            except (OSError, ValueError):
+                continue
+            for slug, name in manifest.get('category_names', {}).items():
+                category_names.setdefault(slug, name)
+            for key, slugs in manifest.get('products', {}).items():
+                shards_by_key[key] = shards_by_key.get(key, 0) + 1
+                merged = products.setdefault(key, [])
+                merged.extend(slug for slug in slugs if slug not in merged)
+        duplicates = {key: slugs for key, slugs in products.items() if shards_by_key[key] > 1}
+        return category_names, duplicates
+
+    def merge_section(self, item: dict, slugs: list[str], category_names: dict):
+        """Названия категорий товара в section (в том же порядке, что и в ProductsByCategorySpider.finish_product)"""
+        section = item.get(self.section_field)
+        if not isinstance(section, list):
+            return
+        position = 1
+        for slug in slugs:
+            name = category_names.get(slug)
+            if name is None:
+                continue
+            if name in section:
+                position = max(position, section.index(name) + 1)
+            else:
+                section.insert(position, name)
+                position += 1
+
+    def merge(self, output: str, append: bool = False, snapshot=None) -> int:
+        """Запись items всех шардов в output (.json - JSON-массив, иначе JSON lines); возвращает количество items.
+
+        snapshot - SnapshotStore с начатым запуском: items добавляются в историю цен и наличия
+        (изменившиеся - также в SNAPSHOT_DELTA_PATH)
+        """
+        category_names, duplicates = self.load_manifests()
+        partition_dir = self.settings.get('CITY_PARTITION_DIR')
+        cities = {city for shard in self.shards for city in shard.cities.split(',')}
+        partitions = CityPartitions(partition_dir, self.settings.get('CITY_PARTITION_FORMAT', 'json')) \
+            if partition_dir and (len(cities) > 1 or 'all' in cities) else None
+        delta_path = self.settings.get('SNAPSHOT_DELTA_PATH') if snapshot is not None else None
+        delta = JsonWriter(Path(delta_path), lines=True) if delta_path else None
+        # Разбор строк нужен только для объединения дубликатов, раскладки по городам и истории
+        parse = bool(duplicates) or partitions is not None or snapshot is not None
+
+        written = set()
+        count = 0
+        output_path = Path(output)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        writer = JsonWriter(output_path, append)
+        try:
+            for shard in self.shards:
+                path = self.path(shard, '.jsonl')
+                if not path.exists():
+                    continue
+                with open(path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        line = line.rstrip('\n')
+                        if not line:
+                            continue
+                        item = None
+                        if parse:
+                            item = json.loads(line)
+                            key = f'{item.get(self.city_field)}|{item.get(self.rpc_field)}'
+                            slugs = duplicates.get(key)
+                            if slugs is not None:
+                                if key in written:
+                                    self.merged_duplicates += 1
+                                    continue
+                                written.add(key)
+                                self.merge_section(item, slugs, category_names)
+                                line = json.dumps(item, ensure_ascii=False)
+                        writer.write(line)
+                        if partitions is not None:
+                            partitions.write(item.get(self.city_field) or 'unknown', line)
+                        if snapshot is not None and snapshot.add(item) and delta is not None:
+                            delta.write(line)
+                        count += 1
+        finally:
+            writer.close()
+            if delta is not None:
+                delta.close()
+            if partitions is not None:
+                partitions.close()
+
+        if self.settings.get('STORES_OUTPUT', 'embedded') == 'normalized':
+            self.merge_stores(self.settings.get('STORES_TABLE_PATH'))
+        return count
+
+    def merge_stores(self, table_path: str):
+        stores = {}
+        for shard in self.shards:
+            try:
+                shard_stores = json.loads(self.path(shard, '.stores.json').read_text(encoding='utf-8'))
+            except (OSError, ValueError):
+                continue
+            for store in shard_stores:
+                stores.setdefault(store['store_id'], store)
+        path = Path(table_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(list(stores.values()), ensure_ascii=False, indent=2), encoding='utf-8')
+        os.replace(tmp_path, path)
+
+
+class JsonWriter:
+    """Запись готовых JSON-строк items: JSON-массив (.json, как JsonItemExporter) или JSON lines"""
+
+    def __init__(self, path: Path, append: bool = False, lines: bool | None = None):
+        self.lines = path.suffix.lower() != '.json' if lines is None else lines
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(path, 'a' if append and self.lines else 'w', encoding='utf-8')
+        self.first = True
+        if not self.lines:
+            self.file.write('[')
+
+    def write(self, line: str):
+        if self.lines:
+            self.file.write(line + '\n')
+            return
+        self.file.write(('\n' if self.first else ',\n') + line)
+        self.first = False
+
+    def close(self):
+        if not self.lines:
+            self.file.write('\n]')
+        self.file.close()
+
+
+class CityPartitions:
+    """Файлы items по городам CITY_PARTITION_DIR/<город>.<формат> (как CityPartitionPipeline)"""
+
+    def __init__(self, directory: str, file_format: str):
+        self.directory = Path(directory)
+        self.file_format = file_format
+        self.writers: dict[str, JsonWriter] = {}
+
+    def write(self, city: str, line: str):
+        writer = self.writers.get(city)
+        if writer is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            writer = self.writers[city] = JsonWriter(self.directory / f'{city.lower()}.{self.file_format}',
+                                                     lines=self.file_format != 'json')
+        writer.write(line)
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+
+
+def read_categories(urls_file) -> list[str]:
+    """slug категорий из файла ссылок (в порядке файла, без повторов)"""
+    slugs = []
+    with open(urls_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                slug = line.rstrip('/').split('/')[-1]
+                if slug not in slugs:
+                    slugs.append(slug)
+    return slugs
+
+
+def resolve_cities(settings, city: str) -> list[str]:
+    """Города шардов: список из -a city; для all - из кеша списка городов (без кеша - один шард на все города)"""
+    if city.strip().lower() != 'all':
+        return [name.strip() for name in city.split(',') if name.strip()]
+
+    from .state import CityDirectoryCache
+
+    cache = CityDirectoryCache.from_settings(settings)
+    cached = cache.load() if cache is not None else None
+    if not cached:
+        logger.info('Кеша списка городов нет: города не делятся между шардами')
+        return ['all']
+    return list(cached)
+
+
+def shard_overrides(settings, overrides: dict, shard: Shard, workdir: Path) -> dict:
+    """Настройки процесса шарда: выгрузка, лог и файлы состояния - в workdir"""
+    base = workdir / shard.name
+    shard_settings = {
+        **overrides,
+        'FEEDS': {str(base) + '.jsonl': {'format': 'jsonlines', 'overwrite': True}},
+        'LOG_FILE': str(base) + '.log',
+        'SHARD_MANIFEST_PATH': str(base) + '.manifest.json',
+        'STORES_TABLE_PATH': str(base) + '.stores.json',
+        # Раскладка по городам и история цен - при объединении
+        'CITY_PARTITION_DIR': None,
+        'SNAPSHOT_ENABLED': False,
+    }
+    if settings.get('METRICS_PATH'):
+        shard_settings['METRICS_PATH'] = str(base) + '.metrics.prom'
+    return shard_settings
+
+
+def run(settings, output: str, city: str, workers: int, page_stripes: dict[str, int], default_stripes: int = 1,
+        cities_per_shard: int | None = None, per_page: int | None = None, overrides: dict | None = None,
+        workdir: str | Path | None = None, append: bool = False, keep_shards: bool = False,
+        spider_args: dict | None = None) -> dict:
+    """Сбор в workers процессах и объединение результатов в output; возвращает сводку запуска.
+
+    spider_args - аргументы паука для всех шардов, кроме city, categories, page_stripe и per_page
+    """
+    from .ratebudget import RateBudget
+
+    overrides = overrides or {}
+    spider_args = spider_args or {}
+    managed = sorted(set(spider_args) & {'city', 'categories', 'page_stripe', 'per_page'})
+    if managed:
+        raise ValueError(f'Аргументы паука {", ".join(managed)} задаются параметрами launcher.py')
+    if overrides.get('JOBDIR') or settings.get('JOBDIR'):
+        raise ValueError('JOBDIR не поддерживается при сборе в несколько процессов')
+
+    workdir = Path(workdir or settings.get('SHARD_WORKDIR'))
+    workdir.mkdir(parents=True, exist_ok=True)
+    categories = read_categories(settings.get('URLS_FILENAME'))
+    cities = resolve_cities(settings, city)
+    shards = plan_shards(categories, cities, page_stripes, default_stripes, cities_per_shard)
+    # Шарды одной категории должны нумеровать страницы одинаково
+    if per_page is None and any(shard.page_stripes > 1 for shard in shards):
+        per_page = (settings.getdict('PARSING_PARAMS').get(SPIDER_NAME) or {}).get('PER_PAGE', 20)
+    workers = max(1, min(workers, len(shards)))
+    # Без общего предела каждый процесс обращался бы к сайту со своей скоростью
+    rate_limited = (settings.getfloat('RATE_BUDGET_PER_PROXY', 0) > 0
+                    or settings.getfloat('RATE_BUDGET_PER_DOMAIN', 0) > 0)
+    if workers > 1 and not rate_limited:
+        raise ValueError('Сбор в несколько процессов требует RATE_BUDGET_PER_DOMAIN или RATE_BUDGET_PER_PROXY больше 0')
+    logger.info(f'Шардов: {len(shards)}, процессов: {workers}, каталог шардов: {workdir}')
+
+    # spawn: процессы сбора не наследуют состояние реактора и открытые файлы
+    context = multiprocessing.get_context('spawn')
+    budget = None
+    if rate_limited:
+        budget = RateBudget(settings.getint('RATE_BUDGET_SLOTS', 4096), context)
+
+    started = time.time()
+    pending = deque(shards)
+    running: dict = {}
+    results: dict[str, dict] = {}
+    interrupted = False
+    try:
+        while pending or running:
+            while pending and len(running) < workers and not interrupted:
+                shard = pending.popleft()
+                result_path = workdir / f'{shard.name}.result.json'
+                result_path.unlink(missing_ok=True)
+                process = context.Process(target=run_shard, name=shard.name,
+                                          args=(shard.spider_args(per_page, spider_args), shard_overrides(settings, overrides, shard, workdir),
+                                                budget, str(result_path)))
+                process.start()
+                running[process.sentinel] = (process, shard, result_path)
+            if not running:
+                break
+
+            for sentinel in wait(list(running)):
+                process, shard, result_path = running.pop(sentinel)
+                process.join()
+                result = results[shard.name] = read_result(process, result_path)
+                logger.info(f'{shard!r}: {result["items"]} items ({result["finish_reason"]}), '
+                            f'готово {len(results)}/{len(shards)}')
+    except KeyboardInterrupt:
+        # Процессы сбора получают Ctrl+C сами и завершаются штатно - новые шарды не запускаются
+        interrupted = True
+        logger.info('Остановка: ожидание процессов сбора')
+        # Собранное остановленными шардами тоже попадает в результат (шарды отмечаются незавершенными)
+        for process, shard, result_path in running.values():
+            process.join()
+            results[shard.name] = read_result(process, result_path)
+
+    merger = ShardMerger(settings, [shard for shard in shards if shard.name in results], workdir)
+    snapshot = None
+    if settings.getbool('SNAPSHOT_ENABLED', False):
+        from .snapshots import SnapshotStore
+
+        snapshot = SnapshotStore.from_settings(settings)
+        snapshot.begin_run(source=f'launcher {city}')
+    try:
+        items = merger.merge(output, append=append, snapshot=snapshot)
+    finally:
+        if snapshot is not None:
+            snapshot.finish_run()
+            snapshot.close()
+    elapsed = time.time() - started
+    failed = [name for name, result in results.items() if result['finish_reason'] not in ('finished',)]
+    summary = {
+        'shards': len(shards),
+        'completed_shards': len(results),
+        'failed_shards': failed,
+        'workers': workers,
+        'items': items,
+        'merged_duplicates': merger.merged_duplicates,
+        'elapsed_sec': round(elapsed, 3),
+        'items_per_sec': round(items / elapsed, 2) if elapsed else None,
+    }
+    logger.info(f'Собрано {items} items за {elapsed / 60:.1f} мин в {workers} процессах, '
+                f'объединено дубликатов: {merger.merged_duplicates}, файл: {output}')
+    if failed:
+        logger.warning(f'Шарды завершились не штатно (см. {workdir}/<шард>.log): {", ".join(failed)}')
+    elif not keep_shards and not interrupted:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return summary
+
+
+def read_result(process, result_path: Path) -> dict:
+    """Сводка завершившегося процесса шарда (run_shard)"""
+    try:
+        return json.loads(result_path.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {'finish_reason': f'exitcode {process.exitcode}', 'items': 0, 'errors': 1}
+
+
+def parse_page_stripes(values: list[str]) -> tuple[int, dict[str, int]]:
+    """--page-stripes N (все категории) и --page-stripes slug=N (одна категория)"""
+    default, per_category = 1, {}
+    for value in values:
+        slug, _, count = value.rpartition('=')
+        if slug:
+            per_category[slug] = int(count)
+        else:
+            default = int(count)
+    return default, per_category
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('-O', dest='overwrite_output', metavar='FILE', help='перезаписать выходной файл')
+    target.add_argument('-o', dest='append_output', metavar='FILE', help='дописать в выходной файл (JSON lines)')
+    parser.add_argument('-a', dest='spider_args', action='append', default=[], metavar='NAME=VALUE',
+                        help='аргумент паука (city=..., mode=... - для всех шардов)')
+    parser.add_argument('-s', dest='settings', action='append', default=[], metavar='NAME=VALUE',
+                        help='переопределить настройку Scrapy во всех процессах')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='процессов сбора (по умолчанию - ядер)')
+    parser.add_argument('--page-stripes', action='append', default=[], metavar='N|SLUG=N',
+                        help='делить страницы категорий (или одной категории SLUG) на N шардов')
+    parser.add_argument('--cities-per-shard', type=int, help='городов в шарде (по умолчанию - все города в каждом шарде)')
+    parser.add_argument('--per-page', type=int, help='per_page для всех шардов (по умолчанию PER_PAGE при --page-stripes)')
+    parser.add_argument('--workdir', help='каталог выгрузок и логов шардов (по умолчанию SHARD_WORKDIR)')
+    parser.add_argument('--keep-shards', action='store_true', help='не удалять выгрузки шардов после объединения')
+    args = parser.parse_args(argv)
+
+    from scrapy.settings import Settings
+    from scrapy.utils.log import configure_logging
+    from scrapy.utils.project import get_project_settings
+
+    settings = get_project_settings()
+    overrides = dict(raw.partition('=')[::2] for raw in args.settings)
+    for key, value in overrides.items():
+        settings.set(key, value, priority='cmdline')
+    configure_logging(Settings({'LOG_LEVEL': 'INFO'}))
+
+    spider_args = dict(raw.partition('=')[::2] for raw in args.spider_args)
+    city = spider_args.pop('city', None) or \
+        (settings.getdict('PARSING_PARAMS').get(SPIDER_NAME) or {}).get('DEFAULT_CITY_NAME', 'Краснодар')
+    per_page = args.per_page
+    if 'per_page' in spider_args and per_page is None:
+        per_page = int(spider_args.pop('per_page'))
+    default_stripes, page_stripes = parse_page_stripes(args.page_stripes)
+
+    summary = run(settings, args.overwrite_output or args.append_output, city, args.workers, page_stripes,
+                  default_stripes, args.cities_per_shard, per_page, overrides, args.workdir,
+                  append=bool(args.append_output), keep_shards=args.keep_shards, spider_args=spider_args)
+    return 1 if summary['failed_shards'] else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,132 @@
+import contextlib
+import json
+import time
+from bisect import bisect_left
+from typing import Iterator
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами корзин (как histogram в Prometheus) по значению метки"""
+
+    # Границы корзин, сек
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, label: str | None, help_text: str):
+        self.label = label
+        self.help_text = help_text
+        # значение метки = [количество в каждой корзине (последняя - +Inf), сумма, количество]
+        self.series: dict[str, list] = {}
+
+    def observe(self, label_value: str, value: float):
+        series = self.series.get(label_value)
+        if series is None:
+            series = self.series[label_value] = [[0] * (len(self.BUCKETS) + 1), 0.0, 0]
+        series[0][bisect_left(self.BUCKETS, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def quantile(self, label_value: str, q: float) -> float | None:
+        """Оценка квантиля q (0..1) по верхней границе корзины"""
+        series = self.series.get(label_value)
+        if not series or not series[2]:
+            return None
+        rank = q * series[2]
+        seen = 0
+        for index, count in enumerate(series[0]):
+            seen += count
+            if seen >= rank:
+                return self.BUCKETS[index] if index < len(self.BUCKETS) else float('inf')
+        return float('inf')
+
+
+class CrawlMetrics:
+    """Метрики этапов сбора: CPU callback паука, время pipelines, загрузка по типам запросов,
+    задержка request->item, прогресс и ETA.
+
+    Один экземпляр на краулер (from_crawler): его заполняют StageMetricsSpiderMiddleware, pipelines
+    и MetricsExporterExtension, которое периодически выгружает метрики в Prometheus text или JSON.
+    """
+
+    PREFIX = 'alkoteka_'
+
+    # Гистограммы: название = (метка, описание)
+    HISTOGRAMS = {
+        'callback_cpu_seconds': ('callback', 'CPU time of spider callbacks (reactor thread)'),
+        'pipeline_seconds': ('pipeline', 'Item pipeline processing time'),
+        'download_seconds': ('endpoint', 'Download latency by endpoint'),
+        'request_to_item_seconds': (None, 'Time from scheduling the request to the scraped item'),
+    }
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.histograms = {name: Histogram(label, help_text) for name, (label, help_text) in self.HISTOGRAMS.items()}
+        self.gauges: dict[str, float | None] = {}
+
+    @classmethod
+    def from_crawler(cls, crawler) -> 'CrawlMetrics':
+        """Общие метрики краулера (создаются при первом обращении; METRICS_ENABLED = False - без записи)"""
+        metrics = getattr(crawler, 'metrics', None)
+        if metrics is None:
+            metrics = crawler.metrics = cls(crawler.settings.getbool('METRICS_ENABLED', True))
+        return metrics
+
+    def observe(self, name: str, value: float, label_value: str = ''):
+        if self.enabled:
+            self.histograms[name].observe(label_value, value)
+
+    @contextlib.contextmanager
+    def _timed(self, name: str, label_value: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.histograms[name].observe(label_value, time.perf_counter() - started)
+
+    def timer(self, name: str, label_value: str = ''):
+        """Контекстный менеджер: время выполнения блока в гистограмму name"""
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._timed(name, label_value)
+
+    def set_gauge(self, name: str, value: float | None):
+        self.gauges[name] = value
+
+    def as_dict(self) -> dict:
+        histograms = {}
+        for name, histogram in self.histograms.items():
+            histograms[name] = {
+                label_value: {
+                    'count': count,
+                    'sum': round(total, 6),
+                    'p50': histogram.quantile(label_value, 0.5),
+                    'p99': histogram.quantile(label_value, 0.99),
+                    'buckets': dict(zip([*map(str, Histogram.BUCKETS), '+Inf'], buckets)),
+                }
+                for label_value, (buckets, total, count) in histogram.series.items()
+            }
+        return {'gauges': dict(self.gauges), 'histograms': histograms}
+
+    def to_json(self) -> str:
+        return json.dumps(self.as_dict(), ensure_ascii=False, indent=2)
+
+    def to_prometheus(self) -> str:
+        """Метрики в текстовом формате Prometheus (для node_exporter textfile collector и т.п.)"""
+        lines = []
+        for name, value in self.gauges.items():
+            if value is None:
+                continue
+            lines += [f'# TYPE {self.PREFIX}{name} gauge', f'{self.PREFIX}{name} {value}']
+
+        for name, histogram in self.histograms.items():
+            metric = self.PREFIX + name
+            lines += [f'# HELP {metric} {histogram.help_text}', f'# TYPE {metric} histogram']
+            for label_value, (buckets, total, count) in histogram.series.items():
+                labels = f'{histogram.label}="{label_value}",' if histogram.label else ''
+                cumulative = 0
+                for bound, bucket in zip([*map(str, Histogram.BUCKETS), '+Inf'], buckets):
+                    cumulative += bucket
+                    lines.append(f'{metric}_bucket{{{labels}le="{bound}"}} {cumulative}')
+                braces = f'{{{labels.rstrip(",")}}}' if labels else ''
+                lines.append(f'{metric}_sum{braces} {total}')
+                lines.append(f'{metric}_count{braces} {count}')
+        return '\n'.join(lines) + '\n'
@@ -3,13 +3,30 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import json
+import logging
+import os
+import random
+import time
+from urllib.parse import urlparse
+
 from scrapy import signals
-from scrapy.exceptions import IgnoreRequest, CloseSpider
-from browserforge.headers import HeaderGenerator
+from scrapy.exceptions import IgnoreRequest, CloseSpider, NotConfigured
+from scrapy.utils.httpobj import urlparse_cached
+from twisted.internet.task import deferLater
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
 
+from .headerpool import HeaderProfilePool
+from .jsondecoder import JSONDecoder
+from .metrics import CrawlMetrics
+from .proxypool import ProxyPool
+from .ratebudget import RateBudget
+from .state import HeaderProfileCache
+
+logger = logging.getLogger(__name__)
+
 
 class AlkotekaSpiderMiddleware:
     # Not all methods need to be defined. If a method is not defined,
@@ -103,70 +120,654 @@ class AlkotekaDownloaderMiddleware:
 
 
 class JSONResponseValidateSpiderMiddleware:
-    """Проверяет входящие запросы на соответствие их формату JSON"""
+    """Проверяет входящие запросы на соответствие их формату JSON
 
-    def __init__(self, settings):
+    Декодированный JSON сохраняется в response (JSONDecoder), поэтому паук не декодирует ответ повторно.
+    """
+
+    def __init__(self, settings, spider_name: str):
         self.parsing_params = settings.get('PARSING_PARAMS', None)
 
         if not self.parsing_params:
             raise CloseSpider()
 
+        self.decoder = JSONDecoder.from_settings(settings)
+        # Префиксы ссылок и исключение при невалидном JSON: (префикс_ссылки, класс_исключения)
+        self.rules: tuple = ()
+
+        if spider_name == 'products_by_category':
+            params = self.parsing_params.get(spider_name) or {}
+            city_url = params.get('CITY_URL')
+            product_url = params.get('PRODUCT_URL')
+            # Проверка при создании middleware: исключение в обработчике spider_opened паука не остановит
+            if not city_url or not product_url:
+                msg = f'В файле settings.py проекта в словаре настройки паука не заполнены CITY_URL и/или PRODUCT_URL'
+                raise CloseSpider(msg)
+
+            # Сюда доходят только ответы, исчерпавшие повторы PayloadRetryDownloaderMiddleware (записаны в DEAD_LETTER_PATH)
+            self.rules = (
+                # Останавливать работу паука, если на запрос списка городов возвращается не json
+                #                                                                       - дальнейшая работа невозможна
+                (city_url, CloseSpider),
+                # Игнорировать запрос, если ответ на него - не json (errback паука освобождает место в обходе категории)
+                (product_url, IgnoreRequest),
+            )
+
     @classmethod
     def from_crawler(cls, crawler):
         # This method is used by Scrapy to create your spiders.
-        s = cls(crawler.settings)
+        s = cls(crawler.settings, crawler.spidercls.name)
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
         return s
 
     def process_spider_input(self, response, spider):
-        if spider.name == 'products_by_category':
-            try:
-                city_url = self.parsing_params.get(spider.name, None).get('CITY_URL')
-                product_url = self.parsing_params.get(spider.name, None).get('PRODUCT_URL')
-            except:
-                msg = f'В файле settings.py проекта в словаре настройки паука не заполнены CITY_URL и/или PRODUCT_URL'
-                raise CloseSpider(msg)
-
-            # Останавливать работу паука, если на запрос списка городов возвращается не json
-            #                                                                           - дальнейшая работа невозможна
-            if city_url in response.url:
-                try:
-                    data = response.json().get('results')
-                except ValueError:
-                    msg = f'Invalid JSON at {response.url}'
-                    raise CloseSpider(msg)
-
-            # Игнорировать запрос, если ответ на него - не json
-            if product_url in response.url:
+        for url_prefix, exception_class in self.rules:
+            if response.url.startswith(url_prefix):
                 try:
-                    data = response.json().get('results')
+                    self.decoder.decode(response)
                 except ValueError:
                     msg = f'Invalid JSON at {response.url}'
-                    raise IgnoreRequest(msg)
+                    raise exception_class(msg)
+                break
 
         return None
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+        if self.rules:
+            spider.logger.info(f'JSON декодируется через {self.decoder.name}')
+
+
+class StageMetricsSpiderMiddleware:
+    """CPU время callback паука (поток реактора) по названию callback - в CrawlMetrics.
+
+    Должен стоять ближе всех к пауку (наибольший номер), чтобы в замер не попадали другие middleware.
+    """
+
+    def __init__(self, metrics: CrawlMetrics):
+        self.metrics = metrics
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        metrics = CrawlMetrics.from_crawler(crawler)
+        if not metrics.enabled:
+            raise NotConfigured()
+        return cls(metrics)
+
+    @staticmethod
+    def callback_name(response) -> str:
+        callback = getattr(response.request, 'callback', None) if response.request is not None else None
+        return getattr(callback, '__name__', None) or 'parse'
+
+    def process_spider_output(self, response, result, spider):
+        name = self.callback_name(response)
+
+        # Время считается только внутри next() - пока работает callback
+        cpu = 0.0
+        iterator = iter(result)
+        try:
+            while True:
+                started = time.thread_time()
+                try:
+                    value = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    cpu += time.thread_time() - started
+                yield value
+        finally:
+            self.metrics.observe('callback_cpu_seconds', cpu, name)
+
+    async def process_spider_output_async(self, response, result, spider):
+        name = self.callback_name(response)
+
+        # Время считается только внутри __anext__() - пока работает callback
+        cpu = 0.0
+        iterator = result.__aiter__()
+        try:
+            while True:
+                started = time.thread_time()
+                try:
+                    value = await iterator.__anext__()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    cpu += time.thread_time() - started
+                yield value
+        finally:
+            self.metrics.observe('callback_cpu_seconds', cpu, name)
 
 
 class BrowserHeadersReplaceDownloaderMiddleware:
-    """Дополняет все requests уникальными данными браузера"""
-    
-    def __init__(self):
-        # Создание генератора headers
-        self.generator = HeaderGenerator()
+    """Дополняет все requests данными браузера (HeaderProfilePool)
+
+    Набор заголовков закрепляется за сессией - прокси запроса (или meta['header_session'])
+    на BROWSER_HEADERS_STICKY_REQUESTS запросов и сбрасывается после бана. Должен стоять после
+    ProxyPoolDownloaderMiddleware (назначает прокси).
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.stats = crawler.stats
+        # Генератор headers (BrowserForge) создается при первой генерации набора: при заданном
+        # BROWSER_HEADERS_CACHE_PATH - в потоке пополнения запаса, а не при запуске паука
+        self.generator = None
+        # Запас наборов прошлого запуска (если BROWSER_HEADERS_CACHE_PATH задан; без файла - пустой,
+        # HeaderProfilePool сразу начинает пополнять его в отдельном потоке)
+        self.cache = HeaderProfileCache.from_settings(settings)
+        ready = self.cache.take() if self.cache is not None else None
+        self.pool = HeaderProfilePool(self.generate,
+                                      size=settings.getint('BROWSER_HEADERS_POOL_SIZE', 50),
+                                      sticky_requests=settings.getint('BROWSER_HEADERS_STICKY_REQUESTS', 100),
+                                      ready=ready)
+        self.stats.set_value('browser_headers/cached', len(ready or ()))
+        self.ban_codes = set(settings.getlist('PROXY_POOL_BAN_CODES', [403]))
 
     @classmethod
     def from_crawler(cls, crawler):
-        return cls()
+        s = cls(crawler)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def spider_closed(self, spider):
+        self.stats.set_value('browser_headers/generated_inline', self.pool.generated_inline)
+        # Неотправленные наборы - следующему запуску
+        if self.cache is not None:
+            self.cache.save(list(self.pool.ready))
+
+    def generate(self) -> dict:
+        """Новый набор заголовков (HeaderProfilePool вызывает его под своей блокировкой)"""
+        if self.generator is None:
+            from browserforge.headers import HeaderGenerator
+
+            self.generator = HeaderGenerator()
+        return self.generator.generate()
+
+    @staticmethod
+    def session_key(request) -> str:
+        return request.meta.get('header_session') or request.meta.get('proxy') or 'direct'
+
+    # Проверка запаса, пока запрос ждет набор из потока пополнения, сек
+    PENDING_POLL_INTERVAL = 0.01
 
     def process_request(self, request, spider):
-        # Генерация полный набора headers для каждого запроса
-        headers = self.generator.generate()
+        session = self.session_key(request)
+        if self.pool.pending(session):
+            # Запрос ждет набор, а поток реактора не генерирует его сам (первые запросы без запаса)
+            self.stats.inc_value('browser_headers/waited')
+            from twisted.internet import reactor
+
+            return deferLater(reactor, self.PENDING_POLL_INTERVAL, self.process_request, request, spider)
+        headers = self.pool.headers_for(session)
 
         # Применение headers к request
         for key, value in headers.items():
             request.headers[key] = value
 
         return None
+
+    def process_response(self, request, response, spider):
+        # Забаненный клиент получает новый набор заголовков
+        if response.status in self.ban_codes and self.pool.discard(self.session_key(request)):
+            self.stats.inc_value('browser_headers/discarded')
+        return response
+
+
+class ProxyPoolDownloaderMiddleware:
+    """Выбор прокси по задержке и доле ошибок (ProxyPool) вместо случайного.
+
+    Список прокси перечитывается из PROXY_POOL_LIST_PATH при изменении файла (не чаще раза
+    в PROXY_POOL_RELOAD_INTERVAL секунд), без перезапуска паука. Бан (PROXY_POOL_BAN_CODES, пустой
+    ответ 200, ошибка соединения) приостанавливает прокси с экспоненциальной паузой, а запрос
+    повторяется через другой прокси (до PROXY_POOL_PAGE_RETRY_TIMES раз). HTML страница вместо JSON
+    (PROXY_POOL_BAN_HTML) - тоже бан. Состояние прокси - в статистике proxy_pool/proxy/<адрес>/*.
+    Пул доступен другим middleware как crawler.proxy_pool. Должен стоять перед ProxySlotThrottleDownloaderMiddleware.
+    """
+
+    # Ответы, которые считаются ошибкой прокси без бана
+    ERROR_CODES = {429}
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool('PROXY_POOL_ENABLED', True):
+            raise NotConfigured()
+
+        self.path = settings.get('PROXY_POOL_LIST_PATH')
+        self.static_list = settings.getlist('PROXY_POOL_LIST')
+        if not self.path and not self.static_list:
+            raise NotConfigured()
+
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.reload_interval = settings.getfloat('PROXY_POOL_RELOAD_INTERVAL', 30)
+        self.max_retries = settings.getint('PROXY_POOL_PAGE_RETRY_TIMES', 5)
+        self.close_spider = settings.getbool('PROXY_POOL_CLOSE_SPIDER', False)
+        self.ban_codes = set(settings.getlist('PROXY_POOL_BAN_CODES', [403]))
+        self.ban_html = settings.getbool('PROXY_POOL_BAN_HTML', True)
+        self.pool = crawler.proxy_pool = ProxyPool(alpha=settings.getfloat('PROXY_POOL_EWMA_ALPHA', 0.3),
+                                                   backoff_base=settings.getfloat('PROXY_POOL_BACKOFF_BASE', 60),
+                                                   backoff_max=settings.getfloat('PROXY_POOL_BACKOFF_MAX', 3600))
+
+        # Время изменения файла при последнем чтении и время следующей проверки (и публикации статистики)
+        self.mtime = None
+        self.next_check = 0.0
+        self.reload(time.time())
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = cls(crawler)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def spider_closed(self, spider):
+        self.publish_stats()
+
+    def reload(self, now: float):
+        """Чтение списка прокси, если файл изменился"""
+        self.next_check = now + self.reload_interval
+        proxies = list(self.static_list)
+        if self.path:
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                mtime = None
+            if mtime == self.mtime and self.pool.proxies:
+                return
+            self.mtime = mtime
+            if mtime is not None:
+                proxies += ProxyPool.read_list(self.path)
+        elif self.pool.proxies:
+            return
+
+        # Последние значения удаляемых прокси остаются в статистике
+        self.publish_stats()
+        added, removed = self.pool.update(proxies)
+        if added or removed:
+            self.stats.inc_value('proxy_pool/reloads')
+            logger.info(f'Список прокси обновлен: {len(self.pool.proxies)} (добавлено {added}, удалено {removed})')
+
+    def publish_stats(self):
+        self.stats.set_value('proxy_pool/size', len(self.pool.proxies))
+        self.stats.set_value('proxy_pool/available', self.pool.available(time.time()))
+        for name, values in self.pool.snapshot().items():
+            for key, value in values.items():
+                self.stats.set_value(f'proxy_pool/proxy/{name}/{key}', value)
+
+    def process_request(self, request, spider):
+        # Прокси, заданный в запросе явно, не меняется
+        if 'proxy' in request.meta and not request.meta.get('_proxy_pool'):
+            return None
+
+        now = time.time()
+        if now >= self.next_check:
+            self.reload(now)
+            self.publish_stats()
+        if not self.pool.proxies:
+            request.meta.pop('proxy', None)
+            request.meta.pop('_proxy_pool', None)
+            return None
+
+        # Повтор после испорченного ответа - через другой прокси (PayloadRetryDownloaderMiddleware)
+        proxy = self.pool.choose(now, avoid=request.meta.get('payload_failed_proxy'))
+        if proxy is None:
+            # Все прокси в бане
+            if self.close_spider:
+                raise CloseSpider('no_proxies')
+            self.stats.inc_value('proxy_pool/exhausted')
+            proxy = self.pool.earliest()
+
+        self.pool.start(proxy)
+        request.meta['proxy'] = proxy
+        request.meta['_proxy_pool'] = True
+        return None
+
+    def process_response(self, request, response, spider):
+        proxy = request.meta.get('proxy')
+        if not request.meta.get('_proxy_pool') or proxy not in self.pool.proxies:
+            return response
+
+        latency = request.meta.get('download_latency')
+        if response.status in self.ban_codes or (response.status == 200 and not response.body) \
+                or (self.ban_html and response.status == 200 and is_html(response)):
+            request.meta['_ban'] = True
+            return self.banned(request, response, spider)
+
+        request.meta['_ban'] = False
+        if response.status in self.ERROR_CODES or response.status >= 500:
+            self.pool.error(proxy, latency)
+            self.stats.inc_value('proxy_pool/errors')
+        else:
+            self.pool.success(proxy, latency or 0.0)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        proxy = request.meta.get('proxy')
+        if not request.meta.get('_proxy_pool') or proxy not in self.pool.proxies:
+            return None
+        if isinstance(exception, IgnoreRequest):
+            self.pool.finish(proxy)
+            return None
+        # Ошибка соединения через прокси - как бан
+        return self.banned(request, None, spider)
+
+    def banned(self, request, response, spider):
+        """Пауза забаненного прокси и повтор запроса через другой прокси"""
+        proxy = request.meta['proxy']
+        pause = self.pool.ban(proxy, time.time())
+        self.stats.inc_value('proxy_pool/bans')
+        logger.debug(f'Прокси {ProxyPool.display_name(proxy)} приостановлен на {pause:.0f} сек')
+
+        retries = request.meta.get('proxy_retry_times', 0) + 1
+        if retries > self.max_retries:
+            self.stats.inc_value('proxy_pool/gave_up')
+            return response
+        self.stats.inc_value('proxy_pool/retries')
+        retry_request = request.copy()
+        retry_request.meta['proxy_retry_times'] = retries
+        retry_request.dont_filter = True
+        return retry_request
+
+
+def is_html(response) -> bool:
+    """HTML страница (бан, капча, заглушка) по заголовку Content-Type"""
+    return b'html' in (response.headers.get(b'Content-Type') or b'').lower()
+
+
+class PayloadRetryDownloaderMiddleware:
+    """Повтор запросов к API, ответ на которые - не JSON (страница бана, обрезанный или испорченный JSON).
+
+    Запрос повторяется с экспоненциальной паузой (PAYLOAD_RETRY_BACKOFF_BASE * 2^повтор, не больше
+    PAYLOAD_RETRY_BACKOFF_MAX) через другой прокси, не больше PAYLOAD_RETRY_TIMES раз. Прокси, вернувший
+    HTML, приостанавливается в пуле (crawler.proxy_pool), испорченный JSON снижает его оценку.
+    Запрос, исчерпавший повторы, записывается в DEAD_LETTER_PATH (JSON lines), а ответ передается дальше:
+    JSONResponseValidateSpiderMiddleware решает, что с ним делать.
+
+    Должен стоять после распаковки ответа (HttpCompressionMiddleware, 590), то есть с меньшим номером.
+    """
+
+    # Ключи meta, которые записываются в DEAD_LETTER_PATH (для повторного запроса)
+    DEAD_LETTER_META = ('city_name', 'city_uuid', 'product_slug', 'category_slug', 'listing', 'frontier')
+
+    def __init__(self, crawler, max_retries: int, backoff_base: float, backoff_max: float, dead_letter_path):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.dead_letter_path = dead_letter_path
+        self.dead_letter_file = None
+        self.ban_codes = set(crawler.settings.getlist('PROXY_POOL_BAN_CODES', [403]))
+        self.decoder = JSONDecoder.from_settings(crawler.settings)
+        # Префиксы ссылок API, ответы которых должны быть JSON
+        self.url_prefixes: tuple = ()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('PAYLOAD_RETRY_ENABLED', True):
+            raise NotConfigured()
+        s = cls(crawler, settings.getint('PAYLOAD_RETRY_TIMES', 3), settings.getfloat('PAYLOAD_RETRY_BACKOFF_BASE', 2),
+                settings.getfloat('PAYLOAD_RETRY_BACKOFF_MAX', 60), settings.get('DEAD_LETTER_PATH'))
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def spider_opened(self, spider):
+        params = self.crawler.settings.getdict('PARSING_PARAMS').get(spider.name) or {}
+        self.url_prefixes = tuple(params[key] for key in ('CITY_URL', 'PRODUCT_URL') if params.get(key))
+
+    def spider_closed(self, spider):
+        if self.dead_letter_file is not None:
+            self.dead_letter_file.close()
+
+    def process_request(self, request, spider):
+        wait = request.meta.get('payload_retry_at', 0) - time.time()
+        if wait <= 0:
+            return None
+        from twisted.internet import reactor
+
+        # Пауза перед повтором: загрузчик продолжит обработку запроса через wait секунд
+        return deferLater(reactor, wait, lambda: None)
+
+    def process_response(self, request, response, spider):
+        if not response.url.startswith(self.url_prefixes) or not self.url_prefixes:
+            return response
+        reason = self.failure_reason(response)
+        if reason is None:
+            return response
+
+        self.stats.inc_value(f'payload_retry/{reason}')
+        proxy = request.meta.get('proxy')
+        pool = getattr(self.crawler, 'proxy_pool', None)
+        # Бан, уже учтенный ProxyPoolDownloaderMiddleware, повторно не учитывается
+        if pool is not None and proxy in pool.proxies and not request.meta.get('_ban'):
+            if reason == 'malformed_json':
+                pool.penalize(proxy)
+            else:
+                pool.trip(proxy, time.time())
+                self.stats.inc_value('proxy_pool/bans')
+
+        retries = request.meta.get('payload_retry_times', 0) + 1
+        if retries > self.max_retries:
+            self.stats.inc_value('payload_retry/gave_up')
+            self.dead_letter(request, response, reason, retries - 1)
+            return response
+
+        pause = min(self.backoff_base * 2 ** (retries - 1), self.backoff_max)
+        # Разброс паузы: повторы после волны банов не приходят одновременно
+        pause *= random.uniform(0.5, 1.0)
+        logger.debug(f'Ответ {response.url} - не JSON ({reason}), повтор {retries} через {pause:.1f} сек')
+        self.stats.inc_value('payload_retry/retries')
+        retry_request = request.copy()
+        retry_request.meta['payload_retry_times'] = retries
+        retry_request.meta['payload_retry_at'] = time.time() + pause
+        retry_request.meta['payload_failed_proxy'] = proxy
+        retry_request.dont_filter = True
+        return retry_request
+
+    def failure_reason(self, response) -> str | None:
+        """Причина, по которой ответ API не годится (None - ответ JSON)"""
+        if response.status in self.ban_codes:
+            return 'ban_status'
+        if response.status != 200:
+            # Остальные статусы - RetryMiddleware и HttpErrorMiddleware
+            return None
+        try:
+            self.decoder.decode(response)
+        except ValueError:
+            if is_html(response) or response.body.lstrip()[:1] == b'<':
+                return 'ban_page'
+            return 'malformed_json'
+        return None
+
+    def dead_letter(self, request, response, reason: str, retries: int):
+        """Запись запроса, исчерпавшего повторы, в DEAD_LETTER_PATH"""
+        self.stats.inc_value('payload_retry/dead_letter')
+        logger.warning(f'Запрос {request.url} не получил JSON за {retries} повторов ({reason})')
+        if not self.dead_letter_path:
+            return
+        if self.dead_letter_file is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.dead_letter_path)), exist_ok=True)
+            self.dead_letter_file = open(self.dead_letter_path, 'a', encoding='utf-8')
+        callback = getattr(request.callback, '__name__', None)
+        proxy = request.meta.get('proxy')
+        record = {
+            'time': time.time(),
+            'url': request.url,
+            'callback': callback,
+            'reason': reason,
+            'status': response.status,
+            'retries': retries,
+            'proxy': ProxyPool.display_name(proxy) if proxy else None,
+            'meta': {key: request.meta[key] for key in self.DEAD_LETTER_META if key in request.meta},
+            'body': response.body[:200].decode('utf-8', 'replace'),
+        }
+        self.dead_letter_file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.dead_letter_file.flush()
+
+
+class ProxySlotThrottleDownloaderMiddleware:
+    """Слоты загрузчика по прокси и типу запроса (листинг / страница товара) с адаптивной скоростью.
+
+    Каждый слот - "ведро токенов": скорость (запросов/сек) задает задержку слота, а
+    PROXY_THROTTLE_CONCURRENCY - количество одновременных запросов через прокси. Скорость слота
+    растет на PROXY_THROTTLE_RATE_STEP после каждого быстрого успешного ответа и уменьшается вдвое
+    при 429, бане или ошибке соединения; Retry-After приостанавливает слот. Поэтому пропускная
+    способность растет с количеством рабочих прокси, а не ограничена одним слотом домена.
+    Запросы без прокси остаются в слоте домена (DOWNLOAD_DELAY, CONCURRENT_REQUESTS_PER_DOMAIN).
+    Должен стоять после ProxyPoolDownloaderMiddleware (назначает прокси).
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool('PROXY_THROTTLE_ENABLED', True):
+            raise NotConfigured()
+
+        self.crawler = crawler
+        self.parsing_params = settings.get('PARSING_PARAMS', {})
+        self.concurrency = settings.getdict('PROXY_THROTTLE_CONCURRENCY')
+        self.start_rate = settings.getfloat('PROXY_THROTTLE_START_RATE', 1.0)
+        self.min_rate = settings.getfloat('PROXY_THROTTLE_MIN_RATE', 0.05)
+        self.max_rate = settings.getfloat('PROXY_THROTTLE_MAX_RATE', 8.0)
+        self.rate_step = settings.getfloat('PROXY_THROTTLE_RATE_STEP', 0.1)
+        self.target_latency = settings.getfloat('PROXY_THROTTLE_TARGET_LATENCY', 2.0)
+        self.ban_codes = set(settings.getlist('PROXY_THROTTLE_BAN_CODES', [403]))
+
+        # Путь PRODUCT_URL паука - для определения типа запроса
+        self.product_path = ''
+        # Текущая скорость каждого слота (запросов/сек)
+        self.rates: dict[str, float] = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = cls(crawler)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def spider_opened(self, spider):
+        product_url = (self.parsing_params.get(spider.name) or {}).get('PRODUCT_URL') or ''
+        self.product_path = urlparse(product_url).path.rstrip('/')
+
+    def spider_closed(self, spider):
+        for key, rate in self.rates.items():
+            # Ключ слота содержит логин и пароль прокси: в статистике (и логе) - адрес без них
+            proxy, _, kind = key.rpartition('|')
+            self.crawler.stats.set_value(f'proxy_throttle/rate/{ProxyPool.display_name(proxy)}|{kind}', round(rate, 3))
+
+    def request_kind(self, request) -> str:
+        path = urlparse_cached(request).path.rstrip('/')
+        if self.product_path and path == self.product_path:
+            return 'listing'
+        if self.product_path and path.startswith(self.product_path + '/'):
+            return 'detail'
+        return 'other'
+
+    def process_request(self, request, spider):
+        proxy = request.meta.get('proxy')
+        if not proxy:
+            # Запрос уходит со своего адреса: ограничения домена не обходятся
+            if request.meta.get('download_slot') in self.rates:
+                del request.meta['download_slot']
+            return None
+
+        kind = self.request_kind(request)
+        key = f'{proxy}|{kind}'
+
+        # Параметры нового слота - до его создания загрузчиком
+        if key not in self.rates:
+            self.rates[key] = self.start_rate
+            self.crawler.engine.downloader.per_slot_settings[key] = {
+                'concurrency': self.concurrency.get(kind, 1),
+                'delay': 1 / self.start_rate,
+            }
+
+        # Ключ назначается заново на каждый запрос: после бана запрос уходит через другой прокси
+        request.meta['download_slot'] = key
+        return None
+
+    def process_response(self, request, response, spider):
+        key = request.meta.get('download_slot')
+        if key not in self.rates:
+            return response
+
+        latency = request.meta.get('download_latency', 0.0)
+        banned = request.meta.get('_ban', response.status in self.ban_codes)
+
+        if response.status == 429 or response.status == 503 or banned:
+            self.set_rate(key, self.rates[key] / 2)
+            retry_after = response.headers.get('Retry-After')
+            if retry_after:
+                self.pause(key, retry_after)
+        elif latency > self.target_latency:
+            self.set_rate(key, self.rates[key] * 0.9)
+        else:
+            self.set_rate(key, self.rates[key] + self.rate_step)
+
+        return response
+
+    def process_exception(self, request, exception, spider):
+        key = request.meta.get('download_slot')
+        if key in self.rates:
+            self.set_rate(key, self.rates[key] / 2)
+
+    def set_rate(self, key: str, rate: float):
+        rate = min(self.max_rate, max(self.min_rate, rate))
+        self.rates[key] = rate
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is not None:
+            slot.delay = 1 / rate
+
+    def pause(self, key: str, retry_after: bytes):
+        """Приостановка слота на Retry-After секунд (задержка отсчитывается загрузчиком от lastseen)"""
+        try:
+            seconds = float(retry_after)
+        except ValueError:
+            return
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is not None:
+            slot.lastseen = max(slot.lastseen, time.time() + seconds)
+
+
+class RateBudgetDownloaderMiddleware:
+    """Общий предел скорости запросов на прокси (RATE_BUDGET_PER_PROXY) и на домен (RATE_BUDGET_PER_DOMAIN),
+    запросов/сек.
+
+    При запуске через launcher.py предел общий для всех процессов сбора (RateBudget.shared), иначе -
+    для одного процесса. Запрос, для которого предел исчерпан, ждет до своего времени до передачи
+    в загрузчик. Должен стоять после ProxyPoolDownloaderMiddleware (назначает прокси).
+    """
+
+    def __init__(self, crawler, budget: RateBudget, per_proxy: float, per_domain: float):
+        self.stats = crawler.stats
+        self.budget = budget
+        self.per_proxy = per_proxy
+        self.per_domain = per_domain
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        per_proxy = settings.getfloat('RATE_BUDGET_PER_PROXY', 0)
+        per_domain = settings.getfloat('RATE_BUDGET_PER_DOMAIN', 0)
+        if per_proxy <= 0 and per_domain <= 0:
+            raise NotConfigured()
+        budget = RateBudget.shared or RateBudget(settings.getint('RATE_BUDGET_SLOTS', 4096))
+        return cls(crawler, budget, per_proxy, per_domain)
+
+    def process_request(self, request, spider):
+        limits = []
+        proxy = request.meta.get('proxy')
+        if self.per_proxy > 0 and proxy:
+            limits.append((f'proxy|{proxy}', self.per_proxy))
+        if self.per_domain > 0:
+            limits.append((f'domain|{urlparse_cached(request).hostname}', self.per_domain))
+
+        wait = self.budget.reserve(limits, time.time())
+        if wait <= 0:
+            return None
+        self.stats.inc_value('rate_budget/delayed')
+        self.stats.inc_value('rate_budget/wait_seconds', round(wait, 3))
+        from twisted.internet import reactor
+
+        # Deferred: загрузчик продолжит обработку запроса через wait секунд
+        return deferLater(reactor, wait, lambda: None)
@@ -1,25 +1,32 @@
-from pydantic import BaseModel, Field, model_validator
+import functools
 
+from pydantic import BaseModel, ConfigDict, Field, model_validator
 
-class PriceDataModel(BaseModel):
+
+class LazyModel(BaseModel):
+    """Схема валидации строится при первой валидации (или build_models()), а не при импорте модуля"""
+    model_config = ConfigDict(defer_build=True)
+
+
+class PriceDataModel(LazyModel):
     current: float = 0.0
     original: float = 0.0
     sale_tag: str = Field(default='', pattern=r'^(Скидка [0-9]{1,2}%)?$')
 
 
-class StockModel(BaseModel):
+class StockModel(LazyModel):
     in_stock: bool = False
     count: int = 0
 
 
-class AssetsModel(BaseModel):
+class AssetsModel(LazyModel):
     main_image: str = ''
     set_images: list[str] = Field(default_factory=list)
     view360: list[str] = Field(default_factory=list)
     video: list[str] = Field(default_factory=list)
 
 
-class MetadataModel(BaseModel):
+class MetadataModel(LazyModel):
     description: str = ''
 
 
@@ -46,52 +53,72 @@ class MetadataPBCModel(MetadataModel):
     gastronomics: list = Field(default_factory=list)
 
 
-class AlkotekaModel(BaseModel):
+class AlkotekaModel(LazyModel):
     timestamp: int
+    city: str = ''
     RPC: str
     url: str
     title: str
     marketing_tags: list[str] = Field(default_factory=list)
     brand: str = ''
     section: list[str] = Field(default_factory=list)
-    price_data: PriceDataModel
-    stock: StockModel
+    # None - только у items из строк листинга, в которых нет цены или остатка
+    price_data: PriceDataModel | None
+    stock: StockModel | None
     assets: AssetsModel
     metadata: MetadataModel | MetadataPBCModel
     variants: int = Field(default=0, ge=0)
+    # Только у items из строк листинга: в items полного сбора поля нет
+    partial: bool = Field(default=False, exclude_if=lambda value: not value)
 
     @model_validator(mode='before')
     @classmethod
     def convert_all_nones(cls, values):
         """Глобальный обработчик для всех полей: конвертирует все None в примитивы"""
-        type_defaults = {
-            'int': 0,
-            'float': 0.0,
-            'str': '',
-            'bool': False,
-            'list': [],
-            'dict': {},
-        }
-
-        # Итерация по сведениям о полях модели
-        for field_name, field_info in cls.model_fields.items():
-            # Получение по имени поля значения этого поля; если значение этого поля - None
+        for field_name, default_factory in none_defaults(cls).items():
             if values.get(field_name) is None:
-                # Получение типа поля из аннотаций модели (предусмотрено в тч если аннотация импортирована из typing)
-                field_type = str(field_info.annotation).replace('typing.', '').lower()
-
-                # Установка значений полей в соответствии с указанными примитивами
-                if field_type.startswith('int'):
-                    values[field_name] = type_defaults['int']
-                elif field_type.startswith('float'):
-                    values[field_name] = type_defaults['float']
-                elif field_type.startswith('str'):
-                    values[field_name] = type_defaults['str']
-                elif field_type.startswith('bool'):
-                    values[field_name] = type_defaults['bool']
-                elif field_type.startswith('list'):
-                    values[field_name] = type_defaults['list']
-                elif field_type.startswith('dict'):
-                    values[field_name] = type_defaults['dict']
+                values[field_name] = default_factory()
 
         return values
+
+    @model_validator(mode='after')
+    def require_price_and_stock(self):
+        """Цена и наличие могут отсутствовать только у partial items"""
+        if not self.partial and (self.price_data is None or self.stock is None):
+            raise ValueError('price_data и stock обязательны для items со страниц товаров')
+        return self
+
+
+def build_models():
+    """Построение схемы AlkotekaModel заранее (вместе со схемами вложенных моделей)"""
+    AlkotekaModel.model_rebuild()
+
+
+@functools.cache
+def none_defaults(model: type[BaseModel]) -> dict[str, type]:
+    """Поля модели, в которых None заменяется примитивом: имя поля = тип примитива (вызов дает 0, '', [] и т.п.).
+
+    Вычисляется один раз на модель, а не для каждого item
+    """
+    type_defaults = {
+        'int': int,
+        'float': float,
+        'str': str,
+        'bool': bool,
+        'list': list,
+        'dict': dict,
+    }
+
+    defaults = {}
+    # Итерация по сведениям о полях модели
+    for field_name, field_info in model.model_fields.items():
+        # Получение типа поля из аннотаций модели (предусмотрено в тч если аннотация импортирована из typing)
+        field_type = str(field_info.annotation).replace('typing.', '').lower()
+
+        # Примитив в соответствии с типом поля
+        for type_name, default_factory in type_defaults.items():
+            if field_type.startswith(type_name):
+                defaults[field_name] = default_factory
+                break
+
+    return defaults
@@ -5,12 +5,25 @@
 
 
 # useful for handling different item types with a single interface
+import hashlib
+import json
+import multiprocessing
+import os
 import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any
 
 from itemadapter import ItemAdapter
 from pydantic import ValidationError
+from scrapy import signals
+from scrapy.exceptions import DropItem, NotConfigured
+from scrapy.exporters import JsonItemExporter, JsonLinesItemExporter
+from twisted.internet.defer import Deferred
 
-from .models import AlkotekaModel
+from .metrics import CrawlMetrics
+from .models import AlkotekaModel, build_models
 
 
 class AlkotekaPipeline:
@@ -21,28 +34,45 @@ class AlkotekaPipeline:
 class FormatingFieldsPipeline:
     """Форматирование значений указанных полей item в соответствии с требуемыми условиями"""
 
+    # Объем в названии товара или в section: "0.75 л", "1л" и т.п.
+    LITRES_PATTERN = re.compile(r'\d[.,]\d{1,2}\s*[лЛ]|\d[лЛ]')
+
+    def __init__(self, metrics: CrawlMetrics | None = None):
+        self.metrics = metrics or CrawlMetrics(enabled=False)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if crawler.settings.getbool('PIPELINE_POOL_ENABLED', False):
+            raise NotConfigured('Форматирование выполняется в ProcessPoolPipeline')
+        return cls(CrawlMetrics.from_crawler(crawler))
+
     def process_item(self, item, spider):
         if spider.name == 'products_by_category':
             # Например:
             # 1. проверка 'no_image' in item['assets']['main_image'] -> item['assets']['main_image'] = None
             # 2. item['metadata']['stores_list'][i]['quantity'] = int(`quantity`.replace('шт', '').strip())
-
-            # Преобразование title товара по формату "{Название}, {Цвет или Объем}"
-            litres_pattern = r'\d[.,]\d{1,2}\s*[лЛ]|\d[лЛ]'
-            if not re.search(litres_pattern, item["title"]):                    
-                litres = re.findall(litres_pattern, ';'.join(item["section"]))
-                try:
-                    item["title"] = f'{item["title"]}, {litres[0]}'
-                except IndexError:
-                    pass
-
-            # Преобразование строкового представления числа скидки в формат "Скидка {discount_percentage}%"
-            if item['price_data'].get('sale_tag', None):
-                item['price_data']['sale_tag'] = f"Скидка {item['price_data']['sale_tag']}%"
+            with self.metrics.timer('pipeline_seconds', 'FormatingFieldsPipeline'):
+                self.format_item(item)
             return item
         else:
             return item
 
+    @classmethod
+    def format_item(cls, item):
+        """Форматирование item паука products_by_category (item или dict)"""
+        # Преобразование title товара по формату "{Название}, {Цвет или Объем}"
+        if not cls.LITRES_PATTERN.search(item["title"]):
+            # Первое совпадение по разделам (шаблон не захватывает разделитель, поэтому без склейки section)
+            for section in item["section"]:
+                litres = cls.LITRES_PATTERN.search(section)
+                if litres:
+                    item["title"] = f'{item["title"]}, {litres.group()}'
+                    break
+
+        # Преобразование строкового представления числа скидки в формат "Скидка {discount_percentage}%"
+        if item['price_data'] and item['price_data'].get('sale_tag', None):
+            item['price_data']['sale_tag'] = f"Скидка {item['price_data']['sale_tag']}%"
+
 
 class ValidateFieldsPipeline:
     """Валидация типов данных для указанных полей item (производится посредством моделей Pydantic (файл models.py)).
@@ -52,24 +82,24 @@ class ValidateFieldsPipeline:
     значения по умолчанию (0, 0.0, '', [], {}, False). Подробнее в файле models.py
     """
 
+    def __init__(self, metrics: CrawlMetrics | None = None):
+        self.metrics = metrics or CrawlMetrics(enabled=False)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if crawler.settings.getbool('PIPELINE_POOL_ENABLED', False):
+            raise NotConfigured('Валидация выполняется в ProcessPoolPipeline')
+        return cls(CrawlMetrics.from_crawler(crawler))
+
     def process_item(self, item, spider):
         if spider.name == 'products_by_category':
-            # Преобразование scrapy.Item в словарь для валидации Pydantic
-            item_dict = dict(item)
-
             try:
-                # Создание валидированной модели Pydantic из словаря item_dict
-                validated = AlkotekaModel.model_validate(
-                    item_dict,
-                    from_attributes=False
-                )
-
                 # Обновление item валидированными значениями
-                for field, value in validated.model_dump().items():
-                    item[field] = value
+                with self.metrics.timer('pipeline_seconds', 'ValidateFieldsPipeline'):
+                    for field, value in self.validate(item).items():
+                        item[field] = value
 
                 # При успешной валидации возвращается обновленный item
-                spider.logger.info(f"Валидация успешно пройдена для item={item['RPC']}")
                 return item
 
             except ValidationError as e:
@@ -83,6 +113,159 @@ class ValidateFieldsPipeline:
         else:
             return item
 
+    @staticmethod
+    def validate(item) -> dict:
+        """Валидированные значения полей item (ValidationError - item не прошел валидацию)"""
+        # Преобразование scrapy.Item в словарь для валидации Pydantic
+        item_dict = dict(item)
+
+        # Создание валидированной модели Pydantic из словаря item_dict
+        validated = AlkotekaModel.model_validate(
+            item_dict,
+            from_attributes=False
+        )
+        return validated.model_dump()
+
+
+def format_and_validate_batch(items: list[dict]) -> list[tuple[str, Any]]:
+    """Форматирование и валидация пачки items в процессе пула ProcessPoolPipeline.
+
+    Для каждого item: ('ok', валидированные значения) | ('invalid', текст ошибки валидации) | ('error', исключение)
+    """
+    results = []
+    for item in items:
+        try:
+            FormatingFieldsPipeline.format_item(item)
+            results.append(('ok', ValidateFieldsPipeline.validate(item)))
+        except ValidationError as e:
+            results.append(('invalid', f"Validation failed: {e}\nDetails: {e.json()}"))
+        except Exception as e:
+            results.append(('error', e))
+    return results
+
+
+class ProcessPoolPipeline:
+    """
+    Форматирование и валидация items паука products_by_category в пуле процессов
+    (вместо FormatingFieldsPipeline и ValidateFieldsPipeline, которые при PIPELINE_POOL_ENABLED отключаются).
+
+    Items собираются в пачки по PIPELINE_POOL_BATCH_SIZE (неполная пачка отправляется через
+    PIPELINE_POOL_BATCH_TIMEOUT сек), process_item возвращает Deferred, который срабатывает после
+    обработки пачки. Пока Deferred не сработал, item занимает место в слоте scraper, поэтому
+    Scrapy сам перестает забирать новые ответы, если пул не успевает (backpressure). В пул
+    отправляется не больше PIPELINE_POOL_MAX_BATCHES пачек, остальные ждут в очереди.
+    """
+
+    def __init__(self, crawler, workers, batch_size, batch_timeout, max_batches, preserve_order):
+        self.crawler = crawler
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.max_batches = max_batches
+        self.preserve_order = preserve_order
+
+        self.executor = None
+        self.reactor = None
+        self.flush_call = None
+        # Накапливаемая пачка: [(item, Deferred)]
+        self.pending = []
+        # Пачки, ожидающие места в пуле
+        self.queued = deque()
+        # Отправленные в пул пачки в порядке отправки: [пачка, результаты (None - еще обрабатывается)]
+        self.submitted = deque()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('PIPELINE_POOL_ENABLED', False):
+            raise NotConfigured()
+
+        workers = settings.getint('PIPELINE_POOL_WORKERS') or os.cpu_count() or 1
+        return cls(crawler, workers,
+                   batch_size=settings.getint('PIPELINE_POOL_BATCH_SIZE', 50),
+                   batch_timeout=settings.getfloat('PIPELINE_POOL_BATCH_TIMEOUT', 0.2),
+                   max_batches=settings.getint('PIPELINE_POOL_MAX_BATCHES') or workers * 2,
+                   preserve_order=settings.getbool('PIPELINE_POOL_PRESERVE_ORDER', True))
+
+    def open_spider(self, spider):
+        from twisted.internet import reactor
+
+        self.reactor = reactor
+        # spawn: дочерние процессы не наследуют состояние реактора Twisted
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def process_item(self, item, spider):
+        if spider.name != 'products_by_category':
+            return item
+
+        deferred = Deferred()
+        self.pending.append((item, deferred))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        elif self.flush_call is None:
+            self.flush_call = self.reactor.callLater(self.batch_timeout, self.flush)
+        return deferred
+
+    def flush(self):
+        """Отправка накопленной пачки в пул"""
+        if self.flush_call is not None and self.flush_call.active():
+            self.flush_call.cancel()
+        self.flush_call = None
+        if not self.pending:
+            return
+
+        batch, self.pending = self.pending, []
+        self.queued.append(batch)
+        self.submit()
+
+    def submit(self):
+        while self.queued and len(self.submitted) < self.max_batches:
+            batch = self.queued.popleft()
+            entry = [batch, None]
+            self.submitted.append(entry)
+            future = self.executor.submit(format_and_validate_batch,
+                                          [ItemAdapter(item).asdict() for item, _ in batch])
+            # Результат приходит в потоке пула - обработка передается в поток реактора
+            future.add_done_callback(lambda f, entry=entry: self.reactor.callFromThread(self.batch_done, entry, f))
+            self.crawler.stats.inc_value('pipeline_pool/batches')
+
+    def batch_done(self, entry, future):
+        try:
+            entry[1] = future.result()
+        except Exception as e:
+            # Например, BrokenProcessPool - ошибка у всех items пачки
+            entry[1] = [('error', e)] * len(entry[0])
+
+        # С сохранением порядка Deferred срабатывают только по порядку отправки пачек
+        if self.preserve_order:
+            while self.submitted and self.submitted[0][1] is not None:
+                self.release(self.submitted.popleft())
+        else:
+            self.submitted.remove(entry)
+            self.release(entry)
+        self.submit()
+
+    def release(self, entry):
+        spider = self.crawler.spider
+        batch, results = entry
+        for (item, deferred), (status, value) in zip(batch, results):
+            if status == 'ok':
+                # Обновление item валидированными значениями
+                for field, field_value in value.items():
+                    item[field] = field_value
+                deferred.callback(item)
+            elif status == 'invalid':
+                spider.logger.error(value)
+                deferred.errback(DropItem(value))
+            else:
+                deferred.errback(value)
+
+    def close_spider(self, spider):
+        # К закрытию паука scraper уже дождался всех Deferred, пачек в работе нет
+        self.flush()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+
 
 class RenameFieldsPipeline:
     """
@@ -90,7 +273,18 @@ class RenameFieldsPipeline:
     (шаблон переименования settings.py RENAME_PATTERN)
     """
 
+    def __init__(self, metrics: CrawlMetrics | None = None):
+        self.metrics = metrics or CrawlMetrics(enabled=False)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(CrawlMetrics.from_crawler(crawler))
+
     def process_item(self, item, spider):
+        with self.metrics.timer('pipeline_seconds', 'RenameFieldsPipeline'):
+            return self.rename_fields(item, spider)
+
+    def rename_fields(self, item, spider):
         # Получение паттерна переименования для текущего паука из settings
         rename_pattern = spider.settings.get('RENAME_PATTERN', {})
         rename_map = rename_pattern.get(spider.name, {})
@@ -100,27 +294,292 @@ class RenameFieldsPipeline:
 
         # Преобразование scrapy.Item в словарь
         item_dict = dict(item)
-
-        for field, rename_rule in rename_map.items():            
-            # Простое переименование на верхнем уровне
-            if isinstance(rename_rule, str):
-                if field in item_dict:
-                    item_dict[rename_rule] = item_dict.pop(field)
-                    spider.logger.info(f"Переименовано: {field} -> {rename_rule}")
-            
-            # Вложенное переименование
-            elif isinstance(rename_rule, dict):
-                nested_item = item_dict.get(field)
-                
-                if nested_item and isinstance(nested_item, dict):
-                    # Переименование внутри вложенного объекта
-                    for old_name, new_name in rename_rule.items():
-                        if old_name in nested_item:
-                            nested_item[new_name] = nested_item.pop(old_name)
-                            spider.logger.info(f"Переименовано: {field}.{old_name} -> {field}.{new_name}")
-                    
-                    # Обновление вложенного объекта
-                    item_dict[field] = nested_item
+        apply_rename_rules(item_dict, compile_rename_rules(rename_map))
 
         # Возврат словаря, тк scrapy.Item выдаст ошибку из-за новых полей
         return item_dict
+
+
+def compile_rename_rules(rename_map: dict) -> tuple:
+    """Правила переименования из RENAME_PATTERN паука: ((поле, новое имя | None, ((старое, новое), ...)), ...)"""
+    rules = []
+    for field, rename_rule in rename_map.items():
+        # Простое переименование на верхнем уровне
+        if isinstance(rename_rule, str):
+            rules.append((field, rename_rule, ()))
+        # Вложенное переименование
+        elif isinstance(rename_rule, dict):
+            rules.append((field, None, tuple(rename_rule.items())))
+    return tuple(rules)
+
+
+def apply_rename_rules(item_dict: dict, rules: tuple):
+    """Переименование полей словаря item на месте"""
+    for field, new_name, nested_rules in rules:
+        if new_name is not None:
+            if field in item_dict:
+                item_dict[new_name] = item_dict.pop(field)
+            continue
+
+        nested_item = item_dict.get(field)
+        if nested_item and isinstance(nested_item, dict):
+            # Переименование внутри вложенного объекта
+            for old_name, nested_new_name in nested_rules:
+                if old_name in nested_item:
+                    nested_item[nested_new_name] = nested_item.pop(old_name)
+
+
+def renamed_field(rules: tuple, field: str, nested_field: str | None = None) -> tuple[str, str | None]:
+    """Имена поля (и вложенного поля) после переименования по правилам compile_rename_rules"""
+    for rule_field, new_name, nested_rules in rules:
+        if rule_field != field:
+            continue
+        if new_name is not None:
+            field = new_name
+        elif nested_field is not None:
+            nested_field = dict(nested_rules).get(nested_field, nested_field)
+    return field, nested_field
+
+
+class ProcessFieldsPipeline:
+    """
+    Форматирование, валидация и переименование полей item за один проход
+    (та же работа, что у цепочки FormatingFieldsPipeline -> ValidateFieldsPipeline -> RenameFieldsPipeline,
+    с тем же результатом, но с одной копией item).
+
+    Правила переименования из RENAME_PATTERN собираются один раз при открытии паука. При PIPELINE_POOL_ENABLED
+    форматирование и валидация выполняются в ProcessPoolPipeline, а здесь остается только переименование.
+    """
+
+    # Паук, items которого форматируются и валидируются
+    SPIDER_NAME = 'products_by_category'
+
+    def __init__(self, rename_pattern: dict, in_pool: bool = False, metrics: CrawlMetrics | None = None):
+        self.rename_pattern = rename_pattern
+        self.in_pool = in_pool
+        self.metrics = metrics or CrawlMetrics(enabled=False)
+        self.rename_rules = ()
+        self.format_and_validate = False
+        self.models_scheduled = False
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        pipeline = cls(settings.getdict('RENAME_PATTERN'), settings.getbool('PIPELINE_POOL_ENABLED', False),
+                       CrawlMetrics.from_crawler(crawler))
+        crawler.signals.connect(pipeline.request_reached_downloader, signal=signals.request_reached_downloader)
+        return pipeline
+
+    def open_spider(self, spider):
+        self.rename_rules = compile_rename_rules(self.rename_pattern.get(spider.name) or {})
+        self.format_and_validate = spider.name == self.SPIDER_NAME and not self.in_pool
+
+    def request_reached_downloader(self, request, spider):
+        # Схема валидации строится, пока паук ждет ответ на первый запрос, а не при запуске
+        if self.models_scheduled or not self.format_and_validate:
+            return
+        self.models_scheduled = True
+        from twisted.internet import reactor
+
+        reactor.callLater(0, build_models)
+
+    def process_item(self, item, spider):
+        with self.metrics.timer('pipeline_seconds', 'ProcessFieldsPipeline'):
+            if not self.format_and_validate:
+                if not self.rename_rules:
+                    return item
+                item_dict = dict(item)
+                apply_rename_rules(item_dict, self.rename_rules)
+                return item_dict
+
+            item_dict = dict(item)
+            FormatingFieldsPipeline.format_item(item_dict)
+            try:
+                validated = AlkotekaModel.model_validate(item_dict, from_attributes=False).model_dump()
+            except ValidationError as e:
+                spider.logger.error(
+                    f"Validation failed: {e}\n"
+                    f"Details: {e.json()}"
+                )
+                raise
+
+            if not self.rename_rules:
+                # Без переименования результат - исходный item, как у цепочки pipelines
+                for field, value in validated.items():
+                    item[field] = value
+                return item
+
+            # Обновление копии item валидированными значениями (новые поля - в конце, как при item[field] = value)
+            item_dict.update(validated)
+            apply_rename_rules(item_dict, self.rename_rules)
+            return item_dict
+
+
+class StoreTablePipeline:
+    """
+    Нормализованный вывод магазинов (STORES_OUTPUT = 'normalized'): в item вместо полных данных магазинов
+    в metadata.stores_list остаются только {store_id, price, quantity}, а сами магазины один раз
+    записываются в таблицу STORES_TABLE_PATH (JSON-список) при закрытии паука.
+
+    store_id стабилен между запусками и городами: хеш адреса и координат магазина.
+    """
+
+    # Поля магазина, которые переносятся в таблицу магазинов
+    STORE_FIELDS = ('address', 'phone', 'opening_hours', 'longitude', 'latitude')
+
+    def __init__(self, crawler, path):
+        self.crawler = crawler
+        self.path = Path(path)
+        # Таблица магазинов: store_id=данные магазина (в порядке появления)
+        self.stores = {}
+        # Имена полей после RENAME_PATTERN (ProcessFieldsPipeline переименовывает поля до этого pipeline)
+        self.metadata_field, self.stores_field = 'metadata', 'stores_list'
+        self.city_field = 'city'
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if crawler.settings.get('STORES_OUTPUT', 'embedded') != 'normalized':
+            raise NotConfigured()
+        return cls(crawler, crawler.settings.get('STORES_TABLE_PATH'))
+
+    def open_spider(self, spider):
+        rules = compile_rename_rules(spider.settings.getdict('RENAME_PATTERN').get(spider.name) or {})
+        self.metadata_field, self.stores_field = renamed_field(rules, 'metadata', 'stores_list')
+        self.city_field, _ = renamed_field(rules, 'city')
+
+    @staticmethod
+    def store_id(store: dict) -> str:
+        raw = f'{store.get("address")}|{store.get("longitude")}|{store.get("latitude")}'
+        return hashlib.blake2b(raw.encode('utf-8'), digest_size=8).hexdigest()
+
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        # Исходные имена - если поля еще не переименованы (RenameFieldsPipeline после этого pipeline)
+        metadata_field = self.metadata_field if self.metadata_field in adapter else 'metadata'
+        metadata = adapter.get(metadata_field)
+        stores_field = self.stores_field if metadata and self.stores_field in metadata else 'stores_list'
+        if not metadata or not metadata.get(stores_field):
+            return item
+
+        city = adapter.get(self.city_field if self.city_field in adapter else 'city', '')
+        refs = []
+        for store in metadata[stores_field]:
+            store_id = self.store_id(store)
+            if store_id not in self.stores:
+                self.stores[store_id] = {'store_id': store_id, 'city': city,
+                                         **{field: store.get(field) for field in self.STORE_FIELDS}}
+            refs.append({'store_id': store_id, 'price': store.get('price'), 'quantity': store.get('quantity')})
+        metadata[stores_field] = refs
+        return item
+
+    def close_spider(self, spider):
+        self.crawler.stats.set_value('stores/unique', len(self.stores))
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(list(self.stores.values()), ensure_ascii=False, indent=2), encoding='utf-8')
+        os.replace(tmp_path, self.path)
+
+
+class CityPartitionPipeline:
+    """
+    Запись items каждого города в отдельный файл CITY_PARTITION_DIR/<город>.<формат>
+    (только при сборе нескольких городов за один запуск; общий файл -O/-o при этом тоже заполняется)
+    """
+
+    exporters_by_format = {
+        'json': JsonItemExporter,
+        'jsonlines': JsonLinesItemExporter,
+    }
+
+    def __init__(self, directory, file_format):
+        self.directory = Path(directory) if directory else None
+        self.file_format = file_format
+        self.exporter_class = self.exporters_by_format[file_format]
+        self.exporters = {}
+        self.files = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings.get('CITY_PARTITION_DIR'),
+                   crawler.settings.get('CITY_PARTITION_FORMAT', 'json'))
+
+    def process_item(self, item, spider):
+        if self.directory is None or len(getattr(spider, 'city_uuids', {})) < 2:
+            return item
+
+        city = ItemAdapter(item).get('city') or 'unknown'
+        exporter = self.exporters.get(city)
+        if exporter is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            file = open(self.directory / f'{city.lower()}.{self.file_format}', 'wb')
+            exporter = self.exporter_class(file, encoding=spider.settings.get('FEED_EXPORT_ENCODING'))
+            exporter.start_exporting()
+            self.files[city] = file
+            self.exporters[city] = exporter
+
+        exporter.export_item(item)
+        return item
+
+    def close_spider(self, spider):
+        for city, exporter in self.exporters.items():
+            exporter.finish_exporting()
+            self.files[city].close()
+
+
+class SnapshotPipeline:
+    """
+    История цен и наличия (SNAPSHOT_ENABLED): каждый item добавляется в SnapshotStore (SNAPSHOT_PATH)
+    как наблюдение текущего запуска. При SNAPSHOT_DELTA_PATH items, изменившиеся с прошлого запуска
+    (новые, цена, наличие, другие поля), дополнительно пишутся в отдельный файл JSON lines.
+    """
+
+    def __init__(self, crawler, delta_path):
+        self.crawler = crawler
+        self.delta_path = Path(delta_path) if delta_path else None
+        self.store = None
+        self.delta_file = None
+        self.delta_exporter = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('SNAPSHOT_ENABLED', False):
+            raise NotConfigured()
+        return cls(crawler, crawler.settings.get('SNAPSHOT_DELTA_PATH'))
+
+    def open_spider(self, spider):
+        from .snapshots import SnapshotStore
+
+        self.store = SnapshotStore.from_settings(spider.settings)
+        run_id = self.store.begin_run(source=f'{spider.name} {getattr(spider, "city_name", "")}'.strip())
+        self.crawler.stats.set_value('snapshot/run_id', run_id)
+        if self.delta_path is not None:
+            self.delta_path.parent.mkdir(parents=True, exist_ok=True)
+            self.delta_file = open(self.delta_path, 'wb')
+            self.delta_exporter = JsonLinesItemExporter(self.delta_file,
+                                                        encoding=spider.settings.get('FEED_EXPORT_ENCODING'))
+            self.delta_exporter.start_exporting()
+
+    def process_item(self, item, spider):
+        from .snapshots import NEW, OUT_OF_STOCK, PRICE
+
+        changes = self.store.add(item)
+        if not changes:
+            return item
+        stats = self.crawler.stats
+        stats.inc_value('snapshot/changed')
+        if changes & NEW:
+            stats.inc_value('snapshot/new')
+        if changes & PRICE:
+            stats.inc_value('snapshot/price_changed')
+        if changes & OUT_OF_STOCK:
+            stats.inc_value('snapshot/out_of_stock')
+        if self.delta_exporter is not None:
+            self.delta_exporter.export_item(item)
+        return item
+
+    def close_spider(self, spider):
+        self.store.finish_run()
+        self.store.close()
+        if self.delta_exporter is not None:
+            self.delta_exporter.finish_exporting()
+            self.delta_file.close()
@@ -0,0 +1,148 @@
+import os
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+
+# Категории кода для отчета: (название, фрагменты пути файла). Выборка относится к категории
+# самого глубокого кадра стека, путь которого содержит один из фрагментов
+CATEGORIES = (
+    ('spider callbacks', ('/alkoteka/spiders/',)),
+    ('loaders', ('/alkoteka/loaders/', '/itemloaders/')),
+    ('extractors', ('/alkoteka/extractors/',)),
+    ('json', ('/alkoteka/jsondecoder.py', '/json/')),
+    ('validation', ('/alkoteka/models.py', '/pydantic/')),
+    ('pipelines', ('/alkoteka/pipelines.py', '/scrapy/pipelines/', '/scrapy/exporters.py')),
+    ('middlewares', ('/alkoteka/middlewares.py', '/alkoteka/proxypool.py', '/alkoteka/headerpool.py',
+                     '/scrapy/downloadermiddlewares/', '/scrapy/spidermiddlewares/')),
+    ('state and caches', ('/alkoteka/state.py', '/sqlite3/')),
+    ('metrics', ('/alkoteka/metrics.py', '/alkoteka/extensions.py', '/alkoteka/profiling.py')),
+)
+
+# Категории по самому глубокому кадру, если в стеке нет кода из CATEGORIES
+FALLBACK_CATEGORIES = (
+    ('reactor wait', ('/selectors.py',)),
+    ('scrapy and twisted', ('/scrapy/', '/twisted/', '/asyncio/')),
+)
+
+# Глубина стека, которая учитывается в выборке
+MAX_DEPTH = 64
+
+
+def _match(filename: str, categories: tuple) -> str | None:
+    filename = filename.replace('\\', '/')
+    for name, fragments in categories:
+        if any(fragment in filename for fragment in fragments):
+            return name
+    return None
+
+
+def category_of(filenames: tuple[str, ...]) -> str:
+    """Категория выборки по файлам кадров стека (от самого глубокого)"""
+    for filename in filenames:
+        name = _match(filename, CATEGORIES)
+        if name is not None:
+            return name
+    return (_match(filenames[0], FALLBACK_CATEGORIES) if filenames else None) or 'other'
+
+
+class SamplingProfiler:
+    """Статистический профилировщик потока реактора: фоновый поток раз в interval секунд
+    снимает стек потока и считает выборки по категориям кода и по функциям.
+
+    Стоимость - одна выборка стека за interval, без трассировки каждого вызова (в отличие от cProfile).
+    """
+
+    def __init__(self, interval: float = 0.01, thread_id: int | None = None):
+        self.interval = interval
+        self.thread_id = thread_id if thread_id is not None else threading.main_thread().ident
+        self.samples = 0
+        self.categories: Counter = Counter()
+        # (файл, строка, функция) самого глубокого кадра
+        self.self_samples: Counter = Counter()
+        # (файл, функция) всех кадров стека (каждая функция - один раз на выборку)
+        self.total_samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='alkoteka-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.sample(frame)
+
+    def sample(self, frame):
+        stack = []
+        while frame is not None and len(stack) < MAX_DEPTH:
+            code = frame.f_code
+            stack.append((code.co_filename, frame.f_lineno, code.co_name))
+            frame = frame.f_back
+        if not stack:
+            return
+        self.samples += 1
+        self.categories[category_of(tuple(filename for filename, _, _ in stack))] += 1
+        self.self_samples[stack[0]] += 1
+        self.total_samples.update({(filename, name) for filename, _, name in stack})
+
+    def report(self, limit: int = 25) -> str:
+        if not self.samples:
+            return 'CPU: выборок нет'
+        lines = [f'CPU: {self.samples} выборок по {self.interval * 1000:.0f} мс (~{self.samples * self.interval:.1f} сек)',
+                 '', 'По категориям:']
+        for name, count in self.categories.most_common():
+            lines.append(f'  {count / self.samples:7.1%}  {name}')
+        lines += ['', f'Собственное время (топ {limit}):']
+        for (filename, lineno, name), count in self.self_samples.most_common(limit):
+            lines.append(f'  {count / self.samples:7.1%}  {name}  {filename}:{lineno}')
+        lines += ['', f'Включая вызовы (топ {limit}):']
+        for (filename, name), count in self.total_samples.most_common(limit):
+            lines.append(f'  {count / self.samples:7.1%}  {name}  {filename}')
+        return '\n'.join(lines)
+
+
+def allocation_report(snapshot: tracemalloc.Snapshot, limit: int = 25,
+                      previous: tracemalloc.Snapshot | None = None) -> str:
+    """Места наибольших выделений памяти (или их роста относительно previous) и их сумма по категориям кода"""
+    snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+    if previous is not None:
+        title = 'Рост памяти'
+        size_of = lambda stat: stat.size_diff
+        statistics = lambda key_type: snapshot.compare_to(previous, key_type)
+    else:
+        title = 'Память'
+        size_of = lambda stat: stat.size
+        statistics = snapshot.statistics
+
+    # Категория - по всему сохраненному стеку (PROFILING_TRACEMALLOC_FRAMES), места - по строке выделения
+    categories: Counter = Counter()
+    for stat in statistics('traceback'):
+        categories[category_of(tuple(frame.filename for frame in reversed(stat.traceback)))] += size_of(stat)
+    stats = statistics('lineno')
+
+    lines = [f'{title} по категориям:']
+    for name, size in categories.most_common():
+        lines.append(f'  {size / 1024 / 1024:9.2f} МБ  {name}')
+    lines += ['', f'{title} по местам выделения (топ {limit}):']
+    for stat in sorted(stats, key=size_of, reverse=True)[:limit]:
+        frame = stat.traceback[0]
+        lines.append(f'  {size_of(stat) / 1024 / 1024:9.2f} МБ  {frame.filename}:{frame.lineno}')
+    return '\n'.join(lines)
+
+
+def current_rss_mb() -> float | None:
+    """Текущий RSS процесса, МБ (Linux: /proc/self/statm; иначе None)"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
@@ -0,0 +1,174 @@
+import pathlib
+import random
+from urllib.parse import urlsplit
+
+from scrapy.utils.url import add_http_if_no_scheme
+
+
+class ProxyHealth:
+    """Состояние одного прокси: EWMA задержки и доли ошибок, бан с экспоненциальной паузой"""
+
+    __slots__ = ('latency', 'error_rate', 'in_flight', 'banned_until', 'bans_in_row',
+                 'requests', 'errors', 'bans')
+
+    def __init__(self):
+        # None - прокси еще не отвечал (такие прокси пробуются в первую очередь)
+        self.latency: float | None = None
+        self.error_rate = 0.0
+        self.in_flight = 0
+        self.banned_until = 0.0
+        self.bans_in_row = 0
+        self.requests = 0
+        self.errors = 0
+        self.bans = 0
+
+
+class ProxyPool:
+    """Пул прокси с выбором по здоровью.
+
+    Для каждого прокси хранятся EWMA задержки ответа и доли ошибок. Запрос получает лучший из двух
+    случайных доступных прокси (меньше задержка с учетом ошибок и запросов в работе): быстрые прокси
+    получают больше запросов, но нагрузка не собирается на одном. Забаненный прокси недоступен
+    backoff_base * 2^(банов подряд) секунд, но не больше backoff_max.
+
+    Бан работает как автоматический выключатель: после паузы прокси получает только один пробный
+    запрос за раз, пока не ответит успешно (новый бан - пауза вдвое больше).
+    """
+
+    # Вес доли ошибок в оценке прокси
+    ERROR_PENALTY = 4.0
+
+    def __init__(self, alpha: float = 0.3, backoff_base: float = 60.0, backoff_max: float = 3600.0,
+                 rng: random.Random | None = None):
+        self.alpha = alpha
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.rng = rng or random.Random()
+        self.proxies: dict[str, ProxyHealth] = {}
+
+    @staticmethod
+    def read_list(path: str | pathlib.Path) -> list[str]:
+        """Адреса прокси из файла: по одному в строке, пустые строки и # - пропускаются"""
+        proxies = []
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    proxies.append(add_http_if_no_scheme(line))
+        return proxies
+
+    @staticmethod
+    def display_name(proxy: str) -> str:
+        """Адрес прокси без логина и пароля (для логов и статистики)"""
+        parts = urlsplit(proxy)
+        return f'{parts.scheme}://{parts.hostname}:{parts.port}' if parts.port else f'{parts.scheme}://{parts.hostname}'
+
+    def update(self, proxies: list[str]) -> tuple[int, int]:
+        """Замена списка прокси с сохранением состояния оставшихся; (добавлено, удалено)"""
+        current = dict.fromkeys(proxies)
+        removed = [proxy for proxy in self.proxies if proxy not in current]
+        for proxy in removed:
+            del self.proxies[proxy]
+        added = 0
+        for proxy in current:
+            if proxy not in self.proxies:
+                self.proxies[proxy] = ProxyHealth()
+                added += 1
+        return added, len(removed)
+
+    def score(self, health: ProxyHealth) -> float:
+        """Оценка прокси: меньше - лучше"""
+        return (health.latency or 0.0) * (1 + health.in_flight) * (1 + self.ERROR_PENALTY * health.error_rate)
+
+    def choose(self, now: float, avoid: str | None = None) -> str | None:
+        """Прокси для запроса (None - все прокси в бане или список пуст); avoid - не выбирать этот прокси,
+        если есть другие доступные"""
+        available = [proxy for proxy, health in self.proxies.items()
+                     if health.banned_until <= now and not (health.bans_in_row and health.in_flight)]
+        if avoid is not None and len(available) > 1 and avoid in available:
+            available.remove(avoid)
+        if not available:
+            return None
+        if len(available) == 1:
+            return available[0]
+        first, second = self.rng.sample(available, 2)
+        return first if self.score(self.proxies[first]) <= self.score(self.proxies[second]) else second
+
+    def earliest(self) -> str | None:
+        """Прокси, бан которого закончится раньше всех"""
+        if not self.proxies:
+            return None
+        return min(self.proxies, key=lambda proxy: self.proxies[proxy].banned_until)
+
+    def available(self, now: float) -> int:
+        return sum(1 for health in self.proxies.values() if health.banned_until <= now)
+
+    def start(self, proxy: str):
+        health = self.proxies.get(proxy)
+        if health is not None:
+            health.in_flight += 1
+            health.requests += 1
+
+    def finish(self, proxy: str) -> ProxyHealth | None:
+        health = self.proxies.get(proxy)
+        if health is not None:
+            health.in_flight = max(health.in_flight - 1, 0)
+        return health
+
+    def success(self, proxy: str, latency: float):
+        health = self.finish(proxy)
+        if health is None:
+            return
+        health.latency = latency if health.latency is None else \
+            self.alpha * latency + (1 - self.alpha) * health.latency
+        health.error_rate *= 1 - self.alpha
+        health.bans_in_row = 0
+
+    def error(self, proxy: str, latency: float | None = None):
+        """Ошибка без бана (5xx, 429): прокси остается доступным, но теряет в оценке"""
+        health = self.finish(proxy)
+        if health is None:
+            return
+        if latency is not None:
+            health.latency = latency if health.latency is None else \
+                self.alpha * latency + (1 - self.alpha) * health.latency
+        health.error_rate = self.alpha + (1 - self.alpha) * health.error_rate
+        health.errors += 1
+
+    def ban(self, proxy: str, now: float) -> float:
+        """Бан прокси; возвращает длительность паузы в секундах"""
+        if self.finish(proxy) is None:
+            return 0.0
+        return self.trip(proxy, now)
+
+    def trip(self, proxy: str, now: float) -> float:
+        """Бан прокси по ответу, который уже учтен (запрос завершен); возвращает длительность паузы"""
+        health = self.proxies.get(proxy)
+        if health is None:
+            return 0.0
+        pause = min(self.backoff_base * 2 ** health.bans_in_row, self.backoff_max)
+        health.banned_until = now + pause
+        health.bans_in_row += 1
+        health.bans += 1
+        health.error_rate = self.alpha + (1 - self.alpha) * health.error_rate
+        return pause
+
+    def penalize(self, proxy: str):
+        """Ошибка по ответу, который уже учтен (например, испорченный JSON): прокси теряет в оценке"""
+        health = self.proxies.get(proxy)
+        if health is not None:
+            health.error_rate = self.alpha + (1 - self.alpha) * health.error_rate
+            health.errors += 1
+
+    def snapshot(self) -> dict[str, dict]:
+        """Состояние прокси для статистики: {адрес без логина и пароля: значения}"""
+        return {
+            self.display_name(proxy): {
+                'latency_ms': round(health.latency * 1000, 1) if health.latency is not None else None,
+                'error_rate': round(health.error_rate, 3),
+                'requests': health.requests,
+                'errors': health.errors,
+                'bans': health.bans,
+            }
+            for proxy, health in self.proxies.items()
+        }
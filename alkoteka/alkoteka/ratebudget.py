@@ -0,0 +1,36 @@
+import multiprocessing
+import zlib
+
+
+class RateBudget:
+    """Общий для нескольких процессов предел скорости запросов по ключам (прокси, домен).
+
+    Для каждого ключа хранится время, с которого разрешен следующий запрос (GCRA - "виртуальное"
+    ведро токенов): запрос резервирует время для всех своих ключей сразу и ждет до него.
+    Времена хранятся в разделяемом массиве фиксированного размера; ключ попадает в ячейку по crc32,
+    поэтому при совпадении ячеек два ключа делят один предел (скорость только ниже, не выше).
+
+    Экземпляр передается в процессы сбора при их создании (multiprocessing, spawn) - см. launcher.py.
+    """
+
+    # Экземпляр, общий для процессов сбора (устанавливается в процессе сбора до запуска краулера)
+    shared: 'RateBudget | None' = None
+
+    def __init__(self, slots: int = 4096, context=None):
+        self.slots = slots
+        self.next_times = (context or multiprocessing).Array('d', slots)
+
+    def slot(self, key: str) -> int:
+        # crc32 одинаков во всех процессах (в отличие от hash() строк)
+        return zlib.crc32(key.encode('utf-8')) % self.slots
+
+    def reserve(self, limits: list[tuple[str, float]], now: float) -> float:
+        """Резервирование запроса для ключей [(ключ, запросов/сек)]; возвращает ожидание в секундах"""
+        if not limits:
+            return 0.0
+        indexes = [(self.slot(key), rate) for key, rate in limits]
+        with self.next_times.get_lock():
+            start = max(now, *(self.next_times[index] for index, _ in indexes))
+            for index, rate in indexes:
+                self.next_times[index] = max(self.next_times[index], start + 1 / rate)
+        return start - now
@@ -29,7 +29,9 @@ ADDONS = {}
 ROBOTSTXT_OBEY = False
 
 # Concurrency and throttling settings
-#CONCURRENT_REQUESTS = 16
+# Общий предел одновременных запросов; предел и задержка для каждого прокси - PROXY_THROTTLE_*
+CONCURRENT_REQUESTS = 32
+# Запросы без прокси (и все запросы при PROXY_THROTTLE_ENABLED = False)
 CONCURRENT_REQUESTS_PER_DOMAIN = 1
 DOWNLOAD_DELAY = 1
 
@@ -50,6 +52,8 @@ DOWNLOAD_DELAY = 1
 SPIDER_MIDDLEWARES = {
    # "alkoteka.middlewares.AlkotekaSpiderMiddleware": 543,
    "alkoteka.middlewares.JSONResponseValidateSpiderMiddleware": 500,
+   # Ближе всех к пауку: CPU время callback без других middleware
+   "alkoteka.middlewares.StageMetricsSpiderMiddleware": 950,
 }
 
 # Enable or disable downloader middlewares
@@ -57,30 +61,108 @@ SPIDER_MIDDLEWARES = {
 DOWNLOADER_MIDDLEWARES = {
     # "alkoteka.middlewares.AlkotekaDownloaderMiddleware": 543,
     "scrapy.downloadermiddlewares.useragent.UserAgentMiddleware": None,
-    "alkoteka.middlewares.BrowserHeadersReplaceDownloaderMiddleware": 400,
-    "rotating_proxies.middlewares.RotatingProxyMiddleware": 610,
-    "rotating_proxies.middlewares.BanDetectionMiddleware": 620,
+    # После распаковки ответа (HttpCompressionMiddleware, 590): повтор ответов API, которые не являются JSON
+    "alkoteka.middlewares.PayloadRetryDownloaderMiddleware": 585,
+    "alkoteka.middlewares.ProxyPoolDownloaderMiddleware": 610,
+    # После выбора прокси: общий для процессов launcher.py предел скорости по прокси и домену
+    "alkoteka.middlewares.RateBudgetDownloaderMiddleware": 612,
+    "alkoteka.middlewares.ProxySlotThrottleDownloaderMiddleware": 615,
+    # После ProxyPoolDownloaderMiddleware: заголовки закрепляются за прокси
+    "alkoteka.middlewares.BrowserHeadersReplaceDownloaderMiddleware": 620,
 }
 
-# Настройки scrapy-rotating-proxies
-ROTATING_PROXY_LIST_PATH = PROJECT_DIR_PATH / 'proxies.txt'
-ROTATING_PROXY_PAGE_RETRY_TIMES = 5
-ROTATING_PROXY_CLOSE_SPIDER = False                             # True для остановки сбора при исчерпании прокси
+# Наборы заголовков браузера (BrowserHeadersReplaceDownloaderMiddleware)
+BROWSER_HEADERS_POOL_SIZE = 50                                  # запас заранее сгенерированных наборов
+BROWSER_HEADERS_STICKY_REQUESTS = 100                           # запросов сессии (прокси) с одним набором
+BROWSER_HEADERS_CACHE_PATH = PROJECT_DIR_PATH / '.state' / 'headers.json'  # неотправленные наборы для следующего запуска (None - не сохранять)
+
+# Пул прокси с выбором по задержке и ошибкам (ProxyPoolDownloaderMiddleware)
+PROXY_POOL_ENABLED = True
+PROXY_POOL_LIST_PATH = PROJECT_DIR_PATH / 'proxies.txt'         # перечитывается при изменении файла
+PROXY_POOL_LIST = []                                            # прокси в дополнение к файлу
+PROXY_POOL_RELOAD_INTERVAL = 30                                 # проверка изменения файла, сек
+PROXY_POOL_PAGE_RETRY_TIMES = 5                                 # повторов запроса через другой прокси при бане
+PROXY_POOL_CLOSE_SPIDER = False                                 # True для остановки сбора, если все прокси в бане
+PROXY_POOL_BAN_CODES = [403]                                    # статусы ответа - признаки бана
+PROXY_POOL_BAN_HTML = True                                      # HTML страница вместо JSON - признак бана
+PROXY_POOL_EWMA_ALPHA = 0.3                                     # вес нового значения в EWMA задержки и ошибок
+PROXY_POOL_BACKOFF_BASE = 60                                    # пауза после первого бана, сек (далее - вдвое больше)
+PROXY_POOL_BACKOFF_MAX = 3600
+
+# Повтор ответов API, которые не являются JSON: страница бана, обрезанный ответ (PayloadRetryDownloaderMiddleware)
+PAYLOAD_RETRY_ENABLED = True
+PAYLOAD_RETRY_TIMES = 3                                         # повторов одного запроса (через другой прокси)
+PAYLOAD_RETRY_BACKOFF_BASE = 2                                  # пауза перед первым повтором, сек (далее - вдвое больше)
+PAYLOAD_RETRY_BACKOFF_MAX = 60
+DEAD_LETTER_PATH = PROJECT_DIR_PATH / 'output' / 'dead_letter.jsonl'  # запросы, исчерпавшие повторы (None - не записывать)
+
+# Общий предел скорости запросов для всех процессов сбора (RateBudgetDownloaderMiddleware, launcher.py)
+RATE_BUDGET_PER_PROXY = 0                                       # запросов/сек через один прокси, 0 - без предела
+RATE_BUDGET_PER_DOMAIN = 8                                      # запросов/сек к одному домену, 0 - без предела
+                                                                # (без предела launcher.py не запускает больше одного процесса)
+RATE_BUDGET_SLOTS = 4096                                        # ячеек разделяемой памяти для ключей
+
+# Сбор в несколько процессов (python -m alkoteka.launcher)
+SHARD_WORKDIR = PROJECT_DIR_PATH / 'output' / 'shards'          # выгрузки и логи шардов до объединения
+SHARD_MANIFEST_PATH = None                                      # задается launcher.py для каждого шарда
+
+# Слоты загрузчика по прокси и типу запроса (ProxySlotThrottleDownloaderMiddleware)
+PROXY_THROTTLE_ENABLED = True
+PROXY_THROTTLE_CONCURRENCY = {                                  # одновременных запросов на прокси
+    'listing': 1,
+    'detail': 2,
+    'other': 1,
+}
+PROXY_THROTTLE_START_RATE = 1.0                                 # начальная скорость слота, запросов/сек
+PROXY_THROTTLE_MIN_RATE = 0.05
+PROXY_THROTTLE_MAX_RATE = 8.0
+PROXY_THROTTLE_RATE_STEP = 0.1                                  # прирост скорости после успешного ответа
+PROXY_THROTTLE_TARGET_LATENCY = 2.0                             # ответы медленнее этого снижают скорость, сек
+PROXY_THROTTLE_BAN_CODES = PROXY_POOL_BAN_CODES                 # признаки бана без ProxyPoolDownloaderMiddleware
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
+EXTENSIONS = {
 #    "scrapy.extensions.telnet.TelnetConsole": None,
-#}
+    "alkoteka.extensions.MetricsExporterExtension": 500,
+    "alkoteka.extensions.ProfilingExtension": 510,
+    "alkoteka.extensions.MemoryWatchdogExtension": 520,
+}
+
+# Метрики этапов сбора (MetricsExporterExtension, StageMetricsSpiderMiddleware)
+METRICS_ENABLED = True
+METRICS_PATH = PROJECT_DIR_PATH / 'output' / 'metrics.prom'     # None - только строка прогресса в логе
+METRICS_FORMAT = 'prometheus'                                   # prometheus | json
+METRICS_INTERVAL = 30                                           # период выгрузки, сек
+
+# Профилирование CPU и памяти (ProfilingExtension), по умолчанию выключено
+PROFILING_ENABLED = False
+PROFILING_DIR = PROJECT_DIR_PATH / 'output' / 'profiling'       # каталог отчетов
+PROFILING_INTERVAL = 0.01                                       # период выборки стека, сек
+PROFILING_TRACEMALLOC_FRAMES = 1                                # глубина стека tracemalloc, 0 - без tracemalloc
+PROFILING_SIGNAL = 'SIGUSR1'                                    # отчет по сигналу: kill -USR1 <pid>
+PROFILING_TOP = 25                                              # строк в каждом разделе отчета
+
+# Сторож памяти (MemoryWatchdogExtension): места выделения памяти в лог при превышении RSS
+MEMORY_WATCHDOG_RSS_MB = 0                                      # порог RSS, МБ; 0 - выключен
+MEMORY_WATCHDOG_STEP_MB = 256                                   # следующий порог - на столько выше
+MEMORY_WATCHDOG_INTERVAL = 10                                   # период проверки, сек
+MEMORY_WATCHDOG_TOP = 15                                        # мест выделения в логе
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 ITEM_PIPELINES = {
     # "alkoteka.pipelines.AlkotekaPipeline": 300,
-    "alkoteka.pipelines.FormatingFieldsPipeline": 400,
-    "alkoteka.pipelines.ValidateFieldsPipeline": 500,
+    # Форматирование, валидация и переименование за один проход
+    # (вместо цепочки FormatingFieldsPipeline: 400, ValidateFieldsPipeline: 500, RenameFieldsPipeline: 600)
+    "alkoteka.pipelines.ProcessFieldsPipeline": 500,
+    # Форматирование и валидация в пуле процессов при PIPELINE_POOL_ENABLED (ProcessFieldsPipeline - только переименование)
+    "alkoteka.pipelines.ProcessPoolPipeline": 450,
     # до 550 вкл - input преобразование, после (551+) - output преобразование
-    "alkoteka.pipelines.RenameFieldsPipeline": 600,
+    "alkoteka.pipelines.StoreTablePipeline": 560,
+    "alkoteka.pipelines.CityPartitionPipeline": 700,
+    # История цен и наличия при SNAPSHOT_ENABLED
+    "alkoteka.pipelines.SnapshotPipeline": 800,
 }
 
 # Enable and configure the AutoThrottle extension (disabled by default)
@@ -114,7 +196,13 @@ URLS_FILENAME = PROJECT_DIR_PATH / 'links.txt'
 # Настройки для сбора данных
 PARSING_PARAMS = {
     'products_by_category': {
-        'PER_PAGE': 20,                     # Количество товаров на странице
+        'PER_PAGE': 20,                     # Количество товаров на странице (если API не примет PER_PAGE_MAX)
+        'PER_PAGE_MAX': 100,                # Наибольшее количество товаров на странице для пробного запроса
+        'PAGES_WINDOW': 5,                  # Страниц категории наперед, если API не сообщает их количество
+        'MAX_PENDING_DETAILS': 200,         # Запросов страниц товаров категории в работе (None - без ограничения)
+        'DEDUP_PRODUCTS': True,             # Товар из нескольких категорий - один запрос и один item
+        'EXTRACTOR': 'compiled',            # Сборка item: 'compiled' - за один проход по JSON, 'loaders' - ItemLoader
+        'MODE': 'full',                     # 'full' - со страницами товаров, 'listing' - только строки листинга (partial)
         'DEFAULT_CITY_NAME': 'Краснодар',   # Город по умолчанию для сбора данных
         'CITY_URL': 'https://alkoteka.com/web-api/v1/city?city_uuid=396df2b5-7b2b-11eb-80cd-00155d039009',
         'PRODUCT_URL': 'https://alkoteka.com/web-api/v1/product',
@@ -136,3 +224,51 @@ RENAME_PATTERN = {
         }
     }
 }
+
+# Хранилище состояния товаров (SQLite): повторная выдача item без запроса страницы товара,
+# если строка листинга не изменилась и с последнего запроса страницы прошло меньше PRODUCT_STATE_TTL секунд
+PRODUCT_STATE_ENABLED = False
+PRODUCT_STATE_PATH = PROJECT_DIR_PATH / '.state' / 'products.sqlite3'
+PRODUCT_STATE_TTL = 3600
+
+# Кеш не зависящих от города полей страниц товаров (описание, характеристики, изображение и т.п.),
+# общий для всех городов и запусков; цена, наличие и магазины разбираются для каждого города
+PRODUCT_STATIC_CACHE_ENABLED = False
+PRODUCT_STATIC_CACHE_PATH = PROJECT_DIR_PATH / '.state' / 'static.sqlite3'
+PRODUCT_STATIC_CACHE_TTL = 86400                                # время актуальности полей, сек
+PRODUCT_STATIC_CACHE_MEMORY = 10000                             # товаров в памяти
+# True - при наличии полей в кеше страница товара не запрашивается: цена и наличие берутся
+# из строки листинга, stores_list остается пустым
+PRODUCT_STATIC_CACHE_SKIP_DETAIL = False
+
+# Раздельная выгрузка по городам при сборе нескольких городов (-a city=all или -a city=Москва,Краснодар)
+CITY_PARTITION_DIR = PROJECT_DIR_PATH / 'output' / 'cities'    # None - не разделять
+CITY_PARTITION_FORMAT = 'json'                                  # json | jsonlines
+
+# Вывод магазинов в metadata.stores_list:
+# embedded - полные данные магазина в каждом item;
+# normalized - в item только {store_id, price, quantity}, магазины - один раз в STORES_TABLE_PATH
+STORES_OUTPUT = 'embedded'
+STORES_TABLE_PATH = PROJECT_DIR_PATH / 'output' / 'stores.json'
+
+# История цен и наличия между запусками (SnapshotPipeline, python -m alkoteka.snapshots)
+SNAPSHOT_ENABLED = False
+SNAPSHOT_PATH = PROJECT_DIR_PATH / 'output' / 'snapshots.sqlite3'
+SNAPSHOT_DELTA_PATH = None                                      # файл items, изменившихся с прошлого запуска (JSON lines)
+
+# Кеш списка городов: при действительном кеше сбор товаров начинается без загрузки списка городов
+CITY_CACHE_ENABLED = True
+CITY_CACHE_PATH = PROJECT_DIR_PATH / '.state' / 'cities.json'
+CITY_CACHE_TTL = 86400                                          # время актуальности кеша, сек
+CITY_CACHE_REFRESH_AFTER = 43200                                # через сколько сек обновлять кеш в фоне
+
+# Декодер JSON ответов: auto (orjson, затем msgspec, если установлены, иначе стандартный json) | orjson | msgspec | json
+JSON_DECODER = 'auto'
+
+# Форматирование и валидация items в пуле процессов (ProcessPoolPipeline) - разгружает поток реактора
+PIPELINE_POOL_ENABLED = False
+PIPELINE_POOL_WORKERS = None                                    # None - по количеству CPU
+PIPELINE_POOL_BATCH_SIZE = 50                                   # items в пачке
+PIPELINE_POOL_BATCH_TIMEOUT = 0.2                               # через сколько сек отправлять неполную пачку
+PIPELINE_POOL_MAX_BATCHES = None                                # пачек в работе одновременно (None - 2 на процесс)
+PIPELINE_POOL_PRESERVE_ORDER = True                             # выдавать items в порядке поступления
@@ -0,0 +1,379 @@
+"""История цен и наличия товаров между запусками сбора (SQLite): загрузка выгрузок, запросы и поток изменений.
+
+Каждый запуск (SnapshotPipeline во время сбора или загрузка готового файла) добавляет наблюдения
+товаров (RPC x город x запуск) - записи не изменяются и не удаляются. При добавлении наблюдение
+сравнивается с предыдущим наблюдением того же товара, а признаки изменений (новый товар, цена,
+наличие, любые другие поля) сохраняются вместе с ним, поэтому запросы "что изменилось в запуске"
+читают только измененные записи по индексу, без сравнения выгрузок целиком.
+
+Примеры:
+    python -m alkoteka.snapshots ingest output/result.json
+    python -m alkoteka.snapshots runs
+    python -m alkoteka.snapshots history 12345 --city Москва
+    python -m alkoteka.snapshots changes --kind price
+    python -m alkoteka.snapshots out-of-stock --run 7
+    python -m alkoteka.snapshots delta -O output/delta.jsonl
+"""
+import argparse
+import hashlib
+import json
+import pathlib
+import sqlite3
+import sys
+import time
+from typing import Any, Iterable, Iterator
+
+from itemadapter import ItemAdapter
+
+SPIDER_NAME = 'products_by_category'
+
+# Признаки изменений наблюдения относительно предыдущего наблюдения товара (битовая маска)
+NEW = 1
+PRICE = 2
+OUT_OF_STOCK = 4
+BACK_IN_STOCK = 8
+CONTENT = 16
+
+CHANGE_KINDS = {
+    'new': NEW,
+    'price': PRICE,
+    'out-of-stock': OUT_OF_STOCK,
+    'in-stock': BACK_IN_STOCK,
+    'stock': OUT_OF_STOCK | BACK_IN_STOCK,
+    'any': NEW | PRICE | OUT_OF_STOCK | BACK_IN_STOCK | CONTENT,
+}
+
+OBSERVATION_COLUMNS = ('rpc', 'city', 'run_id', 'timestamp', 'price_current', 'price_original', 'previous_price',
+                       'in_stock', 'stock_count', 'changes')
+
+
+class ItemFields:
+    """Имена полей item после RENAME_PATTERN (цена, наличие, ключ товара)"""
+
+    def __init__(self, rename_pattern: dict | None = None):
+        from .pipelines import compile_rename_rules, renamed_field
+
+        rules = compile_rename_rules((rename_pattern or {}).get(SPIDER_NAME) or {})
+        self.timestamp, _ = renamed_field(rules, 'timestamp')
+        self.city, _ = renamed_field(rules, 'city')
+        self.rpc, _ = renamed_field(rules, 'RPC')
+        self.price_data, self.price_current = renamed_field(rules, 'price_data', 'current')
+        _, self.price_original = renamed_field(rules, 'price_data', 'original')
+        self.stock, self.in_stock = renamed_field(rules, 'stock', 'in_stock')
+        _, self.stock_count = renamed_field(rules, 'stock', 'count')
+        self.partial, _ = renamed_field(rules, 'partial')
+
+
+class SnapshotStore:
+    """Хранилище наблюдений товаров по запускам (SQLite в режиме WAL).
+
+    observations - наблюдения (rpc, город, запуск) с ценой, наличием и признаками изменений;
+    contents     - полные items без timestamp, по хешу содержимого (неизмененный товар хранится один раз);
+    latest       - последнее наблюдение каждого товара (индекс для сравнения при добавлении).
+    """
+
+    COMMIT_EVERY = 500
+
+    def __init__(self, path: str | pathlib.Path, fields: ItemFields | None = None):
+        self.path = pathlib.Path(path)
+        self.fields = fields or ItemFields()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(
+            'CREATE TABLE IF NOT EXISTS runs ('
+            '    run_id INTEGER PRIMARY KEY AUTOINCREMENT,'
+            '    started_at REAL NOT NULL,'
+            '    finished_at REAL,'
+            '    source TEXT,'
+            '    items INTEGER NOT NULL DEFAULT 0'
+            ');'
+            'CREATE TABLE IF NOT EXISTS observations ('
+            '    rpc TEXT NOT NULL,'
+            '    city TEXT NOT NULL,'
+            '    run_id INTEGER NOT NULL,'
+            '    timestamp INTEGER,'
+            '    price_current REAL,'
+            '    price_original REAL,'
+            '    previous_price REAL,'
+            '    in_stock INTEGER,'
+            '    stock_count INTEGER,'
+            '    content_hash TEXT NOT NULL,'
+            '    changes INTEGER NOT NULL,'
+            '    PRIMARY KEY (rpc, city, run_id)'
+            ') WITHOUT ROWID;'
+            # Только измененные наблюдения: запросы изменений запуска не читают неизмененные товары
+            'CREATE INDEX IF NOT EXISTS observations_changes ON observations (run_id, changes) WHERE changes != 0;'
+            'CREATE TABLE IF NOT EXISTS contents ('
+            '    content_hash TEXT PRIMARY KEY,'
+            '    item TEXT NOT NULL'
+            ') WITHOUT ROWID;'
+            'CREATE TABLE IF NOT EXISTS latest ('
+            '    rpc TEXT NOT NULL,'
+            '    city TEXT NOT NULL,'
+            '    run_id INTEGER NOT NULL,'
+            '    price_current REAL,'
+            '    in_stock INTEGER,'
+            '    content_hash TEXT NOT NULL,'
+            '    PRIMARY KEY (rpc, city)'
+            ') WITHOUT ROWID;'
+        )
+        self.connection.commit()
+        self.run_id = None
+        self.run_items = 0
+        self._pending = 0
+
+    @classmethod
+    def from_settings(cls, settings) -> 'SnapshotStore':
+        return cls(settings.get('SNAPSHOT_PATH'), ItemFields(settings.getdict('RENAME_PATTERN')))
+
+    @staticmethod
+    def content_hash(item_dict: dict, timestamp_field: str) -> str:
+        raw = json.dumps({key: value for key, value in item_dict.items() if key != timestamp_field},
+                         ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+        return hashlib.blake2b(raw.encode('utf-8'), digest_size=16).hexdigest()
+
+    # Добавление
+
+    def begin_run(self, source: str | None = None) -> int:
+        cursor = self.connection.execute('INSERT INTO runs (started_at, source) VALUES (?, ?)', (time.time(), source))
+        self.connection.commit()
+        self.run_id = cursor.lastrowid
+        self.run_items = 0
+        return self.run_id
+
+    def add(self, item: Any) -> int:
+        """Наблюдение item в текущем запуске; возвращает признаки изменений (0 - товар не изменился).
+
+        Повтор товара в том же запуске не учитывается (остается первое наблюдение).
+        """
+        fields = self.fields
+        # ItemAdapter.asdict рекурсивно обходит все значения - для dict (выгрузки, переименованные items) не нужен
+        item_dict = item if isinstance(item, dict) else ItemAdapter(item).asdict()
+        rpc, city = str(item_dict.get(fields.rpc)), str(item_dict.get(fields.city))
+        price_data = item_dict.get(fields.price_data) or {}
+        stock = item_dict.get(fields.stock) or {}
+        price = price_data.get(fields.price_current)
+        in_stock = stock.get(fields.in_stock)
+        in_stock = None if in_stock is None else int(bool(in_stock))
+        content_hash = self.content_hash(item_dict, fields.timestamp)
+        partial = bool(item_dict.get(fields.partial))
+
+        previous = self.connection.execute(
+            'SELECT run_id, price_current, in_stock, content_hash FROM latest WHERE rpc = ? AND city = ?', (rpc, city)
+        ).fetchone()
+        if previous is not None and previous[0] == self.run_id:
+            return 0
+        changes = 0
+        previous_price = None
+        if previous is None:
+            changes = NEW
+        else:
+            _, previous_price, previous_in_stock, previous_hash = previous
+            # Значение, которого нет в item (partial item без цены или остатка), не сравнивается
+            if price is not None and previous_price is not None and price != previous_price:
+                changes |= PRICE
+            if in_stock is not None and previous_in_stock is not None:
+                if previous_in_stock and in_stock == 0:
+                    changes |= OUT_OF_STOCK
+                elif previous_in_stock == 0 and in_stock:
+                    changes |= BACK_IN_STOCK
+            # Item из листинга (partial) сравнивается только по цене и наличию: остальных полей в нем нет
+            if content_hash != previous_hash and not partial:
+                changes |= CONTENT
+
+        if changes:
+            self.connection.execute('INSERT OR IGNORE INTO contents (content_hash, item) VALUES (?, ?)',
+                                    (content_hash, json.dumps(item_dict, ensure_ascii=False)))
+        self.connection.execute(
+            'INSERT OR IGNORE INTO observations (rpc, city, run_id, timestamp, price_current, price_original, '
+            'previous_price, in_stock, stock_count, content_hash, changes) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (rpc, city, self.run_id, item_dict.get(fields.timestamp), price, price_data.get(fields.price_original),
+             previous_price, in_stock, stock.get(fields.stock_count), content_hash, changes)
+        )
+        # После partial item содержимое товара сравнивается с последним полным item,
+        # а цена и наличие, которых в нем нет, - с последними известными
+        latest_hash = previous[3] if partial and previous is not None else content_hash
+        if previous is not None:
+            price = previous[1] if price is None else price
+            in_stock = previous[2] if in_stock is None else in_stock
+        self.connection.execute(
+            'INSERT OR REPLACE INTO latest (rpc, city, run_id, price_current, in_stock, content_hash) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (rpc, city, self.run_id, price, in_stock, latest_hash)
+        )
+        self.run_items += 1
+        self._pending += 1
+        if self._pending >= self.COMMIT_EVERY:
+            self.commit()
+        return changes
+
+    def finish_run(self):
+        self.connection.execute('UPDATE runs SET finished_at = ?, items = ? WHERE run_id = ?',
+                                (time.time(), self.run_items, self.run_id))
+        self.commit()
+
+    def ingest(self, items: Iterable, source: str | None = None) -> int:
+        """Загрузка items одного запуска (например, из выгрузки); возвращает номер запуска"""
+        run_id = self.begin_run(source)
+        for item in items:
+            self.add(item)
+        self.finish_run()
+        return run_id
+
+    def commit(self):
+        self.connection.commit()
+        self._pending = 0
+
+    def close(self):
+        self.commit()
+        self.connection.close()
+
+    # Запросы
+
+    def _rows(self, sql: str, params: Iterable = ()) -> list[dict]:
+        cursor = self.connection.execute(sql, tuple(params))
+        columns = [description[0] for description in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor]
+
+    def runs(self) -> list[dict]:
+        return self._rows('SELECT run_id, started_at, finished_at, source, items FROM runs ORDER BY run_id')
+
+    def last_run_id(self) -> int | None:
+        row = self.connection.execute('SELECT MAX(run_id) FROM runs').fetchone()
+        return row[0]
+
+    def history(self, rpc: str, city: str | None = None) -> list[dict]:
+        """Цена и наличие товара по запускам"""
+        sql = f'SELECT {", ".join(OBSERVATION_COLUMNS)} FROM observations WHERE rpc = ?'
+        params = [str(rpc)]
+        if city is not None:
+            sql += ' AND city = ?'
+            params.append(city)
+        return self._rows(sql + ' ORDER BY city, run_id', params)
+
+    def changes(self, run_id: int | None = None, kinds: int = PRICE) -> list[dict]:
+        """Товары с изменениями kinds (маска NEW | PRICE | ...) в запуске run_id (по умолчанию - последнем)
+        относительно их предыдущего наблюдения"""
+        run_id = run_id if run_id is not None else self.last_run_id()
+        return self._rows(
+            f'SELECT {", ".join(OBSERVATION_COLUMNS)} FROM observations '
+            f'WHERE run_id = ? AND changes != 0 AND changes & ? != 0 ORDER BY city, rpc',
+            (run_id, kinds)
+        )
+
+    def out_of_stock(self, run_id: int | None = None) -> list[dict]:
+        """Товары, которых не стало в наличии в запуске run_id"""
+        return self.changes(run_id, OUT_OF_STOCK)
+
+    def delta(self, run_id: int | None = None, kinds: int = CHANGE_KINDS['any']) -> Iterator[dict]:
+        """Полные items, изменившиеся в запуске run_id (поток изменений)"""
+        run_id = run_id if run_id is not None else self.last_run_id()
+        cursor = self.connection.execute(
+            'SELECT contents.item, observations.timestamp FROM observations '
+            'JOIN contents ON contents.content_hash = observations.content_hash '
+            'WHERE observations.run_id = ? AND observations.changes != 0 AND observations.changes & ? != 0 '
+            'ORDER BY observations.city, observations.rpc',
+            (run_id, kinds)
+        )
+        for raw, timestamp in cursor:
+            item = json.loads(raw)
+            # В contents item хранится с timestamp первого наблюдения этого содержимого
+            if self.fields.timestamp in item:
+                item[self.fields.timestamp] = timestamp
+            yield item
+
+
+def read_items(path: str | pathlib.Path) -> Iterator[dict]:
+    """Items выгрузки: JSON lines или JSON-массив Scrapy (по одному item в строке - без загрузки файла целиком)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        first = f.readline()
+        if not first.lstrip().startswith('['):
+            if first.strip():
+                yield json.loads(first)
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        yielded = 0
+        for line in f:
+            line = line.strip().rstrip(',')
+            if not line or line == ']':
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                # Массив не по одному item в строке (например, с отступами) - разбор файла целиком
+                f.seek(0)
+                yield from json.load(f)[yielded:]
+                return
+            yielded += 1
+            yield item
+
+
+def print_rows(rows: list[dict], out=sys.stdout):
+    if not rows:
+        return
+    columns = list(rows[0])
+    out.write('\t'.join(columns) + '\n')
+    for row in rows:
+        out.write('\t'.join('' if row[column] is None else str(row[column]) for column in columns) + '\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--path', help='файл базы (по умолчанию SNAPSHOT_PATH)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    ingest = commands.add_parser('ingest', help='загрузить выгрузки (.json / .jsonl) - каждую как отдельный запуск')
+    ingest.add_argument('files', nargs='+', help='файлы в порядке сбора')
+    commands.add_parser('runs', help='запуски')
+    history = commands.add_parser('history', help='цена и наличие товара по запускам')
+    history.add_argument('rpc')
+    history.add_argument('--city')
+    changes = commands.add_parser('changes', help='товары, изменившиеся в запуске')
+    changes.add_argument('--run', type=int, help='номер запуска (по умолчанию - последний)')
+    changes.add_argument('--kind', choices=list(CHANGE_KINDS), default='price')
+    out_of_stock = commands.add_parser('out-of-stock', help='товары, которых не стало в наличии')
+    out_of_stock.add_argument('--run', type=int)
+    delta = commands.add_parser('delta', help='выгрузка изменившихся items (JSON lines)')
+    delta.add_argument('--run', type=int)
+    delta.add_argument('--kind', choices=list(CHANGE_KINDS), default='any')
+    delta.add_argument('-O', dest='output', help='файл выгрузки (по умолчанию - stdout)')
+    args = parser.parse_args(argv)
+
+    from scrapy.utils.project import get_project_settings
+
+    settings = get_project_settings()
+    store = SnapshotStore(args.path or settings.get('SNAPSHOT_PATH'), ItemFields(settings.getdict('RENAME_PATTERN')))
+    try:
+        if args.command == 'ingest':
+            for path in args.files:
+                run_id = store.ingest(read_items(path), source=str(path))
+                changed = len(store.changes(run_id, CHANGE_KINDS['any']))
+                print(f'{path}: запуск {run_id}, items: {store.run_items}, изменилось: {changed}')
+        elif args.command == 'runs':
+            print_rows(store.runs())
+        elif args.command == 'history':
+            print_rows(store.history(args.rpc, args.city))
+        elif args.command == 'changes':
+            print_rows(store.changes(args.run, CHANGE_KINDS[args.kind]))
+        elif args.command == 'out-of-stock':
+            print_rows(store.out_of_stock(args.run))
+        elif args.command == 'delta':
+            out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+            try:
+                for item in store.delta(args.run, CHANGE_KINDS[args.kind]):
+                    out.write(json.dumps(item, ensure_ascii=False) + '\n')
+            finally:
+                if args.output:
+                    out.close()
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,16 @@
+from collections import deque
 from collections.abc import AsyncIterator
 from typing import Any, Iterable
+import functools
+import itertools
 import json
 import math
+import os
+import pathlib
 import re
 
 import scrapy
+from scrapy import signals
 from scrapy.http import Response
 from scrapy.exceptions import CloseSpider
 from scrapy.utils.project import get_project_settings
@@ -12,6 +18,40 @@ from scrapy.utils.project import get_project_settings
 from ..loaders.products_by_category_loaders import (
     AlkotekaLoader, MetadataPBCLoader, AssetsLoader, StockLoader, PriceDataLoader
 )
+from ..extractors.products_by_category_extractors import ProductsByCategoryExtractor
+from ..items import AlkotekaItem
+from ..jsondecoder import JSONDecoder
+from ..state import ProductStateStore, ProductStaticCache, CityDirectoryCache
+
+# Ссылка на категорию во входном файле (URLS_FILENAME)
+CATEGORY_URL_PATTERN = re.compile(r'^https://alkoteka\.com/catalog/[a-zA-Z0-9\-_]+$')
+
+
+def read_category_urls(urls_file) -> tuple[list[str], bool] | None:
+    """Валидные ссылки на категории из файла и признак, что валидны все строки; None, если файла нет.
+
+    Файл читается и проверяется один раз на его версию (время изменения и размер): повторные сборы
+    в одном процессе (alkoteka.api) не перечитывают его
+    """
+    try:
+        stat = os.stat(urls_file)
+    except OSError:
+        return None
+    urls, all_valid = _read_category_urls(str(urls_file), stat.st_mtime_ns, stat.st_size)
+    return list(urls), all_valid
+
+
+@functools.lru_cache(maxsize=8)
+def _read_category_urls(path: str, mtime_ns: int, size: int) -> tuple[tuple[str, ...], bool]:
+    urls = []
+    count = 0
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            count += 1
+            line = line.strip()
+            if line and CATEGORY_URL_PATTERN.match(line):
+                urls.append(line)
+    return tuple(urls), len(urls) == count
 
 
 class ProductsByCategorySpider(scrapy.Spider):
@@ -20,21 +60,56 @@ class ProductsByCategorySpider(scrapy.Spider):
     
     # Переменные, используемые в работе паука
     # city_url          - для получения списка городов
-    # cities            - словарь: Название_города=UUID_города
-    # city_name         - название города, для которого будет собираться информация
-    #                     (используется для получения city_uuid из cities)
-    # city_uuid         - uuid города, для которого будет собираться информация
-    # per_page          - количество продуктов на странице
+    # cities            - словарь: название_города (в нижнем регистре)=UUID_города
+    # city_titles       - словарь: название_города (в нижнем регистре)=Название_города (как на сайте)
+    # city_name         - название города (или несколько через запятую, или all - все города),
+    #                     для которого будет собираться информация (используется для получения city_uuids из cities)
+    # city_uuids        - словарь: Название_города=UUID_города для городов, по которым будет собираться информация
+    # per_page          - количество продуктов на странице (уточняется пробным запросом, если задан PER_PAGE_MAX)
+    # per_page_max      - наибольший per_page для пробного запроса
+    # pages_window      - количество страниц категории, запрашиваемых наперед, если API не сообщает число страниц
+    # scheduled_pages   - словарь: (uuid_города, slug_категории)=номер последней запрошенной страницы
+    # max_pending_details - наибольшее количество запросов страниц товаров категории в работе
+    #                     (None - все страницы категории запрашиваются сразу)
+    # frontier          - словарь: (uuid_города, slug_категории)=состояние обхода категории
+    #                     (отложенные страницы листинга, запросы листинга и страниц товаров в работе)
     # product_url       - для получения продуктов по категориям + для получения детальной информации о продукте
     # urls_from_file    - список ссылок на категории, которые будут прочитаны из файла и использованы для сбора данных
     #                     (будет забран slug из ссылок)
     # referer_url       - изначальная ссылка для подмены заголовка Referer
-
-    def __init__(self, city=None, *args, **kwargs):
+    # state_store       - хранилище состояния товаров (None - страница товара запрашивается всегда)
+    # city_cache        - кеш списка городов (None - список городов запрашивается при каждом запуске)
+    # fetched_cities    - словарь: Название_города=UUID_города, полученный с сайта в текущем запуске
+    # extractor         - сборщик item за один проход по JSON (None - сборка через ItemLoader)
+    # json_decoder      - декодер JSON ответов (общий результат с JSONResponseValidateSpiderMiddleware)
+    # dedup_products    - запрашивать страницу товара один раз, даже если товар есть в нескольких категориях
+    # product_categories - словарь: (uuid_города, slug_товара)=[slug_категории, ...] для еще не выданных товаров
+    # emitted_products  - множество (uuid_города, slug_товара) выданных товаров
+    # category_names    - словарь: slug_категории=Название_категории (со страниц товаров)
+    # static_cache      - кеш не зависящих от города полей товаров (None - поля разбираются для каждого города)
+    # static_skip_detail - не запрашивать страницу товара, если его поля есть в static_cache
+    #                     (цена и наличие - из строки листинга, без списка магазинов)
+    # state             - состояние обхода при запуске с JOBDIR (расширение SpiderState сохраняет его при остановке)
+    # page_stripe, page_stripes - страницы категорий шарда: номер страницы - 1 при делении на page_stripes
+    #                     дает остаток page_stripe (-a page_stripe=k/n; по умолчанию 0/1 - все страницы)
+    # shard_manifest_path - файл сведений шарда для объединения результатов (launcher.py; None - не записывается)
+    # shard_products    - словарь: Город|RPC=[slug_категории, ...] выданных товаров (только с shard_manifest_path)
+    # listing_only      - item только из строк листинга, без запросов страниц товаров (-a mode=listing):
+    #                     цена и наличие без описания, характеристик и магазинов, item помечается partial
+
+    # Поля паука, которые хранятся в state и восстанавливаются при продолжении сбора с JOBDIR
+    JOB_STATE_FIELDS = ('scheduled_pages', 'frontier', 'product_categories', 'emitted_products', 'category_names')
+
+    # Приоритет запроса страницы товара: выше листинга, чтобы товары уже найденных страниц
+    # собирались раньше следующих страниц категорий
+    DETAIL_PRIORITY = 10
+
+    def __init__(self, city=None, categories=None, page_stripe=None, per_page=None, mode=None, *args,
+                 settings=None, **kwargs):
         super().__init__(*args, **kwargs)
 
-        # Установка настроек из settings.py
-        self.settings = get_project_settings()
+        # Установка настроек краулера (с -s NAME=VALUE); без краулера - из settings.py
+        self.settings = settings if settings is not None else get_project_settings()
         # Установка настроек парсинга для текущего паука
         self.parsing_params = self.settings.get('PARSING_PARAMS', {}).get(self.name, None)
         if self.parsing_params is None:
@@ -53,77 +128,297 @@ class ProductsByCategorySpider(scrapy.Spider):
         self.product_url = self.parsing_params.get('PRODUCT_URL', None)
         # Установка per_page
         self.per_page = self.parsing_params.get('PER_PAGE', 20)
+        self.per_page_max = self.parsing_params.get('PER_PAGE_MAX') or self.per_page
+        # Установка per_page из командной строки (одинаковый per_page у всех шардов категории)
+        if per_page:
+            self.per_page = self.per_page_max = int(per_page)
+        # Установка части страниц категорий для шарда (-a page_stripe=k/n)
+        self.page_stripe, self.page_stripes = 0, 1
+        if page_stripe:
+            stripe, _, stripes = page_stripe.partition('/')
+            self.page_stripe, self.page_stripes = int(stripe), int(stripes or 1)
+            if not 0 <= self.page_stripe < self.page_stripes:
+                raise CloseSpider(f'page_stripe должен быть k/n, где 0 <= k < n, получено: {page_stripe!r}')
+        # Номера страниц зависят от per_page: шарды одной категории не определяют его пробным запросом
+        if self.page_stripes > 1:
+            self.per_page_max = self.per_page
+        # Установка окна пагинации
+        self.pages_window = self.parsing_params.get('PAGES_WINDOW', 5)
+        # Установка ограничения запросов страниц товаров категории
+        self.max_pending_details = self.parsing_params.get('MAX_PENDING_DETAILS', 200)
         # Установка referer
         self.referer_url = self.parsing_params.get('REFERER_URL', None)
+        # Установка объединения товаров из нескольких категорий
+        self.dedup_products = self.parsing_params.get('DEDUP_PRODUCTS', True)
+        # Установка способа сборки item
+        extractor = self.parsing_params.get('EXTRACTOR', 'compiled')
+        if extractor not in ('compiled', 'loaders'):
+            msg = f"EXTRACTOR должен быть 'compiled' или 'loaders', получено: {extractor!r}"
+            raise CloseSpider(msg)
+        self.extractor = ProductsByCategoryExtractor() if extractor == 'compiled' else None
+        # Установка режима сбора: full - со страницами товаров, listing - только строки листинга
+        mode = mode or self.parsing_params.get('MODE', 'full')
+        if mode not in ('full', 'listing'):
+            msg = f"mode должен быть 'full' или 'listing', получено: {mode!r}"
+            raise CloseSpider(msg)
+        self.listing_only = mode == 'listing'
+        if self.listing_only:
+            # Item из строки листинга собирает только ProductsByCategoryExtractor
+            self.extractor = self.extractor or ProductsByCategoryExtractor()
+            # Запросов страниц товаров нет - страницы листинга не ждут их завершения
+            self.max_pending_details = None
 
         # Сбор невозможен, если хотя бы одна из ссылок не заполнена
         if (self.city_url is None) or (self.product_url is None) or not (self.city_url and self.product_url):
             msg = f'В файле settings.py проекта в словаре настройки паука не заполнены CITY_URL и/или PRODUCT_URL'
             raise CloseSpider(msg)
 
-        # Создание переменной uuid города
-        self.city_uuid = ''
-        # Создание словаря городов: Название_города=UUID_города
+        # Создание словаря городов для сбора: Название_города=UUID_города
+        self.city_uuids = {}
+        # Создание словаря городов: название_города=UUID_города
         self.cities = {}
+        # Создание словаря написаний названий городов: название_города=Название_города
+        self.city_titles = {}
+        # Создание словаря загружаемого с сайта списка городов: Название_города=UUID_города
+        self.fetched_cities = {}
+        # Создание словаря запрошенных страниц категорий
+        self.scheduled_pages = {}
+        # Создание словаря состояния обхода категорий
+        self.frontier = {}
+        # Создание словарей и множества для объединения товаров из нескольких категорий
+        self.product_categories = {}
+        self.emitted_products = set()
+        self.category_names = {}
         # Создание списка ссылок на категории
         self.urls_from_file = []
 
         # Чтение файла links.txt и перенос их в urls_from_file
-        # + проверка существования файла, чтение, проверка валидности ссылок, добавление в список urls_from_file
+        # + проверка существования файла, проверка валидности ссылок, добавление в список urls_from_file
         urls_file = self.settings.get('URLS_FILENAME')
-        if urls_file.exists():
-            url_pattern = re.compile(r'^https://alkoteka\.com/catalog/[a-zA-Z0-9\-_]+$')
-            with open(urls_file, 'r', encoding='utf-8') as f:
-                count = 0
-                for line in f:
-                    count += 1
-                    if line.strip() and url_pattern.match(line.strip()):
-                        self.urls_from_file.append(line.strip())
-
-                if len(self.urls_from_file) != count:
-                    msg = f'Не все ссылки в файле {urls_file} валидны. Часть из них была проигнорирована'
-                    self.logger.warning(msg)
+        category_urls = read_category_urls(urls_file)
+        if category_urls is None:
+            msg = f'Нет ссылок для сбора данных в файле {urls_file}'
+            raise CloseSpider(msg)
+        self.urls_from_file, all_valid = category_urls
+        if not all_valid:
+            msg = f'Не все ссылки в файле {urls_file} валидны. Часть из них была проигнорирована'
+            self.logger.warning(msg)
+        if not self.urls_from_file:
+            msg = f'В файле {urls_file} нет валидных ссылок'
+            raise CloseSpider(msg)
 
+        # Только категории шарда (-a categories=slug1,slug2)
+        if categories:
+            slugs = {slug.strip() for slug in categories.split(',') if slug.strip()}
+            self.urls_from_file = [url for url in self.urls_from_file if url.split('/')[-1] in slugs]
             if not self.urls_from_file:
-                msg = f'В файле {urls_file} нет валидных ссылок'
+                msg = f'В файле {urls_file} нет категорий {categories}'
                 raise CloseSpider(msg)
-        else:
-            msg = f'Нет ссылок для сбора данных в файле {urls_file}'
-            raise CloseSpider(msg)
+
+        self.shard_manifest_path = None
+        self.shard_products = {}
+
+        self.state_store = None
+        self.static_cache = None
+        self.static_skip_detail = False
+        self.city_cache = None
+        self.json_decoder = JSONDecoder()
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        # Паук читает настройки краулера, а не загружает settings.py еще раз
+        spider = super().from_crawler(crawler, *args, settings=crawler.settings, **kwargs)
+        # Открытие хранилища состояния товаров (если включено в settings.py)
+        spider.state_store = ProductStateStore.from_settings(crawler.settings)
+        # Кеш не зависящих от города полей товаров (если включен в settings.py)
+        spider.static_cache = ProductStaticCache.from_settings(crawler.settings)
+        if spider.static_cache is not None:
+            spider.static_skip_detail = crawler.settings.getbool('PRODUCT_STATIC_CACHE_SKIP_DETAIL', False)
+            # Кеш хранит поля в формате ProductsByCategoryExtractor
+            if spider.extractor is None:
+                spider.logger.info('PRODUCT_STATIC_CACHE_ENABLED: item собираются через EXTRACTOR=compiled')
+                spider.extractor = ProductsByCategoryExtractor()
+        # Кеш списка городов (если включен в settings.py)
+        spider.city_cache = CityDirectoryCache.from_settings(crawler.settings)
+        # Декодер JSON из JSON_DECODER
+        spider.json_decoder = JSONDecoder.from_settings(crawler.settings)
+        # Сведения шарда для объединения результатов (при запуске через launcher.py)
+        spider.shard_manifest_path = crawler.settings.get('SHARD_MANIFEST_PATH')
+        # Запросы страниц товаров, отброшенные планировщиком, не остаются в работе
+        crawler.signals.connect(spider.request_dropped, signal=signals.request_dropped)
+        return spider
+
+    def closed(self, reason):
+        if self.shard_manifest_path:
+            self.write_shard_manifest()
+        if self.state_store is not None:
+            self.state_store.close()
+        if self.static_cache is not None:
+            self.static_cache.close()
 
     async def start(self) -> AsyncIterator[Any]:
-        yield scrapy.Request(url=self.city_url, callback=self.parse_cities,
-                             headers={'Referer': self.referer_url + '/'})
+        self.bind_job_state()
+
+        # Города из кеша: сбор товаров начинается без загрузки списка городов
+        cached_cities = self.city_cache.load() if self.city_cache is not None else None
+        if cached_cities and self.cities_resolvable(cached_cities):
+            self.set_cities(cached_cities)
+            self.set_city_uuid()
+            for request in self.start_categories():
+                yield request
+
+            # Обновление кеша в фоне (с низким приоритетом, не задерживая запросы товаров)
+            if self.city_cache.needs_refresh():
+                yield self.city_list_request(1, refresh=True)
+            return
+
+        yield self.city_list_request(1)
+
+    def write_shard_manifest(self):
+        """Названия категорий и категории выданных товаров: launcher.py объединяет по ним section
+        товаров, выданных несколькими шардами"""
+        path = pathlib.Path(self.shard_manifest_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps({'category_names': self.category_names, 'products': self.shard_products},
+                                   ensure_ascii=False), encoding='utf-8')
+
+    def bind_job_state(self):
+        """Словари паука хранятся в state (только с JOBDIR): при продолжении сбора они восстанавливаются"""
+        state = getattr(self, 'state', None)
+        if state is None:
+            return
+        resumed = bool(state)
+        for field in self.JOB_STATE_FIELDS:
+            setattr(self, field, state.setdefault(field, getattr(self, field)))
+        # Запросы в работе при остановке либо вернутся из очереди JOBDIR (счетчики не уйдут ниже нуля),
+        # либо потеряны - без обнуления отложенные страницы их категорий не были бы запрошены
+        for category in self.frontier.values():
+            category['listing'] = category['details'] = 0
+        # per_page, уже определенный пробным запросом, не определяется повторно
+        if 'per_page' in state:
+            self.per_page = self.per_page_max = state['per_page']
+        if resumed:
+            self.logger.info(f'Продолжение сбора из JOBDIR: выдано товаров - {len(self.emitted_products)}')
+
+    def set_per_page(self, per_page: int):
+        """Установка per_page по результату пробного запроса"""
+        self.per_page = per_page
+        self.crawler.stats.set_value('per_page', self.per_page)
+        if getattr(self, 'state', None) is not None:
+            self.state['per_page'] = self.per_page
+
+    def city_list_request(self, page: int, refresh: bool = False) -> scrapy.Request:
+        """Запрос страницы списка городов (refresh - только для обновления кеша)"""
+        url = self.city_url if page == 1 else f'{self.city_url}&page={page}'
+        return scrapy.Request(url, callback=self.parse_cities, priority=-100 if refresh else 0,
+                              meta={'city_cache_refresh': refresh},
+                              headers={'Referer': self.referer_url + '/'})
 
     def parse_cities(self, response: Response, **kwargs: Any) -> Any:
-        data = response.json()
+        data = self.json_decoder.decode(response)
 
         # Заполнение словаря: Название_города=UUID_города
         for city in data["results"]:
-            self.cities[city["name"].lower()] = city["uuid"]
+            self.fetched_cities[city["name"]] = city["uuid"]
 
         # Пагинация списка городов
         if data["meta"]["has_more_pages"]:
-            url = f'{self.city_url}&page={data["meta"]["current_page"]+1}'
-            yield scrapy.Request(url, callback=self.parse_cities,
-                                 headers={'Referer': self.referer_url + '/'})
-        else:
-            # Установка city_uuid для последующего сбора
-            self.set_city_uuid()
+            yield self.city_list_request(data["meta"]["current_page"] + 1,
+                                         refresh=response.meta.get('city_cache_refresh', False))
+            return
 
-            # Создание генераторов каждой категории
-            for url in self.urls_from_file:
-                root_category_slug = url.split("/")[-1]
-                query_params = [
-                    f'city_uuid={self.city_uuid}',
-                    f'page=1',
-                    f'per_page={self.per_page}',
-                    f'root_category_slug={root_category_slug}'
-                ]
-                category_url = f'{self.product_url}?{"&".join(query_params)}'
-                referer_url = f'{self.referer_url}/catalog/{root_category_slug}'
-                yield scrapy.Request(url=category_url, callback=self.parse,
-                                     headers={'Referer': referer_url})
+        # Сохранение списка городов в кеш
+        if self.city_cache is not None:
+            self.city_cache.save(self.fetched_cities)
+        if response.meta.get('city_cache_refresh'):
+            return
+
+        self.set_cities(self.fetched_cities)
+        # Установка city_uuids для последующего сбора
+        self.set_city_uuid()
+        yield from self.start_categories()
+
+    def set_cities(self, cities: dict[str, str]):
+        """Заполнение словарей cities и city_titles из словаря Название_города=UUID_города"""
+        for name, uuid in cities.items():
+            self.cities[name.lower()] = uuid
+            self.city_titles[name.lower()] = name
+
+    def cities_resolvable(self, cities: dict[str, str]) -> bool:
+        """Все ли города из -a city есть в словаре cities"""
+        if self.city_name.strip().lower() == 'all':
+            return True
+        known = {name.lower() for name in cities}
+        return all(name.strip().lower() in known for name in self.city_name.split(','))
+
+    def start_categories(self) -> Iterable[scrapy.Request]:
+        # Определение наибольшего per_page, который принимает API, до запроса категорий
+        if self.per_page_max > self.per_page:
+            yield self.per_page_probe_request(self.per_page_max)
+        else:
+            yield from self.category_requests()
+
+    def category_requests(self, skip: tuple | None = None) -> Iterable[scrapy.Request]:
+        """Запросы первых страниц каждой категории для каждого города
+
+        Города чередуются, чтобы сбор по всем городам шел одновременно.
+        skip - (slug_категории, название_города) уже запрошенной страницы
+        """
+        for url in self.urls_from_file:
+            root_category_slug = url.split("/")[-1]
+            for city_name, city_uuid in self.city_uuids.items():
+                if (root_category_slug, city_name) != skip:
+                    yield self.category_request(root_category_slug, self.page_stripe + 1, city_name, city_uuid)
+
+    def category_request(self, root_category_slug: str, page: int, city_name: str, city_uuid: str,
+                         per_page: int | None = None, **kwargs: Any) -> scrapy.Request:
+        """Запрос страницы списка товаров категории для города"""
+        query_params = [
+            f'city_uuid={city_uuid}',
+            f'page={page}',
+            f'per_page={per_page or self.per_page}',
+            f'root_category_slug={root_category_slug}'
+        ]
+        category_url = f'{self.product_url}?{"&".join(query_params)}'
+        referer_url = f'{self.referer_url}/catalog/{root_category_slug}'
+        kwargs.setdefault('callback', self.parse)
+        return scrapy.Request(url=category_url,
+                              meta={'city_name': city_name, 'city_uuid': city_uuid},
+                              headers={'Referer': referer_url}, **kwargs)
+
+    def per_page_probe_request(self, per_page: int) -> scrapy.Request:
+        """Первая страница первой категории первого города с пробным per_page"""
+        root_category_slug = self.urls_from_file[0].split("/")[-1]
+        city_name, city_uuid = next(iter(self.city_uuids.items()))
+        request = self.category_request(root_category_slug, 1, city_name, city_uuid, per_page=per_page,
+                                        callback=self.parse_per_page_probe, errback=self.per_page_probe_failed)
+        request.meta['per_page_probe'] = per_page
+        return request
+
+    def parse_per_page_probe(self, response: Response, **kwargs: Any) -> Any:
+        products = self.json_decoder.decode(response)
+        meta = products["meta"]
+
+        # API может урезать per_page до своего максимума - тогда он виден в meta или по размеру полной страницы
+        accepted = meta.get("per_page") or response.meta['per_page_probe']
+        if meta["has_more_pages"]:
+            accepted = min(accepted, len(products["results"]))
+        self.set_per_page(max(accepted, self.per_page))
+        self.logger.info(f'Используется per_page={self.per_page}')
+
+        # Пробная страница - полноценная первая страница своей категории
+        yield from self.parse(response)
+        root_category_slug = response.url.split('root_category_slug=')[-1]
+        yield from self.category_requests(skip=(root_category_slug, response.meta['city_name']))
+
+    def per_page_probe_failed(self, failure):
+        # API отклонил per_page - повтор с вдвое меньшим значением, пока оно больше PER_PAGE
+        per_page = failure.request.meta['per_page_probe'] // 2
+        if per_page > self.per_page:
+            yield self.per_page_probe_request(per_page)
+        else:
+            self.set_per_page(self.per_page)
+            yield from self.category_requests()
 
     def calc_similarity(self, s1: str, s2: str) -> float | int:
         """Функция нахождения коэффициента схожести по формуле Жаккара (Jaccard index)"""
@@ -135,15 +430,25 @@ class ProductsByCategorySpider(scrapy.Spider):
         return intersection / union if union != 0 else 0
 
     def set_city_uuid(self):
-        if self.city_name.lower() in self.cities:
-            self.city_uuid = self.cities[self.city_name.lower()]
+        # Сбор по всем городам
+        if self.city_name.strip().lower() == 'all':
+            self.city_uuids = {self.city_titles[name]: uuid for name, uuid in self.cities.items()}
             return
 
+        for city_name in self.city_name.split(','):
+            city_name = city_name.strip()
+            if city_name.lower() not in self.cities:
+                self.suggest_city(city_name)
+            self.city_uuids[self.city_titles[city_name.lower()]] = self.cities[city_name.lower()]
+
+    def suggest_city(self, city_name: str):
+        """Остановка паука с подсказкой наиболее похожих на city_name городов"""
+
         # Составление списка схожести: (коэфф_схожести, {Название_города=UUID_города})
         similarities = []
         for valid_city in self.cities:
             similarities.append((
-                self.calc_similarity(self.city_name.lower(), valid_city),
+                self.calc_similarity(city_name.lower(), valid_city),
                 valid_city
             ))
         similarities.sort(reverse=True)
@@ -151,52 +456,322 @@ class ProductsByCategorySpider(scrapy.Spider):
         best_matches = [city for sim, city in similarities[:3]]
 
         # Подсказка "Возможно вы имели в виду"
-        msg = (f"Не найден: '{self.city_name}'. Возможно вы имели в виду один из этих городов: "
-               f"{', '.join(list(map(lambda x: x.capitalize(), best_matches)))} ?")
+        msg = (f"Не найден: '{city_name}'. Возможно вы имели в виду один из этих городов: "
+               f"{', '.join([self.city_titles[city] for city in best_matches])} ?")
         raise CloseSpider(msg)
 
     def parse(self, response: Response, **kwargs: Any) -> Any:
-        products = response.json()
+        products = self.json_decoder.decode(response)
+        city_name = response.meta['city_name']
+        city_uuid = response.meta['city_uuid']
+
+        # Товары, страницу которых можно не запрашивать: строка листинга не изменилась и не истек TTL
+        fingerprints: dict[str, str] = {}
+        stored_details: dict[str, dict] = {}
+        if self.state_store is not None and not self.listing_only:
+            fingerprints = {str(product['vendor_code']): ProductStateStore.fingerprint(product)
+                            for product in products["results"]}
+            stored_details = self.state_store.lookup(city_uuid, fingerprints)
 
         # Сбор данных о продуктах на странице списка товаров
+        root_category_slug = response.url.split('root_category_slug=')[-1]
+        category = self.frontier_entry(city_uuid, root_category_slug, city_name)
+        if response.meta.get('frontier'):
+            category['listing'] = max(category['listing'] - 1, 0)
         for product in products["results"]:
-            main_loader = AlkotekaLoader()
-            main_loader.add_value('timestamp', 0)
-            main_loader.add_value('RPC', product['vendor_code'])
-            main_loader.add_value('url', product['product_url'])
-            main_loader.add_value('title', product['name'])
-            main_loader.add_value('marketing_tags',
-                                  [product["action_labels"][i]['title'] for i in range(len(product["action_labels"]))])
+            product_slug = product["product_url"].split("/")[-1]
+            product_key = (city_uuid, product_slug)
+            # Товар уже запрошен или выдан из другой категории
+            if self.dedup_products and self.coalesce_product(product_key, root_category_slug):
+                continue
+
+            listing = self.load_listing(product, city_name)
+
+            # Item только из строки листинга (-a mode=listing)
+            if self.listing_only:
+                # Название категории - из строки листинга (страницы товаров не запрашиваются)
+                row_category = self.extractor.listing_category(product)
+                if row_category.get("slug") and row_category.get("name"):
+                    self.category_names.setdefault(row_category["slug"], row_category["name"])
+                self.crawler.stats.inc_value('listing_only/items')
+                yield self.finish_product(product_key, self.extractor.listing_item(listing, product))
+                continue
+
+            # Повторная выдача сохраненного item без запроса страницы товара
+            vendor_code = str(product['vendor_code'])
+            if vendor_code in stored_details:
+                self.crawler.stats.inc_value('product_state/reused')
+                yield self.finish_product(product_key, self.load_item(listing, stored_details[vendor_code]))
+                continue
+
+            # Сборка item из строки листинга и кеша без запроса страницы товара
+            # (только если в строке листинга есть цена и остаток - иначе они берутся со страницы товара)
+            if self.static_skip_detail and product.get("price") is not None \
+                    and product.get("quantity_total") is not None:
+                static = self.static_cache.get(product_slug)
+                if static is not None:
+                    fields = self.extractor.combine(static, self.extractor.volatile_fields(product, with_stores=False))
+                    self.crawler.stats.inc_value('static_cache/detail_skipped')
+                    yield self.finish_product(product_key, self.extractor.item(listing, fields))
+                    continue
 
             # Переход на страницу о продукте и продолжение сбора
-            root_category_slug = response.url.split('root_category_slug=')[-1]
-            product_slug = product["product_url"].split("/")[-1]
             product_url = \
-                f'{self.product_url}/{product_slug}?city_uuid={self.city_uuid}'
+                f'{self.product_url}/{product_slug}?city_uuid={city_uuid}'
             referer_url = f'{self.referer_url}/product/{root_category_slug}/{product_slug}'
+            category['details'] += 1
             yield scrapy.Request(url=product_url, callback=self.parse_product_details,
-                                 meta={'loader': main_loader},
+                                 errback=self.product_details_failed, priority=self.DETAIL_PRIORITY,
+                                 meta={'listing': listing, 'fingerprint': fingerprints.get(vendor_code),
+                                       'city_uuid': city_uuid, 'product_slug': product_slug,
+                                       'category_slug': root_category_slug},
                                  headers={'Referer': referer_url})
 
         # Пагинация по страницам
-        root_category_slug = response.url.split("root_category_slug=")[-1]
-        query_params = [
-            f'city_uuid={self.city_uuid}',
-            f'page={products["meta"]["current_page"] + 1}',
-            f'per_page={self.per_page}',
-            f'root_category_slug={root_category_slug}'
-        ]
-        if products["meta"]["has_more_pages"]:
-            next_page_url = f'{self.product_url}?{"&".join(query_params)}'
-            referer_url = f'{self.referer_url}/catalog/{root_category_slug}'
-            yield scrapy.Request(url=next_page_url, callback=self.parse,
-                                 headers={'Referer': referer_url})
+        yield from self.paginate(products["meta"], root_category_slug, city_name, city_uuid)
+
+    def coalesce_product(self, product_key: tuple, root_category_slug: str) -> bool:
+        """True, если товар (uuid_города, slug_товара) уже запрошен или выдан при обходе другой категории
+
+        Категория повторного вхождения добавляется к section еще не выданного item.
+        """
+        if product_key in self.emitted_products:
+            self.crawler.stats.inc_value('dedup/after_emit')
+            return True
+
+        categories = self.product_categories.get(product_key)
+        if categories is None:
+            self.product_categories[product_key] = [root_category_slug]
+            return False
+
+        if root_category_slug not in categories:
+            categories.append(root_category_slug)
+        self.crawler.stats.inc_value('dedup/coalesced')
+        return True
+
+    def finish_product(self, product_key: tuple, item: Any) -> Any:
+        """Добавление в section item названий всех категорий, в которых встретился товар"""
+        if not self.dedup_products:
+            return item
+
+        self.emitted_products.add(product_key)
+        categories = self.product_categories.pop(product_key, ())
+        if self.shard_manifest_path:
+            self.shard_products[f'{item["city"]}|{item["RPC"]}'] = list(categories)
+        section = list(item['section'])
+        position = 1
+        for slug in categories:
+            name = self.category_names.get(slug)
+            if name is None:
+                # Название категории еще не встречалось на страницах товаров
+                self.crawler.stats.inc_value('dedup/unnamed_category')
+            elif name not in section:
+                section.insert(position, name)
+                position += 1
+        item['section'] = section
+        return item
+
+    def paginate(self, meta: dict, root_category_slug: str, city_name: str, city_uuid: str) -> Iterable[scrapy.Request]:
+        """Следующие страницы категории по данным пагинации страницы meta (откладываются в frontier)"""
+        current_page = meta["current_page"]
+        key = (city_uuid, root_category_slug)
+        pages = self.frontier_entry(city_uuid, root_category_slug, city_name)['pages']
+
+        last_page = meta.get("last_page")
+        if last_page is None and meta.get("total") is not None:
+            last_page = math.ceil(meta["total"] / (meta.get("per_page") or self.per_page))
+
+        # Страницы шарда идут с шагом page_stripes (без шардов - все страницы подряд)
+        step = self.page_stripes
+        first_page = self.page_stripe + 1
+
+        # Количество страниц известно - все остальные страницы откладываются сразу после первой
+        if last_page is not None:
+            if current_page == first_page:
+                pages.extend(range(first_page + step, last_page + 1, step))
+                # Ожидаемое количество товаров категории - для прогресса и ETA (MetricsExporterExtension)
+                per_page = meta.get("per_page") or self.per_page
+                total = meta.get("total") or last_page * per_page
+                if step > 1:
+                    total = sum(max(min(per_page, total - (page - 1) * per_page), 0)
+                                for page in range(first_page, last_page + 1, step))
+                self.crawler.stats.inc_value('progress/expected_products', total)
+        # Количество страниц неизвестно - откладываются pages_window страниц наперед
+        elif meta["has_more_pages"]:
+            scheduled = self.scheduled_pages.get(key, current_page)
+            pages.extend(range(scheduled + step, current_page + self.pages_window * step + 1, step))
+            self.scheduled_pages[key] = max(scheduled, current_page + self.pages_window * step)
+        else:
+            # Категория закончилась - отложенные страницы после нее не нужны
+            while pages and pages[-1] > current_page:
+                pages.pop()
+
+        yield from self.release_pages(key)
+
+    def frontier_entry(self, city_uuid: str, root_category_slug: str, city_name: str) -> dict:
+        """Состояние обхода категории для города"""
+        return self.frontier.setdefault((city_uuid, root_category_slug), {
+            'city_name': city_name, 'pages': deque(), 'listing': 0, 'details': 0
+        })
+
+    def release_pages(self, key: tuple) -> Iterable[scrapy.Request]:
+        """Запросы отложенных страниц категории, пока ожидаемых страниц товаров меньше max_pending_details
+
+        Страница листинга в работе считается как per_page страниц товаров.
+        """
+        category = self.frontier.get(key)
+        if category is None:
+            return
+        pages = category['pages']
+        while pages:
+            pending = category['details'] + category['listing'] * self.per_page
+            if self.max_pending_details is not None and pending >= self.max_pending_details:
+                self.crawler.stats.inc_value('frontier/paused')
+                return
+            category['listing'] += 1
+            request = self.category_request(key[1], pages.popleft(), category['city_name'], key[0],
+                                            errback=self.listing_failed)
+            request.meta['frontier'] = True
+            yield request
+
+        # Обход категории закончен
+        if not category['listing'] and not category['details']:
+            del self.frontier[key]
+
+    def release_detail(self, meta: dict) -> Iterable[scrapy.Request]:
+        """Завершение запроса страницы товара: освобождение места для страниц листинга его категории"""
+        key = (meta['city_uuid'], meta['category_slug'])
+        category = self.frontier.get(key)
+        if category is not None:
+            category['details'] = max(category['details'] - 1, 0)
+        yield from self.release_pages(key)
+
+    def product_details_failed(self, failure):
+        self.logger.warning(f'Страница товара не получена: {failure.request.url} ({failure.value!r})')
+        yield from self.release_detail(failure.request.meta)
+        yield from self.drop_product(failure.request)
+
+    def drop_product(self, request: scrapy.Request, retry: bool = True) -> Iterable[scrapy.Request]:
+        """Товар без item: он больше не считается запрошенным в других категориях.
+
+        Если товар встретился еще в одной категории, страница товара запрашивается повторно
+        (один раз) от ее имени - иначе товар не попадет в выгрузку ни из одной категории.
+        """
+        if not self.dedup_products:
+            return
+        meta = request.meta
+        key = (meta['city_uuid'], meta['product_slug'])
+        categories = self.product_categories.pop(key, None)
+        if not categories:
+            return
+        pending = [slug for slug in categories if slug != meta['category_slug']]
+        if not pending:
+            return
+        if not retry or meta.get('dedup_retry'):
+            self.crawler.stats.inc_value('dedup/lost')
+            return
+
+        self.product_categories[key] = categories
+        self.frontier_entry(meta['city_uuid'], pending[0], meta['listing'].get('city', ''))['details'] += 1
+        self.crawler.stats.inc_value('dedup/retried')
+        yield request.replace(dont_filter=True, meta={**meta, 'category_slug': pending[0], 'dedup_retry': True})
+
+    def release_listing(self, request: scrapy.Request) -> Iterable[scrapy.Request]:
+        """Завершение отложенной страницы листинга без ответа"""
+        key = (request.meta['city_uuid'], request.url.split('root_category_slug=')[-1])
+        category = self.frontier.get(key)
+        if category is not None:
+            category['listing'] = max(category['listing'] - 1, 0)
+        yield from self.release_pages(key)
+
+    def listing_failed(self, failure):
+        self.logger.warning(f'Страница категории не получена: {failure.request.url} ({failure.value!r})')
+        yield from self.release_listing(failure.request)
+
+    def request_dropped(self, request, spider):
+        # Ответа и errback не будет: освободившиеся страницы листинга передаются в движок напрямую
+        if request.meta.get('frontier'):
+            released = self.release_listing(request)
+        elif request.meta.get('category_slug') is not None:
+            released = itertools.chain(self.release_detail(request.meta), self.drop_product(request))
+        else:
+            return
+        for next_request in released:
+            self.crawler.engine.crawl(next_request)
 
     def parse_product_details(self, response: Response, **kwargs: Any) -> Any:
-        data = response.json().get('results')
+        yield from self.release_detail(response.meta)
+        data = self.json_decoder.decode(response).get('results')
+
+        # Название корневой категории товара (для section товаров из нескольких категорий)
+        parent = data["category"]["parent"]
+        if parent.get("slug"):
+            self.category_names.setdefault(parent["slug"], parent["name"])
+
+        listing = response.meta['listing']
+        if self.static_cache is not None:
+            item = self.extractor.item(listing, self.cached_detail_fields(response.meta['product_slug'], data))
+        elif self.extractor is not None:
+            item = self.extractor.item(listing, self.extractor.detail_fields(data))
+        else:
+            item = self.load_product_details(listing, data)
+        if item is None:
+            self.logger.warning('AlkotekaLoader.load_item() returned None for %s', response.url)
+            # Повторный запрос вернет те же данные
+            yield from self.drop_product(response.request, retry=False)
+            return
 
-        main_loader = response.meta['loader']
+        item = self.finish_product((response.meta['city_uuid'], response.meta['product_slug']), item)
 
+        # Сохранение состояния товара для следующих запусков
+        if self.state_store is not None and response.meta.get('fingerprint'):
+            self.state_store.save(response.meta['city_uuid'], str(data["vendor_code"]), response.meta['fingerprint'], item)
+
+        yield item
+
+    def cached_detail_fields(self, product_slug: str, data: dict) -> dict:
+        """Поля страницы товара: не зависящие от города - из static_cache (разбираются только при промахе)"""
+        static = self.static_cache.get(product_slug)
+        if static is None:
+            static = self.extractor.static_fields(data)
+            changed = self.static_cache.put(product_slug, static)
+            self.crawler.stats.inc_value('static_cache/stored' if changed else 'static_cache/unchanged')
+        else:
+            self.crawler.stats.inc_value('static_cache/hit')
+        return self.extractor.combine(static, self.extractor.volatile_fields(data))
+
+    def load_listing(self, product: dict, city_name: str) -> dict:
+        """Поля item из строки листинга (dict: передается в meta запроса страницы товара и сериализуется с ним)"""
+        if self.extractor is not None:
+            return self.extractor.listing_fields(product, city_name)
+
+        main_loader = AlkotekaLoader()
+        main_loader.add_value('timestamp', 0)
+        main_loader.add_value('city', city_name)
+        main_loader.add_value('RPC', product['vendor_code'])
+        main_loader.add_value('url', product['product_url'])
+        main_loader.add_value('title', product['name'])
+        main_loader.add_value('marketing_tags',
+                              [product["action_labels"][i]['title'] for i in range(len(product["action_labels"]))])
+        return dict(main_loader.load_item())
+
+    def listing_loader(self, listing: dict) -> AlkotekaLoader:
+        """AlkotekaLoader с уже обработанными полями листинга (load_listing)"""
+        return AlkotekaLoader(item=AlkotekaItem(listing))
+
+    def load_item(self, listing: dict, detail: dict) -> Any:
+        """item из полей листинга (load_listing) и сохраненных полей страницы товара"""
+        if self.extractor is not None:
+            return self.extractor.item(listing, detail)
+
+        main_loader = self.listing_loader(listing)
+        for field, value in detail.items():
+            main_loader.add_value(field, value)
+        return main_loader.load_item()
+
+    def load_product_details(self, listing: dict, data: dict) -> Any:
+        """Сборка item через ItemLoader по данным страницы товара"""
+        main_loader = self.listing_loader(listing)
         brand: str | None = None
         for desc in data["description_blocks"]:
             if desc["code"].lower() == 'brend':
@@ -216,12 +791,7 @@ class ProductsByCategorySpider(scrapy.Spider):
 
         main_loader.add_value('variants', 0)
 
-        item = main_loader.load_item()
-        if item is None:
-            self.logger.warning('AlkotekaLoader.load_item() returned None for %s', response.url)
-            return
-
-        yield item
+        return main_loader.load_item()
 
     def get_product_price_data(self, data_result, **kwargs: Any) -> Any:
         price_data = PriceDataLoader()
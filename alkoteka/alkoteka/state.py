@@ -0,0 +1,284 @@
+import hashlib
+import json
+import os
+import pathlib
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Any
+
+from itemadapter import ItemAdapter
+
+
+class ProductStateStore:
+    """Хранилище состояния товаров на диске (SQLite в режиме WAL).
+
+    Для каждой пары (город, vendor_code) хранит время последнего запроса страницы товара,
+    отпечаток строки листинга и поля item, полученные со страницы товара. Если строка листинга
+    не изменилась и с последнего запроса прошло меньше TTL, страницу товара можно не запрашивать.
+    """
+
+    # Поля item, которые заполняются по данным страницы товара (а не листинга)
+    DETAIL_FIELDS = ('brand', 'section', 'price_data', 'stock', 'assets', 'metadata', 'variants')
+
+    # Размер пачки записей между commit
+    COMMIT_EVERY = 500
+
+    def __init__(self, path: str | pathlib.Path, ttl: float):
+        self.path = pathlib.Path(path)
+        self.ttl = ttl
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS product_state ('
+            '    city_uuid TEXT NOT NULL,'
+            '    vendor_code TEXT NOT NULL,'
+            '    fingerprint TEXT NOT NULL,'
+            '    fetched_at REAL NOT NULL,'
+            '    detail TEXT NOT NULL,'
+            '    PRIMARY KEY (city_uuid, vendor_code)'
+            ') WITHOUT ROWID'
+        )
+        self.connection.commit()
+        self._pending = 0
+
+    @classmethod
+    def from_settings(cls, settings) -> 'ProductStateStore | None':
+        """None, если хранилище отключено в settings.py"""
+        if not settings.getbool('PRODUCT_STATE_ENABLED', False):
+            return None
+        return cls(settings.get('PRODUCT_STATE_PATH'), settings.getfloat('PRODUCT_STATE_TTL', 3600))
+
+    @staticmethod
+    def fingerprint(row: dict) -> str:
+        """Отпечаток строки листинга (не зависит от порядка ключей)"""
+        raw = json.dumps(row, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+        return hashlib.blake2b(raw.encode('utf-8'), digest_size=16).hexdigest()
+
+    def lookup(self, city_uuid: str, fingerprints: dict[str, str]) -> dict[str, dict]:
+        """Сохраненные поля страницы товара для товаров, которые можно не запрашивать повторно.
+
+        fingerprints - {vendor_code: отпечаток текущей строки листинга}
+        """
+        fresh = {}
+        deadline = time.time() - self.ttl
+        codes = list(fingerprints)
+        # Ограничение SQLite на количество параметров запроса
+        for start in range(0, len(codes), 500):
+            chunk = codes[start:start + 500]
+            rows = self.connection.execute(
+                f'SELECT vendor_code, fingerprint, fetched_at, detail FROM product_state '
+                f'WHERE city_uuid = ? AND vendor_code IN ({",".join("?" * len(chunk))})',
+                [city_uuid, *chunk]
+            )
+            for vendor_code, fingerprint, fetched_at, detail in rows:
+                if fingerprint == fingerprints[vendor_code] and fetched_at >= deadline:
+                    fresh[vendor_code] = json.loads(detail)
+        return fresh
+
+    def save(self, city_uuid: str, vendor_code: str, fingerprint: str, item: Any):
+        """Сохранение полей страницы товара из item"""
+        item_dict = ItemAdapter(item).asdict()
+        detail = {field: item_dict[field] for field in self.DETAIL_FIELDS if field in item_dict}
+        self.connection.execute(
+            'INSERT OR REPLACE INTO product_state (city_uuid, vendor_code, fingerprint, fetched_at, detail) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (city_uuid, vendor_code, fingerprint, time.time(), json.dumps(detail, ensure_ascii=False))
+        )
+        self._pending += 1
+        if self._pending >= self.COMMIT_EVERY:
+            self.commit()
+
+    def commit(self):
+        self.connection.commit()
+        self._pending = 0
+
+    def close(self):
+        self.commit()
+        self.connection.close()
+
+
+class ProductStaticCache:
+    """Кеш не зависящих от города полей страниц товаров (SQLite в режиме WAL), общий для всех городов.
+
+    Ключ - slug товара; вместе с полями хранится хеш их содержимого, поэтому повторное сохранение
+    неизмененных полей (тот же товар в другом городе) только продлевает запись, не перезаписывая ее.
+    Последние MEMORY записей держатся в памяти: при сборе нескольких городов товар запрашивается
+    для всех городов почти одновременно.
+    """
+
+    COMMIT_EVERY = 500
+
+    def __init__(self, path: str | pathlib.Path, ttl: float, memory: int = 10000):
+        self.path = pathlib.Path(path)
+        self.ttl = ttl
+        self.memory = memory
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS product_static ('
+            '    slug TEXT PRIMARY KEY,'
+            '    content_hash TEXT NOT NULL,'
+            '    fetched_at REAL NOT NULL,'
+            '    static TEXT NOT NULL'
+            ') WITHOUT ROWID'
+        )
+        self.connection.commit()
+        self._pending = 0
+        # slug=(хеш, время получения, поля) последних использованных товаров
+        self._recent: OrderedDict[str, tuple[str, float, dict]] = OrderedDict()
+
+    @classmethod
+    def from_settings(cls, settings) -> 'ProductStaticCache | None':
+        """None, если кеш отключен в settings.py"""
+        if not settings.getbool('PRODUCT_STATIC_CACHE_ENABLED', False):
+            return None
+        return cls(settings.get('PRODUCT_STATIC_CACHE_PATH'), settings.getfloat('PRODUCT_STATIC_CACHE_TTL', 86400),
+                   settings.getint('PRODUCT_STATIC_CACHE_MEMORY', 10000))
+
+    @staticmethod
+    def content_hash(static: dict) -> str:
+        raw = json.dumps(static, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+        return hashlib.blake2b(raw.encode('utf-8'), digest_size=16).hexdigest()
+
+    def get(self, slug: str) -> dict | None:
+        """Поля товара, если они есть в кеше и не истек TTL"""
+        entry = self._recent.get(slug)
+        if entry is None:
+            row = self.connection.execute(
+                'SELECT content_hash, fetched_at, static FROM product_static WHERE slug = ?', (slug,)
+            ).fetchone()
+            if row is None:
+                return None
+            entry = (row[0], row[1], json.loads(row[2]))
+            self._remember(slug, entry)
+        else:
+            self._recent.move_to_end(slug)
+
+        if entry[1] < time.time() - self.ttl:
+            return None
+        return entry[2]
+
+    def put(self, slug: str, static: dict) -> bool:
+        """Сохранение полей товара; False - содержимое не изменилось (запись только продлена)"""
+        content_hash = self.content_hash(static)
+        now = time.time()
+        entry = self._recent.get(slug)
+        changed = entry is None or entry[0] != content_hash
+        if changed:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO product_static (slug, content_hash, fetched_at, static) VALUES (?, ?, ?, ?)',
+                (slug, content_hash, now, json.dumps(static, ensure_ascii=False))
+            )
+        else:
+            self.connection.execute('UPDATE product_static SET fetched_at = ? WHERE slug = ?', (now, slug))
+        self._remember(slug, (content_hash, now, static))
+
+        self._pending += 1
+        if self._pending >= self.COMMIT_EVERY:
+            self.commit()
+        return changed
+
+    def _remember(self, slug: str, entry: tuple[str, float, dict]):
+        self._recent[slug] = entry
+        self._recent.move_to_end(slug)
+        if len(self._recent) > self.memory:
+            self._recent.popitem(last=False)
+
+    def commit(self):
+        self.connection.commit()
+        self._pending = 0
+
+    def close(self):
+        self.commit()
+        self.connection.close()
+
+
+class CityDirectoryCache:
+    """Кеш списка городов (Название_города=UUID_города) в JSON-файле с временем актуальности (TTL)"""
+
+    def __init__(self, path: str | pathlib.Path, ttl: float, refresh_after: float):
+        self.path = pathlib.Path(path)
+        self.ttl = ttl
+        self.refresh_after = refresh_after
+        self.fetched_at = 0.0
+
+    @classmethod
+    def from_settings(cls, settings) -> 'CityDirectoryCache | None':
+        """None, если кеш отключен в settings.py"""
+        if not settings.getbool('CITY_CACHE_ENABLED', True):
+            return None
+        ttl = settings.getfloat('CITY_CACHE_TTL', 86400)
+        return cls(settings.get('CITY_CACHE_PATH'), ttl, settings.getfloat('CITY_CACHE_REFRESH_AFTER', ttl / 2))
+
+    def load(self) -> dict[str, str] | None:
+        """Список городов из кеша; None, если кеша нет или истек TTL"""
+        try:
+            data = json.loads(self.path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return None
+
+        self.fetched_at = data.get('fetched_at', 0.0)
+        if time.time() - self.fetched_at > self.ttl:
+            return None
+        return data.get('cities') or None
+
+    def needs_refresh(self) -> bool:
+        """Кеш еще действителен, но его пора обновить (в фоне)"""
+        return time.time() - self.fetched_at > self.refresh_after
+
+    def save(self, cities: dict[str, str]):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.fetched_at = time.time()
+        tmp_path = self.path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps({'fetched_at': self.fetched_at, 'cities': cities}, ensure_ascii=False),
+                            encoding='utf-8')
+        # Атомарная замена: параллельно запущенные пауки не прочитают недописанный файл
+        os.replace(tmp_path, self.path)
+
+
+class HeaderProfileCache:
+    """Запас наборов заголовков браузера между запусками (JSON-файл): паук стартует без генерации наборов.
+
+    В файле - только наборы, которые не отправлялись ни в одном запросе. Файл забирается одним процессом
+    (параллельные шарды не получат одинаковые наборы), при закрытии паука в него сохраняется остаток запаса.
+    """
+
+    def __init__(self, path: str | pathlib.Path):
+        self.path = pathlib.Path(path)
+
+    @classmethod
+    def from_settings(cls, settings) -> 'HeaderProfileCache | None':
+        """None, если BROWSER_HEADERS_CACHE_PATH не задан"""
+        path = settings.get('BROWSER_HEADERS_CACHE_PATH')
+        return cls(path) if path else None
+
+    def take(self) -> list[dict]:
+        """Наборы из файла (файл удаляется); пустой список, если файла нет"""
+        taken_path = self.path.with_name(f'{self.path.name}.{os.getpid()}')
+        try:
+            # Переименование атомарно: файл достанется только одному процессу
+            os.replace(self.path, taken_path)
+        except OSError:
+            return []
+        try:
+            profiles = json.loads(taken_path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            profiles = []
+        finally:
+            taken_path.unlink(missing_ok=True)
+        return [profile for profile in profiles if isinstance(profile, dict)] if isinstance(profiles, list) else []
+
+    def save(self, profiles: list[dict]):
+        if not profiles:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f'{self.path.name}.{os.getpid()}.tmp')
+        tmp_path.write_text(json.dumps(profiles, ensure_ascii=False), encoding='utf-8')
+        os.replace(tmp_path, self.path)
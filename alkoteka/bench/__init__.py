@@ -0,0 +1,5 @@
+# Локальный стенд, имитирующий web-api alkoteka.com, и бенчмарк пропускной способности парсера
+#
+# Запуск стенда:        python -m bench.server --products 100000
+# Запуск бенчмарка:     python -m bench.run smoke
+# Запуск всех сценариев: python -m bench.run all
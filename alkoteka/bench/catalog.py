@@ -0,0 +1,332 @@
+import argparse
+import math
+import random
+import uuid
+import zlib
+
+
+# Корневые категории стенда (совпадают со slug из links.txt)
+DEFAULT_CATEGORIES = (
+    ('vino', 'Вино'),
+    ('shampanskoe-i-igristoe', 'Шампанское и игристое'),
+    ('krepkiy-alkogol', 'Крепкий алкоголь'),
+    ('bezalkogolnye-napitki-1', 'Безалкогольные напитки'),
+    ('produkty-1', 'Продукты'),
+    ('aksessuary-2', 'Аксессуары'),
+    ('podarki-i-nabory-1', 'Подарки и наборы'),
+)
+
+# Реальные города в начале списка, чтобы работали -a city=Краснодар и т.п.
+KNOWN_CITIES = (
+    'Краснодар', 'Москва', 'Сочи', 'Анапа', 'Новороссийск', 'Геленджик', 'Курганинск', 'Абинск',
+    'Ростов-на-Дону', 'Ставрополь', 'Армавир', 'Туапсе', 'Ейск', 'Крымск', 'Темрюк', 'Майкоп',
+)
+
+CITY_PAGE_SIZE = 20
+
+_KINDS = ('Вино', 'Коньяк', 'Виски', 'Ром', 'Джин', 'Водка', 'Ликер', 'Сок', 'Шоколад', 'Бокал')
+_NAMES = ('Шато', 'Гранд', 'Резерв', 'Кубань', 'Тамань', 'Абрау', 'Фанагория', 'Лефкадия', 'Мысхако', 'Южная')
+_COLORS = ('Красное', 'Белое', 'Розовое', 'Оранжевое')
+_COUNTRIES = ('Россия', 'Франция', 'Италия', 'Испания', 'Грузия', 'Чили', 'Шотландия')
+_REGIONS = ('Краснодарский край', 'Бордо', 'Тоскана', 'Риоха', 'Кахетия', 'Спейсайд')
+_SUGAR = ('Сухое', 'Полусухое', 'Полусладкое', 'Сладкое')
+_GRAPES = ('Каберне Совиньон', 'Мерло', 'Шардоне', 'Пино Нуар', 'Рислинг', 'Саперави')
+_CONTAINERS = ('Дуб', 'Сталь', 'Бутылка')
+_PACKAGES = ('Стекло', 'Тетрапак', 'Жестяная банка')
+_LABELS = ('СКИДКА', 'НОВИНКА', 'ДО -10% ОНЛАЙН', 'ХИТ')
+_GASTRONOMICS = (('meat', 'Мясо'), ('fish', 'Рыба'), ('cheese', 'Сыр'), ('dessert', 'Десерты'))
+_VOLUMES = (0.2, 0.33, 0.5, 0.7, 0.75, 1.0, 1.5, 3.0)
+_STREETS = ('Красная', 'Северная', 'Мира', 'Ленина', 'Садовая', 'Кубанская', 'Морская')
+_WORDS = ('насыщенный', 'аромат', 'ноты', 'ягод', 'послевкусие', 'долгое', 'бархатистый', 'танины',
+          'фруктовый', 'оттенки', 'ванили', 'дуба', 'специй', 'свежий', 'минеральный', 'тон')
+
+
+def _stable_hash(*parts) -> int:
+    """Стабильный между процессами хеш (hash() для str рандомизирован)"""
+    return zlib.crc32(':'.join(map(str, parts)).encode('utf-8'))
+
+
+def _values(names) -> list[dict]:
+    return [{'name': name, 'slug': f'v{_stable_hash(name)}'} for name in names]
+
+
+class SyntheticCatalog:
+    """Детерминированный синтетический каталог в формате web-api alkoteka.com.
+
+    Товары не хранятся в памяти: каждый товар однозначно восстанавливается по своему индексу,
+    поэтому каталог масштабируется от сотен до миллионов товаров без роста потребления памяти.
+    Индекс i принадлежит категории i % len(categories); slug товара заканчивается на -<i>.
+    При overlap > 0 листинг категории после своих товаров содержит долю overlap товаров
+    предыдущей категории (как пересекающиеся корневые категории на сайте).
+    """
+
+    def __init__(self, products: int = 1000, cities: int = 50, seed: int = 0,
+                 categories=DEFAULT_CATEGORIES, expose_total: bool = True, max_per_page: int = 100,
+                 overlap: float = 0.0):
+        self.products = products
+        self.seed = seed
+        self.categories = tuple(categories)
+        self.expose_total = expose_total
+        self.max_per_page = max_per_page
+        # В листинг попадает каждый overlap_step-й товар предыдущей категории (0 - без пересечений)
+        self.overlap_step = max(1, round(1 / overlap)) if overlap > 0 else 0
+
+        self.category_index = {slug: i for i, (slug, _) in enumerate(self.categories)}
+
+        names = list(KNOWN_CITIES[:cities])
+        names += [f'Город-{i}' for i in range(len(names), cities)]
+        self.cities = [{'name': name, 'uuid': str(uuid.uuid5(uuid.NAMESPACE_URL, f'alkoteka-city:{name}'))}
+                       for name in names]
+        self._stores = {}
+
+    # ---------- Города ----------
+
+    def city_page(self, page: int) -> dict:
+        start = (page - 1) * CITY_PAGE_SIZE
+        results = self.cities[start:start + CITY_PAGE_SIZE]
+        last_page = max(1, math.ceil(len(self.cities) / CITY_PAGE_SIZE))
+        return {
+            'success': True,
+            'results': results,
+            'meta': {
+                'current_page': page,
+                'per_page': CITY_PAGE_SIZE,
+                'has_more_pages': page < last_page,
+                'total': len(self.cities),
+                'last_page': last_page,
+            },
+        }
+
+    def city_stores(self, city_uuid: str) -> list[dict]:
+        """Магазины города (кешируются: их немного и они одинаковы для всех товаров)"""
+        stores = self._stores.get(city_uuid)
+        if stores is None:
+            rng = random.Random(_stable_hash(self.seed, 'stores', city_uuid))
+            stores = []
+            for n in range(rng.randint(5, 40)):
+                stores.append({
+                    'uuid': str(uuid.uuid5(uuid.NAMESPACE_URL, f'alkoteka-store:{city_uuid}:{n}')),
+                    'title': f'ул. {rng.choice(_STREETS)}, д. {rng.randint(1, 250)}',
+                    'phone': f'+7 (9{rng.randint(10, 99)}) {rng.randint(100, 999)}-{rng.randint(10, 99)}-'
+                             f'{rng.randint(10, 99)}',
+                    'opening_hours': f'{rng.choice(("08", "09", "10"))}:00-{rng.choice(("21", "22", "23"))}:00',
+                    'longitude': round(rng.uniform(37.0, 40.0), 6),
+                    'latitude': round(rng.uniform(43.0, 46.0), 6),
+                })
+            self._stores[city_uuid] = stores
+        return stores
+
+    # ---------- Товары ----------
+
+    def category_size(self, category: int) -> int:
+        n = len(self.categories)
+        return self.products // n + (1 if category < self.products % n else 0)
+
+    def listing_size(self, category: int) -> int:
+        """Количество товаров в листинге категории (свои + пересекающиеся)"""
+        size = self.category_size(category)
+        if self.overlap_step:
+            size += math.ceil(self.category_size((category - 1) % len(self.categories)) / self.overlap_step)
+        return size
+
+    def listing_index(self, category: int, position: int) -> int:
+        """Индекс товара на позиции position листинга категории"""
+        n = len(self.categories)
+        own = self.category_size(category)
+        if position < own:
+            return category + n * position
+        return (category - 1) % n + n * (position - own) * self.overlap_step
+
+    def product_slug(self, index: int) -> str:
+        return f'tovar-{index}'
+
+    def product_index(self, slug: str) -> int | None:
+        try:
+            index = int(slug.rsplit('-', 1)[-1])
+        except ValueError:
+            return None
+        return index if 0 <= index < self.products else None
+
+    def _static(self, index: int) -> dict:
+        """Не зависящие от города атрибуты товара"""
+        rng = random.Random(_stable_hash(self.seed, 'product', index))
+        category_slug, category_name = self.categories[index % len(self.categories)]
+        volume = rng.choice(_VOLUMES)
+        kind = rng.choice(_KINDS)
+        name = f'{kind} {rng.choice(_NAMES)} {index}'
+        # Примерно у половины товаров объем указан в названии, у остальных - только в filter_labels
+        if rng.random() < 0.5:
+            name = f'{name}, {volume:g} л'
+        return {
+            'rng': rng,
+            'category_slug': category_slug,
+            'category_name': category_name,
+            'volume': volume,
+            'kind': kind,
+            'name': name,
+            'base_price': rng.randint(90, 9000),
+        }
+
+    def _city_price(self, index: int, static: dict, city_uuid: str) -> tuple[float, float | None, int]:
+        rng = random.Random(_stable_hash(self.seed, 'price', index, city_uuid))
+        price = float(round(static['base_price'] * rng.uniform(0.9, 1.1)))
+        roll = rng.random()
+        if roll < 0.3:
+            prev_price = float(round(price * rng.uniform(1.05, 1.5)))
+        elif roll < 0.9:
+            prev_price = price
+        else:
+            prev_price = None
+        quantity = 0 if rng.random() < 0.15 else rng.randint(1, 300)
+        return price, prev_price, quantity
+
+    def _listing_row(self, index: int, city_uuid: str) -> dict:
+        static = self._static(index)
+        rng = static['rng']
+        slug = self.product_slug(index)
+        price, prev_price, quantity = self._city_price(index, static, city_uuid)
+        labels = rng.sample(_LABELS, rng.randint(0, 2))
+        return {
+            'uuid': str(uuid.uuid5(uuid.NAMESPACE_URL, f'alkoteka-product:{index}')),
+            'name': static['name'],
+            'slug': slug,
+            'vendor_code': 100000 + index,
+            'subname': None,
+            'price': price,
+            'prev_price': prev_price,
+            'quantity_total': quantity,
+            'available': quantity > 0,
+            'image_url': f'https://web.alkoteka.com/resize/350_500/product/{slug}.png',
+            'product_url': f'https://alkoteka.com/product/{static["category_slug"]}/{slug}',
+            'action_labels': [{'title': label, 'color': '#ff0000'} for label in labels],
+            'filter_labels': [{'filter': 'obem', 'title': f'{static["volume"]:g} л'}],
+            'category': {'slug': static['category_slug'], 'name': static['category_name']},
+        }
+
+    def product_page(self, category_slug: str, page: int, per_page: int, city_uuid: str) -> dict | None:
+        category = self.category_index.get(category_slug)
+        if category is None:
+            return None
+
+        per_page = max(1, min(per_page, self.max_per_page))
+        size = self.listing_size(category)
+        last_page = max(1, math.ceil(size / per_page))
+        start = (page - 1) * per_page
+        results = [self._listing_row(self.listing_index(category, position), city_uuid)
+                   for position in range(start, min(start + per_page, size))]
+
+        meta = {
+            'current_page': page,
+            'per_page': per_page,
+            'has_more_pages': page < last_page,
+        }
+        if self.expose_total:
+            meta['total'] = size
+            meta['last_page'] = last_page
+        return {'success': True, 'results': results, 'meta': meta}
+
+    def product_detail(self, slug: str, city_uuid: str) -> dict | None:
+        index = self.product_index(slug)
+        if index is None:
+            return None
+
+        row = self._listing_row(index, city_uuid)
+        static = self._static(index)
+        rng = static['rng']
+
+        description_blocks = [
+            {'code': 'brend', 'title': 'Бренд', 'values': _values([rng.choice(_NAMES)])},
+            {'code': 'obem', 'title': 'Объем', 'min': static['volume'], 'max': static['volume'], 'unit': 'л'},
+            {'code': 'strana', 'title': 'Страна', 'values': _values([rng.choice(_COUNTRIES)])},
+            {'code': 'proizvoditel', 'title': 'Производитель', 'values': _values([f'{rng.choice(_NAMES)} ООО'])},
+            {'code': 'vid-upakovki', 'title': 'Вид упаковки', 'values': _values([rng.choice(_PACKAGES)])},
+        ]
+        if static['kind'] in ('Вино', 'Коньяк', 'Виски', 'Ром', 'Джин', 'Водка', 'Ликер'):
+            strength = rng.choice((11, 12, 13, 14, 40, 43))
+            description_blocks += [
+                {'code': 'krepost', 'title': 'Крепость', 'min': strength, 'max': strength, 'unit': '%'},
+                {'code': 'region', 'title': 'Регион', 'values': _values(rng.sample(_REGIONS, rng.randint(1, 2)))},
+                {'code': 'vid', 'title': 'Вид', 'values': _values([static['kind']])},
+            ]
+        if static['kind'] == 'Вино':
+            description_blocks += [
+                {'code': 'cvet', 'title': 'Цвет', 'values': _values([rng.choice(_COLORS)])},
+                {'code': 'soderzanie-saxara', 'title': 'Сахар', 'values': _values([rng.choice(_SUGAR)])},
+                {'code': 'sortovoi-sostav', 'title': 'Сортовой состав',
+                 'values': _values(rng.sample(_GRAPES, rng.randint(1, 3)))},
+                {'code': 'temperatura-podaci', 'title': 'Температура подачи',
+                 'values': _values([rng.randint(8, 12), rng.randint(14, 18)]), 'unit': '°C'},
+            ]
+        if static['kind'] in ('Коньяк', 'Виски', 'Ром'):
+            description_blocks += [
+                {'code': 'prodolzitelnost-vyderzki', 'title': 'Выдержка',
+                 'values': _values([f'{rng.choice((3, 5, 12, 18))} лет'])},
+                {'code': 'emkost-vyderzki', 'title': 'Емкость выдержки',
+                 'values': _values(rng.sample(_CONTAINERS, rng.randint(1, 2)))},
+            ]
+        if static['kind'] == 'Водка':
+            description_blocks.append({'code': 'filtration', 'title': 'Фильтрация', 'values': _values(['Уголь'])})
+        if rng.random() < 0.1:
+            description_blocks.append({'code': 'podarocnaya-upakovka', 'title': 'Подарочная упаковка',
+                                       'values': _values(['Да'])})
+        if rng.random() < 0.05:
+            description_blocks.append({'code': 'ves', 'title': 'Вес', 'min': 500, 'max': 500, 'unit': 'г'})
+
+        text_blocks = []
+        if rng.random() < 0.9:
+            content = ' '.join(rng.choice(_WORDS) for _ in range(rng.randint(40, 200)))
+            text_blocks.append({'title': 'Описание', 'content': f' {content.capitalize()}. '})
+        if rng.random() < 0.3:
+            text_blocks.append({'title': 'Дегустационные характеристики', 'content': rng.choice(_WORDS)})
+
+        gastronomics = None
+        if rng.random() < 0.6:
+            gastronomics = {}
+            for key, title in rng.sample(_GASTRONOMICS, rng.randint(1, len(_GASTRONOMICS))):
+                gastronomics[key] = [{'title': title, 'image': f'https://web.alkoteka.com/g/{key}.png'}]
+
+        # Наличие в магазинах зависит от города
+        stock_rng = random.Random(_stable_hash(self.seed, 'stock', index, city_uuid))
+        stores = []
+        if row['quantity_total']:
+            city_stores = self.city_stores(city_uuid)
+            for store in stock_rng.sample(city_stores, stock_rng.randint(1, len(city_stores))):
+                stores.append(dict(store, price=row['price'], quantity=stock_rng.randint(1, 30)))
+
+        filter_labels = list(row['filter_labels'])
+        if static['kind'] == 'Вино':
+            filter_labels.append({'filter': 'cvet', 'title': rng.choice(_COLORS)})
+
+        detail = dict(row)
+        detail.update({
+            'subname': f'{rng.choice(_NAMES)} Reserve' if rng.random() < 0.4 else None,
+            'category': {
+                'slug': f'{static["category_slug"]}-sub',
+                'name': static['kind'],
+                'parent': {'slug': static['category_slug'], 'name': static['category_name']},
+            },
+            'filter_labels': filter_labels,
+            'description_blocks': description_blocks,
+            'text_blocks': text_blocks,
+            'gastronomics': gastronomics,
+            'availability': {'stores': stores},
+        })
+        return {'success': True, 'results': detail}
+
+
+def add_catalog_arguments(parser: argparse.ArgumentParser):
+    """Параметры стенда, общие для server и run"""
+    parser.add_argument('--products', type=int, default=1000, help='количество товаров в каталоге')
+    parser.add_argument('--cities', type=int, default=50, help='количество городов')
+    parser.add_argument('--max-per-page', type=int, default=100, help='максимальный per_page, принимаемый API')
+    parser.add_argument('--hide-total', action='store_true', help='не отдавать total/last_page в meta листинга')
+    parser.add_argument('--overlap', type=float, default=0.0,
+                        help='доля товаров категории, которые также есть в листинге следующей категории')
+    parser.add_argument('--latency', type=float, default=0.0, help='задержка ответа, сек')
+    parser.add_argument('--jitter', type=float, default=0.0, help='разброс задержки, ±сек')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='доля ответов 500')
+    parser.add_argument('--ban-rate', type=float, default=0.0, help='доля ответов-банов (HTML-страница)')
+    parser.add_argument('--ban-status', type=int, default=403, help='HTTP статус ответа-бана')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='доля ответов 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='значение Retry-After для 429, сек')
+    parser.add_argument('--seed', type=int, default=0)
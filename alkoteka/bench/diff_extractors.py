@@ -0,0 +1,198 @@
+"""Дифференциальная проверка сборки item: ProductsByCategoryExtractor против ItemLoader.
+
+Строки листинга и страницы товаров берутся из синтетического каталога стенда, часть из них
+случайно портится (пустые и отсутствующие значения, повторяющиеся блоки, пробелы и т.п.).
+Каждый товар собирается обоими способами - по странице товара и из сохраненных полей
+(ProductStateStore) - и результаты сравниваются вместе с классами item и порядком полей.
+
+Пример:
+    python -m bench.diff_extractors --products 20000
+"""
+import argparse
+import copy
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
+
+import scrapy
+from itemadapter import ItemAdapter
+
+from .catalog import DEFAULT_CATEGORIES, SyntheticCatalog
+
+
+def canonical(value):
+    """Значение с классами item/контейнеров и порядком полей"""
+    if isinstance(value, (scrapy.Item, dict)):
+        return type(value).__name__, [(key, canonical(val)) for key, val in value.items()]
+    if isinstance(value, list):
+        return 'list', [canonical(val) for val in value]
+    return type(value).__name__, value
+
+
+def _spaced(value):
+    return f'  {value}\t' if isinstance(value, str) else value
+
+
+def _block_with(block: dict, **changes) -> dict:
+    return {**block, **changes}
+
+
+def mutate_listing(rng: random.Random, row: dict) -> dict:
+    row = copy.deepcopy(row)
+    choice = rng.randrange(6)
+    if choice == 0:
+        row['action_labels'] = []
+    elif choice == 1:
+        row['name'] = _spaced(row['name'])
+    elif choice == 2:
+        row['name'] = rng.choice((None, '', '   '))
+    elif choice == 3:
+        row['product_url'] = _spaced(row['product_url'])
+    elif choice == 4:
+        row['action_labels'] = [{'title': None}, {'title': ' НОВИНКА '}]
+    return row
+
+
+def mutate_detail(rng: random.Random, data: dict) -> dict:
+    data = copy.deepcopy(data)
+    for _ in range(rng.randint(1, 4)):
+        choice = rng.randrange(16)
+        blocks = data['description_blocks']
+        if choice == 0:
+            data['price'] = rng.choice((None, 0, 0.0, 199))
+        elif choice == 1:
+            data['prev_price'] = rng.choice((None, 0, 250.0))
+        elif choice == 2:
+            data['quantity_total'] = rng.choice((None, 0, 0.0, 7.0))
+        elif choice == 3:
+            data['image_url'] = rng.choice((None, '', '   ', _spaced(data['image_url'])))
+        elif choice == 4:
+            data['subname'] = rng.choice((None, '', '  ', ' Reserve '))
+        elif choice == 5:
+            data['text_blocks'] = rng.choice((None, [], [{'title': 'ОПИСАНИЕ', 'content': None}],
+                                              [{'title': 'Описание', 'content': '   '}],
+                                              [{'title': 'Описание', 'content': ' a '},
+                                               {'title': 'описание', 'content': ' b '}]))
+        elif choice == 6 and blocks:
+            # Повторный блок: для списков значения объединяются, для остальных берется первый
+            block = rng.choice(blocks)
+            if 'values' in block:
+                block = _block_with(block, values=[{'name': 'Еще одно'}, *block['values']])
+            else:
+                block = _block_with(block, min=0, max=0)
+            blocks.insert(rng.randrange(len(blocks) + 1), block)
+        elif choice == 7 and blocks:
+            index = rng.randrange(len(blocks))
+            if 'values' in blocks[index]:
+                blocks[index] = _block_with(blocks[index], values=[])
+        elif choice == 8:
+            data['description_blocks'] = [block for block in blocks if block['code'] != 'brend']
+        elif choice == 9:
+            blocks.insert(0, {'code': 'brend', 'values': rng.choice(([], [{'name': '  '}],
+                                                                      [{'name': 'A'}, {'name': 'B'}]))})
+        elif choice == 10 and blocks:
+            block = rng.choice(blocks)
+            block['code'] = block['code'].upper()
+        elif choice == 11:
+            blocks.append({'code': 'neizvestnyi-blok', 'values': [{'name': 'x'}]})
+        elif choice == 12:
+            data['gastronomics'] = rng.choice(({}, {'meat': []}, None))
+        elif choice == 13:
+            data['availability'] = {'stores': []}
+        elif choice == 14:
+            data['filter_labels'] = []
+        elif choice == 15:
+            if data['vendor_code'] is not None:
+                data['vendor_code'] = rng.choice((None, str(data['vendor_code'])))
+    return data
+
+
+def make_spider():
+    """Паук с настройками стенда: нужен только для методов сборки item"""
+    links = Path(tempfile.mkdtemp(prefix='alkoteka-diff-')) / 'links.txt'
+    links.write_text(f'https://alkoteka.com/catalog/{DEFAULT_CATEGORIES[0][0]}', encoding='utf-8')
+    os.environ['SCRAPY_SETTINGS_MODULE'] = 'bench.settings'
+    os.environ['ALKOTEKA_BENCH_LINKS'] = str(links)
+
+    from alkoteka.spiders.products_by_category import ProductsByCategorySpider
+    return ProductsByCategorySpider()
+
+
+def build(spider, extractor, row: dict, data: dict, city_name: str, stored: dict | None):
+    spider.extractor = extractor
+    listing = spider.load_listing(row, city_name)
+    if stored is not None:
+        return spider.load_item(listing, stored)
+    if extractor is not None:
+        return extractor.item(listing, extractor.detail_fields(data))
+    return spider.load_product_details(listing, data)
+
+
+def stored_detail(item) -> dict:
+    """Поля страницы товара в том виде, в котором их возвращает ProductStateStore.lookup"""
+    from alkoteka.state import ProductStateStore
+
+    item_dict = ItemAdapter(item).asdict()
+    detail = {field: item_dict[field] for field in ProductStateStore.DETAIL_FIELDS if field in item_dict}
+    return json.loads(json.dumps(detail, ensure_ascii=False))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=5000, help='количество товаров для сравнения')
+    parser.add_argument('--cities', type=int, default=3, help='количество городов')
+    parser.add_argument('--mutate', type=float, default=0.5, help='доля испорченных товаров')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    spider = make_spider()
+    extractor = spider.extractor
+    catalog = SyntheticCatalog(products=args.products, cities=args.cities, seed=args.seed)
+    rng = random.Random(args.seed)
+
+    mismatches = 0
+    elapsed = {'loaders': 0.0, 'compiled': 0.0}
+    # Одинаковый timestamp у обоих способов
+    with mock.patch('time.time', return_value=1_700_000_000.5):
+        for index in range(args.products):
+            city = catalog.cities[index % len(catalog.cities)]
+            slug = catalog.product_slug(index)
+            row = catalog._listing_row(index, city['uuid'])
+            data = catalog.product_detail(slug, city['uuid'])['results']
+            if rng.random() < args.mutate:
+                row = mutate_listing(rng, row)
+                data = mutate_detail(rng, data)
+
+            started = time.perf_counter()
+            expected = build(spider, None, row, data, city['name'], None)
+            elapsed['loaders'] += time.perf_counter() - started
+            started = time.perf_counter()
+            actual = build(spider, extractor, row, data, city['name'], None)
+            elapsed['compiled'] += time.perf_counter() - started
+
+            stored = stored_detail(expected)
+            cases = (
+                ('detail', expected, actual),
+                ('stored', build(spider, None, row, data, city['name'], stored),
+                 build(spider, extractor, row, data, city['name'], stored)),
+            )
+            for case, left, right in cases:
+                if canonical(left) != canonical(right):
+                    mismatches += 1
+                    if mismatches <= 5:
+                        print(f'Расхождение ({case}) для {slug}:\n  loaders:  {canonical(left)}\n'
+                              f'  compiled: {canonical(right)}', file=sys.stderr)
+
+    per_item = {name: round(value / args.products * 1_000_000, 1) for name, value in elapsed.items()}
+    print(f'Товаров: {args.products}, расхождений: {mismatches}')
+    print(f'Сборка item, мкс/товар: loaders={per_item["loaders"]} compiled={per_item["compiled"]}')
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
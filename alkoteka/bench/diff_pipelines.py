@@ -0,0 +1,120 @@
+"""Дифференциальная проверка ProcessFieldsPipeline против цепочки
+FormatingFieldsPipeline -> ValidateFieldsPipeline -> RenameFieldsPipeline.
+
+Items собираются из синтетического каталога стенда (часть строк листинга и страниц товаров
+испорчена так же, как в bench.diff_extractors, часть items не проходит валидацию). Каждый item
+обрабатывается обоими способами - с RENAME_PATTERN из настроек и без переименования - и
+результаты (или ошибки) сравниваются вместе с классами item и порядком полей.
+
+Пример:
+    python -m bench.diff_pipelines --products 20000
+"""
+import argparse
+import copy
+import logging
+import random
+import sys
+import time
+from unittest import mock
+
+from .catalog import SyntheticCatalog
+from .diff_extractors import build, canonical, make_spider, mutate_detail, mutate_listing
+
+
+def mutate_item(rng: random.Random, item):
+    """Значения, которые форматирование или валидация обрабатывают отдельно"""
+    choice = rng.randrange(6)
+    if choice == 0:
+        item['price_data']['sale_tag'] = rng.choice(('', None, '15', '150', 'abc'))
+    elif choice == 1:
+        item['section'] = rng.choice(([], ['Вино', 'Красное 0,75л'], ['1л', '0.5 л']))
+    elif choice == 2:
+        item['title'] = rng.choice(('Вино 0.75 л', None, ''))
+    elif choice == 3:
+        item['variants'] = rng.choice((None, -1, 2))
+    elif choice == 4:
+        item['marketing_tags'] = None
+    return item
+
+
+def run_chain(pipelines, item, spider):
+    try:
+        for pipeline in pipelines:
+            item = pipeline.process_item(item, spider)
+    except Exception as e:
+        return e
+    return item
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=5000, help='количество товаров для сравнения')
+    parser.add_argument('--cities', type=int, default=3, help='количество городов')
+    parser.add_argument('--mutate', type=float, default=0.5, help='доля испорченных товаров')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    from scrapy.utils.project import get_project_settings
+
+    from alkoteka.pipelines import (FormatingFieldsPipeline, ProcessFieldsPipeline, RenameFieldsPipeline,
+                                    ValidateFieldsPipeline)
+
+    spider = make_spider()
+    settings = get_project_settings()
+    # Ошибки валидации ожидаемы, в выводе они не нужны
+    logging.getLogger(spider.name).setLevel(logging.CRITICAL)
+
+    cases = {}
+    for case, rename_pattern in (('rename', settings.getdict('RENAME_PATTERN')), ('no rename', {})):
+        case_settings = settings.copy()
+        case_settings.set('RENAME_PATTERN', rename_pattern)
+        fused = ProcessFieldsPipeline(rename_pattern)
+        fused.open_spider(spider)
+        cases[case] = (case_settings, [FormatingFieldsPipeline(), ValidateFieldsPipeline(), RenameFieldsPipeline()],
+                       [fused])
+
+    catalog = SyntheticCatalog(products=args.products, cities=args.cities, seed=args.seed)
+    rng = random.Random(args.seed)
+
+    mismatches = errors = 0
+    elapsed = {'chain': 0.0, 'fused': 0.0}
+    with mock.patch('time.time', return_value=1_700_000_000.5):
+        for index in range(args.products):
+            city = catalog.cities[index % len(catalog.cities)]
+            slug = catalog.product_slug(index)
+            row = catalog._listing_row(index, city['uuid'])
+            data = catalog.product_detail(slug, city['uuid'])['results']
+            if rng.random() < args.mutate:
+                row = mutate_listing(rng, row)
+                data = mutate_detail(rng, data)
+            item = build(spider, spider.extractor, row, data, city['name'], None)
+            if rng.random() < args.mutate:
+                item = mutate_item(rng, item)
+
+            for case, (case_settings, chain, fused) in cases.items():
+                spider.settings = case_settings
+                results = {}
+                for name, pipelines in (('chain', chain), ('fused', fused)):
+                    # Pipelines изменяют вложенные словари item на месте
+                    item_copy = copy.deepcopy(item)
+                    started = time.perf_counter()
+                    result = run_chain(pipelines, item_copy, spider)
+                    elapsed[name] += time.perf_counter() - started
+                    results[name] = ('error', type(result).__name__) if isinstance(result, Exception) \
+                        else canonical(result)
+                errors += results['chain'][0] == 'error'
+                if results['chain'] != results['fused']:
+                    mismatches += 1
+                    if mismatches <= 5:
+                        print(f'Расхождение ({case}) для {slug}:\n  chain: {results["chain"]}\n'
+                              f'  fused: {results["fused"]}', file=sys.stderr)
+
+    runs = args.products * len(cases)
+    per_item = {name: round(value / runs * 1_000_000, 1) for name, value in elapsed.items()}
+    print(f'Товаров: {args.products}, прогонов: {runs}, ошибок валидации: {errors}, расхождений: {mismatches}')
+    print(f'Pipelines, мкс/item: chain={per_item["chain"]} fused={per_item["fused"]}')
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
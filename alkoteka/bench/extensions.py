@@ -0,0 +1,144 @@
+import json
+import resource
+import time
+from pathlib import Path
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Перцентиль q (0..100) методом ближайшего ранга"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(q / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+class BenchStatsExtension:
+    """Сбор метрик бенчмарка: items/sec, задержка request->item, пиковый RSS.
+
+    Задержка request->item считается от постановки в очередь запроса, ответ на который
+    породил item (для ProductsByCategorySpider - запрос /product/<slug>), до сигнала item_scraped.
+    """
+
+    META_KEY = 'bench_scheduled_at'
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.started_at = None
+        self.first_item_at = None
+        self.finished_at = None
+        self.latencies: list[float] = []
+        self.peak_pending = 0
+        self.report = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        ext = cls(crawler)
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.request_scheduled, signal=signals.request_scheduled)
+        crawler.signals.connect(ext.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(ext.engine_stopped, signal=signals.engine_stopped)
+        crawler.bench_stats = ext
+        return ext
+
+    def spider_opened(self, spider):
+        self.started_at = time.perf_counter()
+
+    def request_scheduled(self, request, spider):
+        # setdefault: повторы (retry) сохраняют время первой постановки
+        request.meta.setdefault(self.META_KEY, time.perf_counter())
+        # Размер очереди планировщика (frontier) - по счетчикам Scrapy
+        stats = self.crawler.stats
+        pending = stats.get_value('scheduler/enqueued', 0) - stats.get_value('scheduler/dequeued', 0)
+        self.peak_pending = max(self.peak_pending, pending)
+
+    def item_scraped(self, item, response, spider):
+        now = time.perf_counter()
+        if self.first_item_at is None:
+            self.first_item_at = now
+        scheduled_at = response.meta.get(self.META_KEY) if response is not None else None
+        if scheduled_at is not None:
+            self.latencies.append(now - scheduled_at)
+
+    def spider_closed(self, spider, reason):
+        self.finished_at = time.perf_counter()
+        elapsed = self.finished_at - (self.started_at or self.finished_at)
+        stats = self.crawler.stats.get_stats()
+        items = stats.get('item_scraped_count', 0)
+
+        self.report = {
+            'finish_reason': reason,
+            'items': items,
+            'elapsed_sec': round(elapsed, 3),
+            'items_per_sec': round(items / elapsed, 2) if elapsed else 0.0,
+            'time_to_first_item_sec': round(self.first_item_at - self.started_at, 3) if self.first_item_at else None,
+            'latency_p50_ms': round(percentile(self.latencies, 50) * 1000, 1),
+            'latency_p99_ms': round(percentile(self.latencies, 99) * 1000, 1),
+            # ru_maxrss в Linux - в килобайтах
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            'peak_pending_requests': self.peak_pending,
+            'requests': stats.get('downloader/request_count', 0),
+            'responses_by_status': {
+                key.rsplit('/', 1)[-1]: value for key, value in stats.items()
+                if key.startswith('downloader/response_status_count/')
+            },
+            'item_dropped': stats.get('item_dropped_count', 0),
+            'spider_exceptions': stats.get('spider_exceptions/count', 0),
+            # Очереди планировщика: disk - запросы сериализуются в JOBDIR, unserializable - не удалось
+            'scheduler': {
+                key.split('/', 1)[-1]: value for key, value in stats.items()
+                if key.startswith('scheduler/enqueued/') or key == 'scheduler/unserializable'
+            },
+        }
+
+    def engine_stopped(self):
+        # Статистика прокси публикуется middleware при закрытии паука - после spider_closed расширения
+        stats = self.crawler.stats.get_stats()
+        self.report['proxy_pool'] = {
+            key.split('/', 1)[-1]: value for key, value in stats.items() if key.startswith('proxy_pool/')
+        }
+
+
+class StartupProbeExtension:
+    """Замер запуска (bench.startup): время этапов от старта процесса до первого запроса.
+
+    После первого запроса, дошедшего до загрузчика, паук закрывается; время этапов (time.time())
+    пишется в BENCH_STARTUP_PATH при остановке движка.
+    """
+
+    def __init__(self, crawler, path: str):
+        self.crawler = crawler
+        self.path = path
+        self.marks = {'crawler': time.time()}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get('BENCH_STARTUP_PATH')
+        if not path:
+            raise NotConfigured()
+        ext = cls(crawler, path)
+        crawler.signals.connect(ext.engine_started, signal=signals.engine_started)
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.request_reached_downloader, signal=signals.request_reached_downloader)
+        crawler.signals.connect(ext.engine_stopped, signal=signals.engine_stopped)
+        return ext
+
+    def engine_started(self):
+        self.marks['engine'] = time.time()
+
+    def spider_opened(self, spider):
+        self.marks['spider_opened'] = time.time()
+
+    def request_reached_downloader(self, request, spider):
+        if 'first_request' in self.marks:
+            return
+        self.marks['first_request'] = time.time()
+        self.crawler.engine.close_spider(spider, 'startup_probe')
+
+    def engine_stopped(self):
+        self.marks['engine_stopped'] = time.time()
+        Path(self.path).write_text(json.dumps(self.marks), encoding='utf-8')
@@ -0,0 +1,80 @@
+"""Локальные HTTP прокси для стенда: у каждого прокси своя задержка и доля банов.
+
+Нужны для проверки выбора прокси (ProxyPoolDownloaderMiddleware): медленный или банящий прокси
+в пуле должен получать меньше запросов и не определять хвост задержки всего сбора.
+
+Пример:
+    python -m bench.proxies --latency 0,0,0,0.5 --ban-rate 0,0,0.2,0
+"""
+import argparse
+import random
+
+from twisted.internet import reactor
+from twisted.web import http, proxy
+
+from .server import BAN_PAGE
+
+
+class BenchProxyRequest(proxy.ProxyRequest):
+    """Запрос к прокси: бан (403 с HTML) или передача стенду после задержки прокси"""
+
+    def process(self):
+        factory = self.channel.factory
+        factory.requests += 1
+        if factory.rng.random() < factory.ban_rate:
+            self.setResponseCode(403)
+            self.setHeader(b'Content-Type', b'text/html; charset=utf-8')
+            self.write(BAN_PAGE.encode('utf-8'))
+            self.finish()
+            return
+        reactor.callLater(factory.latency, self._forward)
+
+    def _forward(self):
+        # Клиент мог закрыть соединение, пока запрос "задерживался"
+        if self.finished or self.channel is None:
+            return
+        super().process()
+
+
+class BenchProxy(proxy.Proxy):
+    requestFactory = BenchProxyRequest
+
+
+def proxy_factory(latency: float, ban_rate: float, seed: int) -> http.HTTPFactory:
+    factory = http.HTTPFactory()
+    factory.protocol = BenchProxy
+    factory.noisy = False
+    factory.latency = latency
+    factory.ban_rate = ban_rate
+    factory.rng = random.Random(seed)
+    factory.requests = 0
+    return factory
+
+
+def _floats(raw: str) -> list[float]:
+    return [float(value) for value in raw.split(',')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--latency', type=_floats, required=True,
+                        help='задержка каждого прокси, сек, через запятую (количество прокси)')
+    parser.add_argument('--ban-rate', type=_floats, help='доля банов каждого прокси через запятую')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    ban_rates = args.ban_rate or [0.0] * len(args.latency)
+    ports = []
+    for index, latency in enumerate(args.latency):
+        ban_rate = ban_rates[index] if index < len(ban_rates) else 0.0
+        port = reactor.listenTCP(0, proxy_factory(latency, ban_rate, args.seed + index), interface=args.host)
+        ports.append(str(port.getHost().port))
+
+    # Первая строка stdout читается bench.run для получения портов
+    print(f'LISTENING {" ".join(ports)}', flush=True)
+    reactor.run()
+
+
+if __name__ == '__main__':
+    main()
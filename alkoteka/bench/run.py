@@ -0,0 +1,246 @@
+"""Бенчмарк пропускной способности паука products_by_category на локальном стенде.
+
+Поднимает bench.server в отдельном процессе, запускает ProductsByCategorySpider с настройками
+проекта (bench.settings) и выводит items/sec, p50/p99 задержки request->item, пиковый RSS
+и пиковый размер очереди планировщика.
+
+Примеры:
+    python -m bench.run smoke
+    python -m bench.run cpu --products 100000 --set CONCURRENT_REQUESTS=64
+    python -m bench.run cpu --param EXTRACTOR=loaders
+    python -m bench.run latency --proxies 0,0,0,0.5 --proxy-ban-rate 0,0,0.1,0
+    python -m bench.run all --json bench_output.json
+    python -m bench.run cpu --workers 4 --page-stripes 2 --city all --feed out.jsonl
+    python -m bench.run large --port 8765 --set JOBDIR='"jobs/large"'   # повторный запуск продолжает сбор
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import urllib.request
+from pathlib import Path
+
+from .catalog import DEFAULT_CATEGORIES, add_catalog_arguments
+
+
+# Снятие ограничений скорости проекта - для измерения потолка по CPU
+UNTHROTTLED = {
+    'DOWNLOAD_DELAY': 0,
+    'CONCURRENT_REQUESTS': 32,
+    'CONCURRENT_REQUESTS_PER_DOMAIN': 32,
+    'PROXY_THROTTLE_ENABLED': False,
+    # Общий предел launcher.py обязателен, но не достигается
+    'RATE_BUDGET_PER_DOMAIN': 1_000_000,
+}
+
+# Сценарии: параметры стенда + ограничения запуска + переопределения настроек
+SCENARIOS = {
+    # Настройки проекта как есть (DOWNLOAD_DELAY, CONCURRENT_REQUESTS_PER_DOMAIN)
+    'smoke': {'products': 200, 'max_items': 20, 'timeout': 180, 'settings': {}},
+    # Сеть без задержек - упор в CPU паука, middlewares и pipelines
+    'cpu': {'products': 20_000, 'max_items': 5_000, 'timeout': 600, 'settings': UNTHROTTLED},
+    # Сетевая задержка как у боевого API
+    'latency': {'products': 20_000, 'latency': 0.1, 'jitter': 0.05, 'max_items': 3_000, 'timeout': 600,
+                'settings': UNTHROTTLED},
+    # Ошибки сервера, баны и 429
+    'faults': {'products': 20_000, 'error_rate': 0.02, 'ban_rate': 0.02, 'throttle_rate': 0.02,
+               'max_items': 3_000, 'timeout': 600, 'settings': UNTHROTTLED},
+    # Каталог на миллион товаров
+    'large': {'products': 1_000_000, 'max_items': 20_000, 'timeout': 1200, 'settings': UNTHROTTLED},
+}
+
+SERVER_ARGS = ('products', 'cities', 'max_per_page', 'hide_total', 'overlap', 'latency', 'jitter', 'error_rate',
+               'ban_rate', 'ban_status', 'throttle_rate', 'retry_after', 'seed')
+
+
+def parse_setting(raw: str) -> tuple[str, object]:
+    key, _, value = raw.partition('=')
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+def start_server(config: dict) -> tuple[subprocess.Popen, str]:
+    cmd = [sys.executable, '-m', 'bench.server', '--port', str(config.get('port', 0))]
+    for name in SERVER_ARGS:
+        value = config.get(name)
+        if value is None or value is False:
+            continue
+        flag = '--' + name.replace('_', '-')
+        cmd += [flag] if value is True else [flag, str(value)]
+
+    proc = subprocess.Popen(cmd, cwd=Path(__file__).parent.parent, stdout=subprocess.PIPE, text=True)
+    line = proc.stdout.readline().strip()
+    if not line.startswith('LISTENING '):
+        proc.kill()
+        raise RuntimeError(f'Стенд не запустился: {line!r}')
+    return proc, f'http://127.0.0.1:{line.split()[1]}'
+
+
+def start_proxies(config: dict) -> tuple[subprocess.Popen, list[str]]:
+    """Локальные прокси bench.proxies (--proxies: задержка каждого прокси через запятую)"""
+    cmd = [sys.executable, '-m', 'bench.proxies', '--latency', str(config['proxies'])]
+    if config.get('proxy_ban_rate'):
+        cmd += ['--ban-rate', str(config['proxy_ban_rate'])]
+    proc = subprocess.Popen(cmd, cwd=Path(__file__).parent.parent, stdout=subprocess.PIPE, text=True)
+    line = proc.stdout.readline().strip()
+    if not line.startswith('LISTENING '):
+        proc.kill()
+        raise RuntimeError(f'Прокси стенда не запустились: {line!r}')
+    return proc, [f'http://127.0.0.1:{port}' for port in line.split()[1:]]
+
+
+def server_stats(base_url: str) -> dict:
+    try:
+        with urllib.request.urlopen(f'{base_url}/__stats__', timeout=5) as response:
+            return json.load(response)
+    except OSError:
+        return {}
+
+
+def run_scenario(name: str, config: dict, overrides: dict, params: dict, city: str | None,
+                 feed: str | None) -> dict:
+    workdir = Path(tempfile.mkdtemp(prefix='alkoteka-bench-'))
+    links = workdir / 'links.txt'
+    links.write_text('\n'.join(f'https://alkoteka.com/catalog/{slug}' for slug, _ in DEFAULT_CATEGORIES),
+                     encoding='utf-8')
+
+    proc, base_url = start_server(config)
+    proxies_proc = None
+    try:
+        if config.get('proxies'):
+            proxies_proc, proxies = start_proxies(config)
+            (workdir / 'proxies.txt').write_text('\n'.join(proxies), encoding='utf-8')
+            os.environ['ALKOTEKA_BENCH_PROXIES'] = str(workdir / 'proxies.txt')
+        os.environ['SCRAPY_SETTINGS_MODULE'] = 'bench.settings'
+        os.environ['ALKOTEKA_BENCH_URL'] = base_url
+        os.environ['ALKOTEKA_BENCH_LINKS'] = str(links)
+        os.environ['ALKOTEKA_BENCH_PARAMS'] = json.dumps(params)
+
+        from scrapy.crawler import CrawlerProcess
+        from scrapy.utils.project import get_project_settings
+
+        settings = get_project_settings()
+        cmdline = {**config.get('settings', {}), **overrides}
+        cmdline['CITY_PARTITION_DIR'] = str(workdir / 'cities')
+        for key, path in (('STORES_TABLE_PATH', 'stores.json'), ('PRODUCT_STATIC_CACHE_PATH', 'static.sqlite3'),
+                          ('METRICS_PATH', 'metrics.prom'), ('CITY_CACHE_PATH', 'cities.json'),
+                          ('BROWSER_HEADERS_CACHE_PATH', 'headers.json'), ('DEAD_LETTER_PATH', 'dead_letter.jsonl'),
+                          ('PRODUCT_STATE_PATH', 'state.sqlite3')):
+            if key not in overrides:
+                cmdline[key] = str(workdir / path)
+        cmdline['CLOSESPIDER_TIMEOUT'] = config.get('timeout', 0)
+        feed_path = feed if feed is not None else str(workdir / 'output.json')
+
+        if config.get('workers'):
+            # Сбор в несколько процессов (alkoteka.launcher): CLOSESPIDER_ITEMCOUNT действовал бы в каждом шарде
+            from alkoteka.launcher import parse_page_stripes, run
+
+            for key, value in cmdline.items():
+                settings.set(key, value, priority='cmdline')
+            default_stripes, page_stripes = parse_page_stripes(config.get('page_stripes') or [])
+            city = city or settings.getdict('PARSING_PARAMS')['products_by_category']['DEFAULT_CITY_NAME']
+            summary = run(settings, feed_path or str(workdir / 'output.jsonl'), city,
+                          config['workers'], page_stripes, default_stripes, config.get('cities_per_shard'),
+                          overrides=cmdline, workdir=workdir / 'shards', keep_shards=True)
+            return {'scenario': name, 'finish_reason': 'failed' if summary['failed_shards'] else 'finished',
+                    **summary, 'server': server_stats(base_url)}
+
+        cmdline['EXTENSIONS'] = {**settings.getdict('EXTENSIONS'), 'bench.extensions.BenchStatsExtension': 0}
+        cmdline['CLOSESPIDER_ITEMCOUNT'] = config.get('max_items', 0)
+        if feed_path:
+            cmdline['FEEDS'] = {feed_path: {'format': 'json', 'overwrite': True}}
+        for key, value in cmdline.items():
+            settings.set(key, value, priority='cmdline')
+
+        process = CrawlerProcess(settings)
+        crawler = process.create_crawler('products_by_category')
+        process.crawl(crawler, **({'city': city} if city else {}))
+        process.start()
+
+        report = {'scenario': name, **crawler.bench_stats.report, 'server': server_stats(base_url)}
+    finally:
+        for child in (proc, proxies_proc):
+            if child is not None:
+                child.terminate()
+                child.wait(timeout=10)
+    return report
+
+
+def format_report(report: dict) -> str:
+    lines = [f'== {report["scenario"]} ({report["finish_reason"]})']
+    for key in ('items', 'elapsed_sec', 'items_per_sec', 'time_to_first_item_sec', 'latency_p50_ms',
+                'latency_p99_ms', 'peak_rss_mb', 'peak_pending_requests', 'requests', 'responses_by_status', 'item_dropped',
+                'spider_exceptions', 'scheduler', 'proxy_pool', 'workers', 'shards', 'failed_shards',
+                'merged_duplicates', 'server'):
+        if key not in report:
+            continue
+        lines.append(f'  {key:<24} {report.get(key)}')
+    return '\n'.join(lines)
+
+
+def run_all(names: list[str], passthrough: list[str]) -> list[dict]:
+    """Каждый сценарий - в отдельном процессе (реактор Twisted нельзя перезапустить)"""
+    reports = []
+    for name in names:
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as tmp:
+            output = tmp.name
+        subprocess.run([sys.executable, '-m', 'bench.run', name, '--json', output, *passthrough],
+                       cwd=Path(__file__).parent.parent, check=False)
+        try:
+            reports.append(json.loads(Path(output).read_text(encoding='utf-8')))
+        except ValueError:
+            reports.append({'scenario': name, 'finish_reason': 'failed'})
+        os.unlink(output)
+    return reports
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('scenario', choices=[*SCENARIOS, 'all'])
+    add_catalog_arguments(parser)
+    parser.add_argument('--max-items', type=int, help='остановить после N items (CLOSESPIDER_ITEMCOUNT)')
+    parser.add_argument('--timeout', type=int, help='остановить через N секунд (CLOSESPIDER_TIMEOUT)')
+    parser.add_argument('--city', help='город для сбора (-a city=...)')
+    parser.add_argument('--port', type=int, help='порт стенда (постоянный - для продолжения сбора с JOBDIR)')
+    parser.add_argument('--proxies', help='запросы через локальные прокси: задержка каждого, сек, через запятую')
+    parser.add_argument('--proxy-ban-rate', help='доля банов каждого локального прокси через запятую')
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                        help='переопределить настройку Scrapy (значение разбирается как JSON)')
+    parser.add_argument('--param', action='append', default=[], metavar='NAME=VALUE',
+                        help='переопределить параметр паука из PARSING_PARAMS (значение разбирается как JSON)')
+    parser.add_argument('--workers', type=int, help='сбор в N процессах через alkoteka.launcher')
+    parser.add_argument('--page-stripes', action='append', metavar='N|SLUG=N',
+                        help='делить страницы категорий на N шардов (с --workers)')
+    parser.add_argument('--cities-per-shard', type=int, help='городов в шарде (с --workers)')
+    parser.add_argument('--feed', help='файл выгрузки items; пустая строка - без выгрузки')
+    parser.add_argument('--json', help='сохранить отчет в файл')
+    # Явно не указанные параметры стенда берутся из сценария
+    for action in parser._actions:
+        if action.dest not in ('scenario', 'set', 'param', 'help'):
+            action.default = argparse.SUPPRESS
+    args = vars(parser.parse_args(argv))
+
+    if args['scenario'] == 'all':
+        passthrough = [arg for arg in (argv if argv is not None else sys.argv[1:]) if arg != 'all']
+        passthrough = [arg for arg in passthrough if arg != '--json' and arg != args.get('json')]
+        reports = run_all(list(SCENARIOS), passthrough)
+    else:
+        config = {**SCENARIOS[args['scenario']], **args}
+        overrides = dict(parse_setting(raw) for raw in args['set'])
+        params = dict(parse_setting(raw) for raw in args['param'])
+        reports = [run_scenario(args['scenario'], config, overrides, params, args.get('city'), args.get('feed'))]
+
+    for report in reports:
+        print(format_report(report) if 'items' in report else f'== {report["scenario"]} failed')
+
+    if args.get('json'):
+        data = reports if args['scenario'] == 'all' else reports[0]
+        Path(args['json']).write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding='utf-8')
+
+
+if __name__ == '__main__':
+    main()
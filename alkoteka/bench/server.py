@@ -0,0 +1,164 @@
+"""Локальный стенд web-api alkoteka.com на Twisted.
+
+Имитирует:
+    /web-api/v1/city?city_uuid=...&page=N
+    /web-api/v1/product?city_uuid=...&page=N&per_page=M&root_category_slug=...
+    /web-api/v1/product/<slug>?city_uuid=...
+
+Поддерживает задержку ответа, ошибки сервера, ответы-баны (HTML вместо JSON) и 429 с Retry-After.
+Служебный /__stats__ отдает счетчики запросов стенда.
+
+Пример:
+    python -m bench.server --port 8765 --products 1000000 --latency 0.05 --error-rate 0.01
+"""
+import argparse
+import json
+import random
+import sys
+from collections import Counter
+
+from twisted.internet import reactor
+from twisted.web import resource, server
+
+from .catalog import SyntheticCatalog, add_catalog_arguments
+
+
+API_PREFIX = b'/web-api/v1/'
+
+BAN_PAGE = ('<!DOCTYPE html><html><head><title>Доступ ограничен</title></head>'
+            '<body><h1>Подозрительная активность</h1><p>Подтвердите, что вы не робот.</p></body></html>')
+
+
+class AlkotekaApiResource(resource.Resource):
+    """Обработчик всех запросов стенда"""
+
+    isLeaf = True
+
+    def __init__(self, catalog: SyntheticCatalog, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, ban_rate: float = 0.0, ban_status: int = 403,
+                 throttle_rate: float = 0.0, retry_after: int = 1, seed: int = 0):
+        super().__init__()
+        self.catalog = catalog
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.ban_rate = ban_rate
+        self.ban_status = ban_status
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.stats = Counter()
+
+    def render_GET(self, request):
+        path = request.path
+        if path == b'/__stats__':
+            return self._json(request, 200, dict(self.stats))
+
+        if not path.startswith(API_PREFIX):
+            self.stats['not_found'] += 1
+            return self._json(request, 404, {'success': False, 'message': 'Not found'})
+
+        endpoint = path[len(API_PREFIX):].decode('utf-8').strip('/')
+        kind = 'city' if endpoint == 'city' else 'listing' if endpoint == 'product' else 'detail'
+        self.stats[f'{kind}_requests'] += 1
+
+        status, body, headers = self._fault(kind)
+        if status is None:
+            status, body = self._handle(endpoint, request)
+
+        delay = self.latency + (self.rng.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+        if delay <= 0:
+            return self._finish_now(request, status, body, headers)
+
+        reactor.callLater(delay, self._finish_later, request, status, body, headers)
+        return server.NOT_DONE_YET
+
+    def _fault(self, kind: str):
+        """Выбор искусственного сбоя для запроса (или None - отвечать нормально)"""
+        roll = self.rng.random()
+        if roll < self.error_rate:
+            self.stats[f'{kind}_errors'] += 1
+            return 500, b'<html><body>500 Internal Server Error</body></html>', {b'Content-Type': b'text/html'}
+        roll -= self.error_rate
+        if roll < self.ban_rate:
+            self.stats[f'{kind}_bans'] += 1
+            return self.ban_status, BAN_PAGE.encode('utf-8'), {b'Content-Type': b'text/html; charset=utf-8'}
+        roll -= self.ban_rate
+        if roll < self.throttle_rate:
+            self.stats[f'{kind}_throttled'] += 1
+            return 429, b'Too Many Requests', {b'Retry-After': str(self.retry_after).encode()}
+        return None, None, None
+
+    def _handle(self, endpoint: str, request) -> tuple[int, bytes]:
+        args = {key.decode(): values[-1].decode() for key, values in request.args.items()}
+        city_uuid = args.get('city_uuid', '')
+
+        try:
+            page = int(args.get('page', 1))
+            per_page = int(args.get('per_page', 20))
+        except ValueError:
+            return 422, self._dump({'success': False, 'message': 'Invalid pagination'})
+
+        if endpoint == 'city':
+            data = self.catalog.city_page(page)
+        elif endpoint == 'product':
+            data = self.catalog.product_page(args.get('root_category_slug', ''), page, per_page, city_uuid)
+        elif endpoint.startswith('product/'):
+            data = self.catalog.product_detail(endpoint.split('/', 1)[1], city_uuid)
+        else:
+            data = None
+
+        if data is None:
+            self.stats['not_found'] += 1
+            return 404, self._dump({'success': False, 'message': 'Not found'})
+        return 200, self._dump(data)
+
+    @staticmethod
+    def _dump(data) -> bytes:
+        return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+    def _json(self, request, status: int, data):
+        return self._finish_now(request, status, self._dump(data), None)
+
+    def _finish_now(self, request, status: int, body: bytes, headers):
+        request.setResponseCode(status)
+        request.setHeader(b'Content-Type', b'application/json')
+        for key, value in (headers or {}).items():
+            request.setHeader(key, value)
+        self.stats[f'status_{status}'] += 1
+        return body
+
+    def _finish_later(self, request, status: int, body: bytes, headers):
+        # Клиент мог закрыть соединение, пока ответ "задерживался"
+        if request.finished or request.channel is None:
+            return
+        request.write(self._finish_now(request, status, body, headers))
+        request.finish()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765, help='0 - выбрать свободный порт')
+    add_catalog_arguments(parser)
+    args = parser.parse_args(argv)
+
+    catalog = SyntheticCatalog(products=args.products, cities=args.cities, seed=args.seed,
+                               expose_total=not args.hide_total, max_per_page=args.max_per_page,
+                               overlap=args.overlap)
+    api = AlkotekaApiResource(catalog, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                              ban_rate=args.ban_rate, ban_status=args.ban_status,
+                              throttle_rate=args.throttle_rate, retry_after=args.retry_after, seed=args.seed)
+    site = server.Site(api)
+    site.noisy = False
+    port = reactor.listenTCP(args.port, site, interface=args.host)
+
+    # Первая строка stdout читается bench.run для получения порта
+    print(f'LISTENING {port.getHost().port}', flush=True)
+
+    reactor.run()
+    print(json.dumps(dict(api.stats), ensure_ascii=False), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+# Настройки проекта для запуска паука против локального стенда (bench.server)
+#
+# Подключаются через SCRAPY_SETTINGS_MODULE=bench.settings (это делает bench.run),
+# поэтому и паук (get_project_settings()), и краулер видят одинаковые значения.
+# Адрес стенда и файл ссылок передаются через переменные окружения.
+
+import copy
+import json
+import os
+import pathlib
+
+from alkoteka.settings import *  # noqa: F401,F403
+from alkoteka.settings import PARSING_PARAMS as _PROJECT_PARSING_PARAMS
+
+
+BENCH_URL = os.environ.get('ALKOTEKA_BENCH_URL', 'http://127.0.0.1:8765')
+
+PARSING_PARAMS = copy.deepcopy(_PROJECT_PARSING_PARAMS)
+PARSING_PARAMS['products_by_category'].update({
+    'CITY_URL': f'{BENCH_URL}/web-api/v1/city?city_uuid=396df2b5-7b2b-11eb-80cd-00155d039009',
+    'PRODUCT_URL': f'{BENCH_URL}/web-api/v1/product',
+})
+# Переопределение параметров паука (bench.run --param NAME=VALUE): паук читает их из настроек краулера
+PARSING_PARAMS['products_by_category'].update(json.loads(os.environ.get('ALKOTEKA_BENCH_PARAMS') or '{}'))
+
+URLS_FILENAME = pathlib.Path(os.environ.get('ALKOTEKA_BENCH_LINKS', PROJECT_DIR_PATH / 'links.txt'))  # noqa: F405
+
+# Стенд работает на 127.0.0.1, а allowed_domains паука - alkoteka.com
+DOWNLOADER_MIDDLEWARES = {
+    **DOWNLOADER_MIDDLEWARES,  # noqa: F405
+    'scrapy.downloadermiddlewares.offsite.OffsiteMiddleware': None,
+}
+
+# Прокси из proxies.txt не имеют доступа к локальному стенду (bench.run --proxies - локальные прокси стенда)
+PROXY_POOL_LIST_PATH = os.environ.get('ALKOTEKA_BENCH_PROXIES') or None
+PROXY_POOL_LIST = []
+
+# Замер запуска (bench.startup): файл времени этапов до первого запроса
+BENCH_STARTUP_PATH = os.environ.get('ALKOTEKA_BENCH_STARTUP') or None
+if BENCH_STARTUP_PATH:
+    EXTENSIONS = {**EXTENSIONS, 'bench.extensions.StartupProbeExtension': 0}  # noqa: F405
+
+TELNETCONSOLE_ENABLED = False
+LOG_LEVEL = 'INFO'
@@ -0,0 +1,122 @@
+"""Бенчмарк запуска: время от старта процесса `scrapy crawl products_by_category` до первого запроса.
+
+Поднимает bench.server, запускает паука в отдельных процессах (как короткие задания по расписанию)
+и выводит медианное время этапов от старта процесса:
+    crawler        - импорты, настройки и создание паука (создание расширений краулера)
+    spider_opened  - созданы middlewares и pipelines, паук открыт
+    engine         - движок запущен
+    first_request  - первый запрос дошел до загрузчика (после него паук закрывается)
+    engine_stopped - паук закрыт, движок остановлен
+    exit           - процесс завершился
+Запуски cold - без артефактов прошлых запусков (кеш списка городов, запас заголовков браузера),
+warm - с артефактами предыдущего запуска.
+
+Примеры:
+    python -m bench.startup
+    python -m bench.startup --runs 10 --set PRODUCT_STATE_ENABLED=true
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from .catalog import DEFAULT_CATEGORIES
+from .run import parse_setting, start_server
+
+STAGES = ('crawler', 'spider_opened', 'engine', 'first_request', 'engine_stopped', 'exit')
+
+# Артефакты, которые переживают запуск (удаляются перед каждым cold запуском)
+WARM_PATHS = {
+    'CITY_CACHE_PATH': 'cities.json',
+    'BROWSER_HEADERS_CACHE_PATH': 'headers.json',
+}
+
+# Файлы запуска - во временной папке, а не в output проекта
+RUN_PATHS = {
+    'STORES_TABLE_PATH': 'stores.json',
+    'PRODUCT_STATIC_CACHE_PATH': 'static.sqlite3',
+    'PRODUCT_STATE_PATH': 'state.sqlite3',
+    'METRICS_PATH': 'metrics.prom',
+    'DEAD_LETTER_PATH': 'dead_letter.jsonl',
+    'SNAPSHOT_PATH': 'snapshots.sqlite3',
+}
+
+
+def run_once(workdir: Path, overrides: dict) -> dict:
+    """Один запуск паука; время этапов от старта процесса, сек"""
+    marks_path = workdir / 'marks.json'
+    marks_path.unlink(missing_ok=True)
+    cmd = [sys.executable, '-m', 'scrapy', 'crawl', 'products_by_category', '-s', 'LOG_LEVEL=WARNING']
+    for key, value in overrides.items():
+        cmd += ['-s', f'{key}={value if isinstance(value, str) else json.dumps(value)}']
+    env = {**os.environ, 'ALKOTEKA_BENCH_STARTUP': str(marks_path)}
+
+    started = time.time()
+    proc = subprocess.run(cmd, cwd=Path(__file__).parent.parent, env=env, capture_output=True, text=True)
+    finished = time.time()
+    if not marks_path.exists():
+        raise RuntimeError(f'Паук не дошел до первого запроса:\n{proc.stderr[-2000:]}')
+    marks = json.loads(marks_path.read_text(encoding='utf-8'))
+    marks['exit'] = finished
+    return {stage: marks[stage] - started for stage in STAGES if stage in marks}
+
+
+def summarize(runs: list[dict]) -> dict:
+    return {stage: {'median_ms': round(statistics.median(run[stage] for run in runs) * 1000, 1),
+                    'min_ms': round(min(run[stage] for run in runs) * 1000, 1)}
+            for stage in STAGES if all(stage in run for run in runs)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='запусков каждого вида (cold, warm)')
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                        help='переопределить настройку Scrapy (значение разбирается как JSON)')
+    parser.add_argument('--json', help='сохранить отчет в файл')
+    args = parser.parse_args(argv)
+
+    workdir = Path(tempfile.mkdtemp(prefix='alkoteka-startup-'))
+    links = workdir / 'links.txt'
+    links.write_text('\n'.join(f'https://alkoteka.com/catalog/{slug}' for slug, _ in DEFAULT_CATEGORIES),
+                     encoding='utf-8')
+    warm_dir = workdir / 'warm'
+    overrides = {key: str(workdir / name) for key, name in RUN_PATHS.items()}
+    overrides.update({key: str(warm_dir / name) for key, name in WARM_PATHS.items()})
+    overrides.update(dict(parse_setting(raw) for raw in args.set))
+
+    proc, base_url = start_server({'products': 200})
+    os.environ['SCRAPY_SETTINGS_MODULE'] = 'bench.settings'
+    os.environ['ALKOTEKA_BENCH_URL'] = base_url
+    os.environ['ALKOTEKA_BENCH_LINKS'] = str(links)
+    try:
+        # Первый запуск не учитывается: прогрев кеша файловой системы и .pyc
+        run_once(workdir, overrides)
+        # Запуски cold и warm чередуются: колебания нагрузки машины одинаково влияют на оба вида
+        runs = {'cold': [], 'warm': []}
+        for _ in range(args.runs):
+            shutil.rmtree(warm_dir, ignore_errors=True)
+            runs['cold'].append(run_once(workdir, overrides))
+            runs['warm'].append(run_once(workdir, overrides))
+        report = {kind: summarize(kind_runs) for kind, kind_runs in runs.items()}
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for kind, stages in report.items():
+        print(f'== {kind} (мс от старта процесса, медиана / минимум)')
+        for stage, value in stages.items():
+            print(f'  {stage:<16} {value["median_ms"]:>8} / {value["min_ms"]}')
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding='utf-8')
+
+
+if __name__ == '__main__':
+    main()